@@ -7,8 +7,12 @@ from galois import FieldArray
 from linicrypt_solver.field import GF
 
 
-# TODO flesh out interface and add make constraints work with both types of constraints simultaneously
+# TODO flesh out interface
 class Constraint(ABC):
+    # Constraints with different nonces query independent oracles, so they can
+    # never be collapsed into each other. None is the oracle shared by everyone.
+    nonce: object = None
+
     def difference_matrix(self, other: Self) -> FieldArray:
         fixing_self = self.fixing_matrix()
         fixing_other = other.fixing_matrix()
@@ -35,8 +39,15 @@ class Constraint(ABC):
     def is_proper(self, fixed_constraints: list[Self]) -> bool:
         pass
 
+    @abstractmethod
+    def is_determined(self, fixing: FieldArray) -> bool:
+        # Whether the values in fixing already decide what is queried
+        pass
+
     def __eq__(self, other) -> bool:
-        assert type(other) is type(self)
+        # Programs can mix random oracle and ideal cipher queries
+        if type(other) is not type(self):
+            return False
         return (self.fixing_matrix() == other.fixing_matrix()).all()
 
     @abstractmethod
@@ -64,5 +75,6 @@ DualVector = list[int] | FieldArray | np.ndarray
 
 
 def main():
-    # TODO impleement and add to scripts in pyproject
-    pass
+    from linicrypt_solver.cli import main
+
+    main()
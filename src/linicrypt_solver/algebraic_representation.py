@@ -1,12 +1,32 @@
 import numpy as np
 from galois import FieldArray
 from loguru import logger
-from typing import Iterator
+from typing import Iterable, Iterator
 
+from dataclasses import dataclass
+from functools import cached_property
 from enum import Enum
 
+from linicrypt_solver import trace
+from linicrypt_solver.distinct_nonces import (
+    find_shared_queries,
+    has_distinct_nonces,
+    shared_partition,
+)
 from linicrypt_solver.field import GF
-from linicrypt_solver.solvable import Constraints, Partition
+from linicrypt_solver.partition import Antichain, BlockPartition
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.search import BestFirstSearch
+from linicrypt_solver.solvable import (
+    Constraints,
+    Coverage,
+    Partition,
+    PartitionSource,
+    PartitionsSeparating,
+    PartitionWalk,
+    SolvableStats,
+    VerdictCache,
+)
 from linicrypt_solver.utils import stack_matrices, embed_left, embed_right
 
 SimpleAttack = tuple[Partition, FieldArray, Constraints]
@@ -20,8 +40,10 @@ class PartitionCompare(Enum):
 
 
 def compare_partitions(partition_a, partition_b) -> PartitionCompare:
-    a_finer_b = is_finer(partition_a, partition_b)
-    b_finer_a = is_finer(partition_b, partition_a)
+    block_a = BlockPartition.from_list(partition_a)
+    block_b = BlockPartition.from_list(partition_b)
+    a_finer_b = block_a.is_finer(block_b)
+    b_finer_a = block_b.is_finer(block_a)
     if a_finer_b and b_finer_a:
         return PartitionCompare.EQUAL
     elif a_finer_b:
@@ -37,27 +59,13 @@ def is_subset(set_a, set_b):
 
 
 def is_finer(partition_a, partition_b) -> bool:
-    return all(
-        any(is_subset(set_a, set_b) for set_b in partition_b) for set_a in partition_a
-    )
+    block_a = BlockPartition.from_list(partition_a)
+    return block_a.is_finer(BlockPartition.from_list(partition_b))
 
 
 def join(partition_a: Partition, partition_b: Partition) -> Partition:
-    equiv_classes = []
-    all_subsets = partition_a + partition_b
-    for set_a in all_subsets:
-        union_class_a = set(set_a)
-        for set_b in all_subsets:
-            a = set(set_a)
-            b = set(set_b)
-            if len(a.intersection(b)) > 0:
-                union_class_a = union_class_a.union(b)
-        logger.info(f"Unionc class {union_class_a}")
-        equiv_classes.append(frozenset(union_class_a))
-
-    equiv_classes_set = frozenset(equiv_classes)
-    join = list(list(equiv_class) for equiv_class in equiv_classes_set)
-    return join
+    block_a = BlockPartition.from_list(partition_a)
+    return block_a.join(BlockPartition.from_list(partition_b)).to_list()
 
 
 def test_join():
@@ -107,15 +115,42 @@ class Attack:
         solution: Constraints,
     ):
         self.original_partition = partition
-        self.frozen_partition = frozenset(frozenset(subset) for subset in partition)
-        self.subspace = subspace
+        self._subspace = subspace
         self.fixing = fixing
         self.solution = solution
+        self._f: FieldArray | None = None
+        self._collapse: FieldArray | None = None
+
+    @staticmethod
+    def from_collapse(
+        partition: Partition,
+        f: FieldArray,
+        collapse: FieldArray,
+        fixing: FieldArray | None,
+        ordering: Constraints,
+    ) -> "Attack":
+        # Keeps what the enumeration already computed: the solution ordering of the
+        # collapsed constraints, and the subspace as the collapse of the partition
+        # in the coordinates of f. The product f @ collapse is only taken on access.
+        attack = Attack(partition, None, fixing, ordering)
+        attack._f = f
+        attack._collapse = collapse
+        return attack
 
     @property
     def partition(self):
         return self.original_partition
 
+    @property
+    def subspace(self) -> FieldArray | None:
+        if self._subspace is None and self._collapse is not None:
+            self._subspace = self._f @ self._collapse
+        return self._subspace
+
+    @cached_property
+    def block_partition(self) -> BlockPartition:
+        return BlockPartition.from_list(self.original_partition)
+
     def __repr__(self) -> str:
         lines = [
             f"partition:\n{self.original_partition}",
@@ -126,7 +161,7 @@ class Attack:
         return "\n".join(lines)
 
     def __key(self):
-        return self.frozen_partition
+        return self.block_partition
 
     def __hash__(self):
         return hash(self.__key())
@@ -140,35 +175,9 @@ class Attack:
 def maximal_attacks(attacks: Iterator[Attack]) -> list[Attack]:
     # If the partition is finer, the subspace is larger
     # partitions are only partially ordered, so we might have multiple maxima
-    maxima: list[Attack] = []
+    maxima: Antichain[Attack] = Antichain()
     for attack in attacks:
-        part = attack.partition
-        part_is_uncomparable = True
-        new_maxima = set()
-        for maximum_attack in maxima:
-            maximum_part = maximum_attack.partition
-            comparision = compare_partitions(part, maximum_part)
-            if comparision == PartitionCompare.FINER:
-                logger.debug(f"{part} is finer than some in {maxima}")
-                part_is_uncomparable = False
-                new_maxima.add(attack)
-            elif comparision == PartitionCompare.COARSER:
-                logger.debug(f"{part} is coarser than some in {maxima}")
-                part_is_uncomparable = False
-                new_maxima.add(maximum_attack)
-            elif comparision == PartitionCompare.EQUAL:
-                logger.debug(f"{part} is equal to some in {maxima}")
-                part_is_uncomparable = False
-                new_maxima.add(maximum_attack)
-            elif comparision == PartitionCompare.UNCOMPARABLE:
-                logger.debug(f"{part} is uncomparable to some in {maxima}")
-                new_maxima.add(maximum_attack)
-
-        if part_is_uncomparable:
-            logger.debug(f"{part} is umcomparable to all {maxima}")
-            new_maxima.add(attack)
-
-        maxima = list(new_maxima)
+        maxima.insert(attack.block_partition, attack)
     return list(maxima)
 
 
@@ -198,6 +207,95 @@ def test_maximal_attack():
     assert maximal_attacks(iter([a, b])) == [a]
 
 
+class Property(Enum):
+    CR = "collision resistance"
+    SPR = "second preimage resistance"
+
+
+class DecisionPath(Enum):
+    DISTINCT_NONCES = "distinct nonces"
+    ENUMERATION = "enumeration"
+
+
+@dataclass
+class CRDecision:
+    # None if no attack was found, but the search ran out of budget
+    is_resistant: bool | None
+    path: DecisionPath
+    # Partition of the joined constraints of some attack, if there is one
+    partition: Partition | None = None
+    # How much of the partitions were enumerated, None for the polynomial path
+    coverage: Coverage | None = None
+
+
+@dataclass
+class AttackSearch:
+    attacks: list[Attack]
+    coverage: Coverage
+
+
+@dataclass
+class JoinedProgram:
+    # Two executions of a program, restricted to the subspace of F^(2d) where
+    # their outputs agree. The columns of f are the basis of that subspace.
+    constraints: Constraints
+    f: FieldArray
+    # Both executions are the same on this subspace
+    preimage_S: FieldArray
+    # The input of the left execution in F^(2d), fixed for 2PR
+    left_input: FieldArray
+
+    def fixing(self, prop: Property) -> FieldArray:
+        if prop == Property.SPR:
+            return self.left_input @ self.f
+        return GF.Zeros((1, self.f.shape[1]))
+
+    def attack_fixing(self, prop: Property) -> FieldArray | None:
+        if prop == Property.SPR:
+            return self.left_input
+        return None
+
+    def determined(self) -> tuple[list[int], FieldArray]:
+        # The joined constraints whose queries are decided by the fixed left input,
+        # directly or through the answers of such constraints, and the row space
+        # of the fixed input together with all their values. For 2PR these are
+        # fixed random values of the left execution, so a collapse that imposes a
+        # linear relation on them (one that lowers the rank of the values) only
+        # works with negligible probability. In particular no two of those
+        # constraints can share a block, as they differ in some value.
+        cs = self.constraints.cs
+        values = self.fixing(Property.SPR).row_space()
+        determined: list[int] = []
+        found = True
+        while found:
+            found = False
+            for i, c in enumerate(cs):
+                if i not in determined and c.is_determined(values):
+                    determined.append(i)
+                    values = stack_matrices(values, c.fixing_matrix()).row_space()
+                    found = True
+        return sorted(determined), values
+
+    def fixed_values(self, prop: Property) -> FieldArray | None:
+        # The values a collapse must not relate for prop, see determined
+        if prop == Property.SPR:
+            return self.determined()[1]
+        return None
+
+    def attack(self, partition: Partition, prop: Property) -> Attack | None:
+        # Checks a single partition, for example one found by another process
+        collapses = self.constraints.solvable_collapses(
+            [partition],
+            self.preimage_S,
+            [self.fixing(prop)],
+            fixed=[self.fixed_values(prop)],
+        )
+        for part, subspace, orderings in collapses:
+            fixing = self.attack_fixing(prop)
+            return Attack.from_collapse(part, self.f, subspace, fixing, orderings[0])
+        return None
+
+
 class AlgebraicRep:
     def __init__(self, cs: Constraints, fixing: FieldArray, output: FieldArray):
         dim_cs = cs.dim()
@@ -260,15 +358,12 @@ class AlgebraicRep:
     def all_maximal_collision_attacks(self) -> list[Attack]:
         return maximal_attacks(self.list_collision_attacks())
 
-    def list_collision_attacks(self) -> Iterator[Attack]:
+    def joined(self) -> "JoinedProgram":
         S = stack_matrices(GF.Identity(self.dim()), GF.Identity(self.dim()))
         C_join = self.cs.construct_joined()
         dim = C_join.dim()
         output_collapse = embed_left(self.output, dim) - embed_right(self.output, dim)
-        # f = output_collapse.null_space().transpose()
         f = self.collapse_output_f()
-        # print(f)
-        # print(output_collapse)
         assert (output_collapse @ f == GF.Zeros((1, 1))).all()
 
         # Robust way to compute the preimage of S
@@ -284,59 +379,243 @@ class AlgebraicRep:
         # So each column of preimage_S is actually the preimage of each column of S
         assert (f @ preimage_S == S).all()
 
-        def is_outside_S(subspace):
-            W_plus = stack_matrices(S, subspace, axis=1).column_space()
-            assert len(W_plus) >= self.dim()
-            return len(W_plus) > self.dim()
-
-        C_joined_f = C_join.map(f)
-        subspaces_iter = C_joined_f.find_solvable_subspaces_outside(preimage_S)
-        for part, subspace in subspaces_iter:
-            logger.info("Found solvable subspace:")
-            logger.info(f"Partition of the constraints is {part}")
-            logger.info("Solvable subspace of F^(2d) is")
-            logger.info(f @ subspace)
-            logger.info("Solvable constraints in that subspace are")
-            collapsed_constraints = C_join.map(f @ subspace)
-            zero = GF.Zeros((1, collapsed_constraints.dim()))
-            solution = collapsed_constraints.find_solution_ordering(fixing=zero)
-            logger.info(solution)
-            assert solution is not None
-            assert is_outside_S(f @ subspace)
-            yield Attack(part, f @ subspace, None, C_join.map(f @ subspace))
-
-    def is_collision_resistant(self):
-        return any(True for _ in self.list_collision_attacks())
-
-    def list_second_preimage_attacks(self):
-        S = stack_matrices(GF.Identity(self.dim()), GF.Identity(self.dim()))
-        C_join = self.cs.construct_joined()
-        dim = C_join.dim()
-        output_collapse = embed_left(self.output, dim) - embed_right(self.output, dim)
-        f = output_collapse.null_space().transpose()
+        # For 2PR the input of the left execution is fixed
+        I_1 = embed_left(self.fixing, dim)
+        logger.debug("Left input is:\n{}", I_1)
+        return JoinedProgram(C_join.map(f), f, preimage_S, I_1)
 
-        # Robust way to compute the preimage of S
-        # Annihlator of S called S^0 are the dual vectors that are zero on S
-        S_0 = S.left_null_space()
-        # This is f^*(S^0)
-        f_pullback_S_0 = S_0 @ f
-        # We have f^-1(S) = f^*(S^0))^0. Because S is in the image of f, this f(f^-1(S)) = S
-        preimage_S = f_pullback_S_0.null_space().transpose()
-        assert (f @ preimage_S == S).all()
+    def analyze(
+        self,
+        properties: Iterable[Property] = (Property.CR, Property.SPR),
+        walk: PartitionSource | None = None,
+        verdicts: VerdictCache | None = None,
+    ) -> Iterator[tuple[Property, Attack]]:
+        # Builds the joined program once and walks the partitions of its
+        # constraints a single time, checking the fixing of every requested
+        # property on each collapse. CR comes first because 2PR fixes more.
+        # verdicts keeps the checks for later analyses of the same program.
+        properties = [p for p in Property if p in properties]
+        with trace.phase("join"):
+            joined = self.joined()
+        f = joined.f
+        subspaces_iter = joined.constraints.find_solvable_subspaces_outside_each(
+            joined.preimage_S,
+            [joined.fixing(p) for p in properties],
+            walk,
+            verdicts,
+            [joined.fixed_values(p) for p in properties],
+        )
+        for part, subspace, orderings in subspaces_iter:
+            for prop, ordering in zip(properties, orderings):
+                fixing = joined.attack_fixing(prop)
+                attack = Attack.from_collapse(part, f, subspace, fixing, ordering)
+                logger.info(f"Found solvable subspace for {prop.value}:")
+                logger.info(f"Partition of the constraints is {part}")
+                logger.opt(lazy=True).info(
+                    "Solvable subspace of F^(2d) is\n{}", lambda: attack.subspace
+                )
+                logger.opt(lazy=True).info(
+                    "Solvable constraints in that subspace are\n{}",
+                    lambda: attack.solution,
+                )
+                yield (prop, attack)
+
+    def count_attacks(
+        self, prop: Property = Property.CR, chunk: tuple[int, int] | None = None
+    ) -> SolvableStats:
+        # Statistics over the attacks of analyze without building any of them
+        joined = self.joined()
+        return joined.constraints.count_solvable_subspaces_outside(
+            joined.preimage_S, joined.fixing(prop), chunk, joined.fixed_values(prop)
+        )
 
-        I_1 = embed_left(self.fixing, dim)
-        logger.debug(f"Left input is:\n{I_1}")
-        I_1_f = I_1 @ f
-        logger.debug(f"Left input after pullback is:\n{I_1_f}")
+    def search_attacks(
+        self,
+        prop: Property = Property.CR,
+        deadline: float | None = None,
+        max_partitions: int | None = None,
+        start: int = 0,
+    ) -> AttackSearch:
+        # Anytime version of analyze: stops at the deadline (a time.monotonic()
+        # value) or after max_partitions and returns what it found so far
+        walk = PartitionWalk(deadline, max_partitions, start)
+        attacks = [attack for _, attack in self.analyze([prop], walk)]
+        return AttackSearch(attacks, walk.coverage())
+
+    def list_collision_attacks(self) -> Iterator[Attack]:
+        for _, attack in self.analyze(properties=[Property.CR]):
+            yield attack
 
-        C_joined_f = C_join.map(f)
-        subspaces_iter = C_joined_f.find_solvable_subspaces_outside(
-            preimage_S, fixing=I_1_f
+    def decide_collision_resistance(
+        self,
+        deadline: float | None = None,
+        max_partitions: int | None = None,
+        best_first: bool = False,
+        max_queue: int | None = None,
+    ) -> CRDecision:
+        # Use the polynomial criterion when the program is in its class and only
+        # fall back to enumerating all partitions of the joined constraints otherwise.
+        # If the enumeration runs out of budget before finding an attack, the
+        # decision is None and the coverage says how much was explored.
+        # best_first enumerates the most promising partitions first, which finds
+        # attacks much sooner, at the cost of a priority queue of up to
+        # max_queue partitions.
+        if has_distinct_nonces(self.cs):
+            logger.info("Deciding CR with the distinct nonces criterion")
+            shared = find_shared_queries(self.cs, self.output)
+            if shared is None:
+                return CRDecision(True, DecisionPath.DISTINCT_NONCES)
+            partition = shared_partition(shared, len(self.cs.cs))
+            return CRDecision(False, DecisionPath.DISTINCT_NONCES, partition)
+
+        logger.info("Deciding CR by enumerating partitions")
+        walk: PartitionWalk | BestFirstSearch
+        if best_first:
+            walk = BestFirstSearch(max_queue, deadline, max_partitions)
+        else:
+            walk = PartitionWalk(deadline, max_partitions)
+        attack = next((a for _, a in self.analyze([Property.CR], walk)), None)
+        coverage = walk.coverage()
+        if attack is not None:
+            path = DecisionPath.ENUMERATION
+            return CRDecision(False, path, attack.partition, coverage)
+        if coverage.complete:
+            return CRDecision(True, DecisionPath.ENUMERATION, coverage=coverage)
+        return CRDecision(None, DecisionPath.ENUMERATION, coverage=coverage)
+
+    def is_collision_resistant(
+        self,
+        deadline: float | None = None,
+        max_partitions: int | None = None,
+        best_first: bool = False,
+        max_queue: int | None = None,
+    ) -> bool | None:
+        decision = self.decide_collision_resistance(
+            deadline, max_partitions, best_first, max_queue
+        )
+        return decision.is_resistant
+
+    def second_preimage_attacks(self, prune: bool = True) -> Iterator[Attack]:
+        # The 2PR attacks of analyze, found by only enumerating partitions that
+        # keep the constraints determined by the left input apart (see
+        # JoinedProgram.determined), as any other collapse relates their values.
+        # With prune=False all partitions are walked, which gives the same attacks.
+        with trace.phase("join"):
+            joined = self.joined()
+        determined, values = joined.determined()
+        logger.info("Constraints {} are determined by the left input", determined)
+        walk = PartitionsSeparating(determined) if prune else PartitionWalk()
+        collapses = joined.constraints.find_solvable_subspaces_outside_each(
+            joined.preimage_S, [joined.fixing(Property.SPR)], walk, fixed=[values]
         )
-        for part, subspace in subspaces_iter:
-            logger.info(part)
-            logger.info(subspace)
-            yield (part, f @ subspace, C_join.map(f @ subspace))
+        for part, subspace, orderings in collapses:
+            yield Attack.from_collapse(
+                part, joined.f, subspace, joined.left_input, orderings[0]
+            )
+
+    def list_second_preimage_attacks(self) -> Iterator[SimpleAttack]:
+        for attack in self.second_preimage_attacks():
+            yield (attack.partition, attack.subspace, attack.solution)
+
+    def is_second_preimage_resistant(self) -> bool:
+        return not any(True for _ in self.list_second_preimage_attacks())
+
+
+def test_distinct_nonces_agrees_with_enumeration():
+    for output in ([[0, 0, 1, 1]], [[0, 1, 0, 1]], [[0, 0, 0, 1]], [[1, 0, 1, 0]]):
+        cs = Constraints(
+            [
+                ConstraintH([1, 0, 0, 0], [0, 0, 1, 0], nonce=1),
+                ConstraintH([0, 0, 1, 0], [0, 0, 0, 1], nonce=2),
+            ]
+        )
+        program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF(output))
+        decision = program.decide_collision_resistance()
+        assert decision.path == DecisionPath.DISTINCT_NONCES
+        enumerated = next(program.list_collision_attacks(), None)
+        assert decision.is_resistant == (enumerated is None)
+
 
-    def is_second_preimage_resistant(self):
-        return any(True for _ in self.list_second_preimage_attacks())
+def test_analyze_matches_single_property():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    both = list(program.analyze())
+    cr = [a for p, a in both if p == Property.CR]
+    spr = [a for p, a in both if p == Property.SPR]
+    assert cr == list(program.list_collision_attacks())
+    assert [a.partition for a in spr] == [
+        part for part, _, _ in program.list_second_preimage_attacks()
+    ]
+
+
+def test_count_attacks_in_chunks():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    stats = program.count_attacks()
+    assert stats.partitions == 15
+    assert stats.solvable == len(list(program.list_collision_attacks()))
+    chunks = [program.count_attacks(chunk=(i, 4)) for i in range(4)]
+    merged = chunks[0].merge(chunks[1]).merge(chunks[2]).merge(chunks[3])
+    assert merged == stats
+
+
+def test_search_attacks_with_budget():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    first = program.search_attacks(max_partitions=6)
+    assert first.coverage.explored == 6 and not first.coverage.complete
+    assert first.coverage.remaining() == [(6, 15)]
+    rest = program.search_attacks(start=first.coverage.stop)
+    assert rest.coverage.stop == 15
+    assert first.attacks + rest.attacks == list(program.list_collision_attacks())
+
+    decision = program.decide_collision_resistance(max_partitions=0)
+    assert decision.is_resistant is None
+    assert decision.coverage.fraction == 0.0
+
+
+def test_best_first_decision():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    decision = program.decide_collision_resistance(best_first=True)
+    assert decision.is_resistant is False
+    assert decision.coverage.explored <= 15
+
+
+def test_second_preimage_pruning():
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    program = PGVComporessionFunction(PGVParams(0, 0, 0, 1, 0, 1)).construct_MD(2)
+    determined, _ = program.joined().determined()
+    # The left copies of both calls
+    assert determined == [0, 1]
+
+    def blocks(attacks: Iterator[Attack]) -> list[Partition]:
+        return sorted(sorted(sorted(block) for block in a.partition) for a in attacks)
+
+    full = blocks(program.second_preimage_attacks(prune=False))
+    assert blocks(program.second_preimage_attacks()) == full
+    # Merging both left calls needs a relation between values that are fixed
+    # and random, so no entry point reports it
+    assert [[0, 1, 3], [2]] not in full
+    assert blocks(a for _, a in program.analyze([Property.SPR])) == full
+    listed = sorted(
+        sorted(sorted(block) for block in p)
+        for p, _, _ in program.list_second_preimage_attacks()
+    )
+    assert listed == full
+    joined = program.joined()
+    assert joined.attack([[0, 1, 3], [2]], Property.SPR) is None
+    assert program.count_attacks(Property.SPR).solvable == len(full)
@@ -0,0 +1,300 @@
+from itertools import combinations, pairwise
+from typing import Iterator
+
+import numpy as np
+from galois import FieldArray
+
+from linicrypt_solver.algebraic_representation import (
+    AlgebraicRep,
+    Attack,
+    JoinedProgram,
+    Property,
+)
+from linicrypt_solver.field import GF
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Partition, PartitionSource, PartitionWalk
+
+# Analysis of many programs whose joined constraints have the same types and
+# nonces and only differ in their coefficients, for example all PGV chains of
+# the same length. The partitions are walked once for the whole batch.
+#
+# Nothing is collapsed. Dual vectors V restricted to the collapse of a partition,
+# the kernel of its difference matrix D, have rank rank(V; D) - rank(D). So every
+# check of Constraints.solvable_collapses turns into comparing ranks of matrices
+# stacked with D in the joined coordinates, and batched_rank computes those for
+# all programs at once.
+
+
+def batched_rank(A: FieldArray) -> np.ndarray:
+    # Ranks of the matrices A[i], by Gaussian elimination of all of them in step
+    A = A.copy()
+    count, _, cols = A.shape
+    used = np.zeros(A.shape[:2], dtype=bool)
+    rank = np.zeros(count, dtype=int)
+    batch = np.arange(count)
+    for col in range(cols):
+        nonzero = (A[:, :, col] != 0) & ~used
+        has_pivot = nonzero.any(axis=1)
+        if not has_pivot.any():
+            continue
+        pivot = nonzero.argmax(axis=1)
+        pivot_rows = A[batch, pivot]
+        pivot_values = pivot_rows[:, col].copy()
+        pivot_values[~has_pivot] = 1
+        factors = A[:, :, col] / pivot_values[:, np.newaxis]
+        factors[batch, pivot] = 0
+        factors[~has_pivot] = 0
+        A -= factors[:, :, np.newaxis] * pivot_rows[:, np.newaxis, :]
+        used[batch[has_pivot], pivot[has_pivot]] = True
+        rank += has_pivot
+    return rank
+
+
+def ranks(*matrices: FieldArray) -> list[np.ndarray]:
+    # batched_rank of several batches of shape (programs, rows, dim) in one go,
+    # padded with zero rows to the same shape
+    rows = max(m.shape[1] for m in matrices)
+    padded = [np.pad(m, ((0, 0), (0, rows - m.shape[1]), (0, 0))) for m in matrices]
+    return np.split(batched_rank(GF(np.concatenate(padded))), len(matrices))
+
+
+def stack(*matrices: FieldArray) -> FieldArray:
+    return GF(np.concatenate(matrices, axis=1))
+
+
+def constraint_rows(c) -> np.ndarray:
+    # q, a, 0 for ConstraintH and x, k, y for ConstraintE
+    rows = c.fixing_matrix()
+    return np.pad(rows, ((0, 3 - len(rows)), (0, 0)))
+
+
+def structure(joined: JoinedProgram) -> tuple:
+    cs = joined.constraints.cs
+    kinds = tuple((type(c).__name__, c.nonce) for c in cs)
+    return (kinds, joined.f.shape, joined.left_input.shape)
+
+
+class ProgramBatch:
+    def __init__(
+        self, programs: list[AlgebraicRep], joined: list[JoinedProgram] | None = None
+    ):
+        if joined is None:
+            joined = [p.joined() for p in programs]
+        self.programs = programs
+        self.joined = joined
+        assert len({structure(j) for j in joined}) == 1, "different structures"
+        first = joined[0].constraints
+        self.constraints = first
+        self.kinds = [type(c) for c in first.cs]
+        self.nonces = [c.nonce for c in first.cs]
+
+        # (programs, constraints, 3, dim)
+        self.cs = GF(
+            np.stack(
+                [
+                    np.stack([constraint_rows(c) for c in j.constraints.cs])
+                    for j in joined
+                ]
+            )
+        )
+        # The annihilator of preimage_S: a collapse is outside of preimage_S iff
+        # these rows are not all in the row space of its difference matrix
+        annihilators = [j.preimage_S.left_null_space() for j in joined]
+        rows = max(len(a) for a in annihilators)
+        self.annihilator = GF(
+            np.stack([np.pad(a, ((0, rows - len(a)), (0, 0))) for a in annihilators])
+        )
+
+    def __len__(self) -> int:
+        return len(self.programs)
+
+    def fixing(self, prop: Property) -> FieldArray:
+        return GF(np.stack([j.fixing(prop) for j in self.joined]))
+
+    def fixed_values(self, prop: Property) -> FieldArray | None:
+        # JoinedProgram.fixed_values, padded with zero rows to the same shape
+        values = [j.fixed_values(prop) for j in self.joined]
+        if values[0] is None:
+            return None
+        rows = max(len(v) for v in values)
+        return GF(np.stack([np.pad(v, ((0, rows - len(v)), (0, 0))) for v in values]))
+
+    def difference(self, partition: Partition) -> FieldArray:
+        rows = [GF.Zeros((len(self), 1, self.cs.shape[-1]))]
+        for block in partition:
+            for i, j in pairwise(block):
+                rows.append(self.cs[:, i] - self.cs[:, j])
+        return stack(*rows)
+
+    def comparable(self, i: int, j: int) -> bool:
+        return self.kinds[i] is self.kinds[j] and self.nonces[i] == self.nonces[j]
+
+    def solvable(
+        self,
+        partition: Partition,
+        fixing: FieldArray,
+        fixed: FieldArray | None = None,
+    ) -> np.ndarray:
+        # For each program, whether the collapse of the partition is outside of
+        # preimage_S, keeps the rank of the fixed values, is proper, and is
+        # solvable with the fixing
+        n = len(self.kinds)
+        diff = self.difference(partition)
+        r_diff, r_outside = ranks(diff, stack(diff, self.annihilator))
+        active = r_outside > r_diff
+        if fixed is not None:
+            (r_fixed,) = ranks(stack(diff, fixed))
+            active &= r_fixed - r_diff == batched_rank(fixed)
+        if not active.any():
+            return active
+
+        def vanish(*vectors: FieldArray) -> list[np.ndarray]:
+            # Whether each batch of dual vectors is zero on the collapse
+            return [r == r_diff for r in ranks(*(stack(diff, v) for v in vectors))]
+
+        # Rows r of constraints i and j agree on the collapse
+        pairs = [(i, j) for i, j in combinations(range(n), 2) if self.comparable(i, j)]
+        vectors = [
+            self.cs[:, i, r : r + 1] - self.cs[:, j, r : r + 1]
+            for i, j in pairs
+            for r in range(3)
+        ]
+        vectors += [self.cs[:, i, 0:1] - self.cs[:, i, 2:3] for i in range(n)]
+        results = vanish(*vectors)
+        agree = {
+            (i, j, r): results[3 * p + r]
+            for p, (i, j) in enumerate(pairs)
+            for r in range(3)
+        }
+        # x = y on the collapse, for the fixed point solutions of ConstraintE
+        x_is_y = results[3 * len(pairs) :]
+
+        # Constraints equal on the collapse are identified, the first one stays
+        kept = np.zeros((len(self), n), dtype=bool)
+        for j in range(n):
+            duplicate = np.zeros(len(self), dtype=bool)
+            for i in range(j):
+                if (i, j, 0) not in agree:
+                    continue
+                equal = agree[i, j, 0] & agree[i, j, 1] & agree[i, j, 2]
+                duplicate |= kept[:, i] & equal
+            kept[:, j] = ~duplicate
+
+        # Constraints.is_proper on the kept constraints
+        for i, j in pairs:
+            if self.kinds[j] is ConstraintH:
+                improper = agree[i, j, 0]
+            else:
+                x, k, y = agree[i, j, 0], agree[i, j, 1], agree[i, j, 2]
+                improper = (x & k) | (k & y)
+                fixed_points = x_is_y[i] & x_is_y[j]
+                improper |= fixed_points & ((k & ~x) | (x & ~k))
+            active &= ~(kept[:, i] & kept[:, j] & improper)
+
+        # Constraints.find_solution_ordering: repeatedly take out the first
+        # constraint that is solvable given the fixing and all the others
+        remaining = kept & active[:, np.newaxis]
+        while remaining.any():
+            matrices = []
+            for i in range(n):
+                others = remaining.copy()
+                others[:, i] = False
+                rest = GF(np.where(others[:, :, np.newaxis, np.newaxis], self.cs, 0))
+                base = stack(diff, fixing, rest.reshape(len(self), -1, rest.shape[-1]))
+                c = self.cs[:, i]
+                if self.kinds[i] is ConstraintH:
+                    matrices += [stack(base, c[:, :1]), stack(base, c[:, :2])]
+                else:
+                    matrices += [
+                        stack(base, c),
+                        stack(base, c[:, :2]),
+                        stack(base, c[:, 1:]),
+                        stack(base, c[:, 1:2]),
+                    ]
+            results = iter(ranks(*matrices))
+            picked = np.zeros(len(self), dtype=bool)
+            for i in range(n):
+                if self.kinds[i] is ConstraintH:
+                    r_q, r_qa = next(results), next(results)
+                    solvable = r_qa > r_q
+                else:
+                    r_xky, r_xk, r_ky, r_k = (next(results) for _ in range(4))
+                    solvable = (r_xky > r_xk) | (r_xky > r_ky)
+                    solvable |= x_is_y[i] & (r_k < r_xky)
+                take = remaining[:, i] & solvable & ~picked
+                remaining[take, i] = False
+                picked |= take
+            stuck = remaining.any(axis=1) & ~picked
+            active &= ~stuck
+            remaining[stuck] = False
+        return active
+
+    def solvable_partitions(
+        self, prop: Property = Property.CR, walk: PartitionSource | None = None
+    ) -> Iterator[tuple[Partition, np.ndarray]]:
+        # The partitions that are attacks on some program of the batch, with the
+        # mask of those programs
+        if walk is None:
+            walk = PartitionWalk(progress=False)
+        fixing = self.fixing(prop)
+        fixed = self.fixed_values(prop)
+        for partition in walk.partitions(self.constraints):
+            if not self.constraints.respects_nonces(partition):
+                continue
+            mask = self.solvable(partition, fixing, fixed)
+            if mask.any():
+                yield (partition, mask)
+
+    def list_attacks(
+        self, prop: Property = Property.CR, walk: PartitionSource | None = None
+    ) -> list[list[Attack]]:
+        # The attacks on each program, built from the hits like analyze does
+        attacks: list[list[Attack]] = [[] for _ in range(len(self))]
+        for partition, mask in self.solvable_partitions(prop, walk):
+            for i in np.flatnonzero(mask):
+                attack = self.joined[i].attack(partition, prop)
+                assert attack is not None
+                attacks[i].append(attack)
+        return attacks
+
+
+def batch_by_structure(
+    programs: list[AlgebraicRep],
+) -> list[tuple[list[int], ProgramBatch]]:
+    # Groups the programs into batches, with the indices of their programs
+    joined = [p.joined() for p in programs]
+    groups: dict[tuple, list[int]] = {}
+    for i, j in enumerate(joined):
+        groups.setdefault(structure(j), []).append(i)
+    return [
+        (
+            indices,
+            ProgramBatch([programs[i] for i in indices], [joined[i] for i in indices]),
+        )
+        for indices in groups.values()
+    ]
+
+
+def test_batched_rank():
+    A = GF([[[1, 0, 1], [0, 1, 1], [1, 1, 0]], [[1, 2, 3], [2, 4, 6], [0, 0, 0]]])
+    assert list(batched_rank(A)) == [
+        np.linalg.matrix_rank(A[0]),
+        np.linalg.matrix_rank(A[1]),
+    ]
+
+
+def test_batch_agrees_with_analyze():
+    from itertools import product
+
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    programs = [
+        PGVComporessionFunction(PGVParams(*params)).construct_MD(2)
+        for params in list(product([0, 1], repeat=6))[::3]
+    ]
+    for prop in Property:
+        for indices, batch in batch_by_structure(programs):
+            attacks = batch.list_attacks(prop)
+            for i, found in zip(indices, attacks):
+                expected = [a for _, a in programs[i].analyze([prop])]
+                assert [a.partition for a in found] == [a.partition for a in expected]
@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from itertools import product
+from typing import Callable
+
+import galois
+import numpy as np
+from galois import FieldArray
+from loguru import logger
+
+from linicrypt_solver.algebraic_representation import (
+    AlgebraicRep,
+    Attack,
+    JoinedProgram,
+    Property,
+    maximal_attacks,
+)
+from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+from linicrypt_solver.sampling import sample_partition
+from linicrypt_solver.service import warm_up
+from linicrypt_solver.solvable import Constraints, Partition, PartitionWalk
+
+# Benchmarks of the solver, written as JSON so that two runs can be compared:
+#
+#   python -m linicrypt_solver.bench run --out before.json
+#   python -m linicrypt_solver.bench run --out after.json
+#   python -m linicrypt_solver.bench compare before.json after.json
+#
+# Each stage is set up untimed, run `repeats` times for the wall time and once
+# more under tracemalloc for the peak memory. Stages that enumerate partitions
+# also report partitions per second. Everything random is seeded, and the field
+# kernels are compiled before the first stage.
+#
+# Analysing all 64 PGV chains at n >= 3 takes hours, so by default those stages
+# use every 8th parameter set and at most 100 partitions per chain, --full runs
+# all of them to the end.
+
+ALL_PARAMS = [PGVParams(*p) for p in product([0, 1], repeat=6)]
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # Untimed, returns the state that run gets
+    setup: Callable[[], object]
+    # Returns the number of partitions it visited, None if that doesn't apply
+    run: Callable[[object], int | None]
+    repeats: int = 3
+
+
+def analyze_all(programs: list[AlgebraicRep], max_partitions: int | None = None) -> int:
+    visited = 0
+    for program in programs:
+        walk = PartitionWalk(max_partitions=max_partitions, progress=False)
+        for _ in program.analyze(list(Property), walk):
+            pass
+        visited += walk.visited
+    return visited
+
+
+def second_preimages_all(programs: list[AlgebraicRep]) -> None:
+    for program in programs:
+        for _ in program.second_preimage_attacks():
+            pass
+
+
+def attacks_of(program: AlgebraicRep) -> list[Attack]:
+    walk = PartitionWalk(progress=False)
+    return [attack for _, attack in program.analyze([Property.CR], walk)]
+
+
+def md_chains(n: int, params: list[PGVParams]) -> list[AlgebraicRep]:
+    return [PGVComporessionFunction(p).construct_MD(n) for p in params]
+
+
+def quietly(f: Callable, *args) -> Callable[[object], None]:
+    # The sympy searches print their results
+    def run(_):
+        with contextlib.redirect_stdout(io.StringIO()):
+            f(*args)
+
+    return run
+
+
+def collapse_inputs(n: int, count: int) -> tuple[JoinedProgram, list[Partition]]:
+    # The joined constraints of a chain and random partitions of them
+    program = PGVComporessionFunction(PGVParams(1, 0, 0, 1, 1, 0)).construct_MD(n)
+    joined = program.joined()
+    rng = random.Random(0)
+    size = len(joined.constraints.cs)
+    return joined, [sample_partition(size, rng) for _ in range(count)]
+
+
+def ordering_inputs(n: int, count: int) -> list[tuple[Constraints, FieldArray]]:
+    # Collapsed constraints with the left input fixed, as for 2PR
+    joined, partitions = collapse_inputs(n, count)
+    inputs = []
+    for partition in partitions:
+        collapsed, subspace = joined.constraints.collapse(partition)
+        inputs.append((collapsed, joined.left_input @ joined.f @ subspace))
+    return inputs
+
+
+def benchmarks(full: bool = False) -> list[Benchmark]:
+    from linicrypt_solver import cli
+    from linicrypt_solver import sympy as basis_changes
+
+    suite = [
+        Benchmark(
+            "examples/running_example",
+            lambda: [cli.running_example()],
+            analyze_all,
+        ),
+        Benchmark(
+            "examples/example_no_nonces",
+            lambda: [cli.example_no_nonces()],
+            analyze_all,
+        ),
+    ]
+    for n in range(1, 6):
+        suite.append(
+            Benchmark(
+                f"construct_MD/n={n}",
+                lambda n=n: n,
+                lambda n: md_chains(n, ALL_PARAMS) and None,
+            )
+        )
+    for n in range(1, 6):
+        params = ALL_PARAMS if full or n <= 2 else ALL_PARAMS[::8]
+        budget = None if full or n <= 2 else 100
+        suite.append(
+            Benchmark(
+                f"analyze_MD/n={n}",
+                lambda n=n, params=params: md_chains(n, params),
+                lambda programs, budget=budget: analyze_all(programs, budget),
+                repeats=1,
+            )
+        )
+    suite.append(
+        Benchmark(
+            "second_preimage_MD/n=3",
+            lambda: md_chains(3, ALL_PARAMS if full else ALL_PARAMS[::8]),
+            second_preimages_all,
+            repeats=1,
+        )
+    )
+    suite += [
+        Benchmark(
+            "basis_changes/H2_permute",
+            lambda: None,
+            quietly(basis_changes.H2_permute_constraints),
+        ),
+        Benchmark(
+            "basis_changes/H2_collapse",
+            lambda: None,
+            quietly(basis_changes.H2_collapse_constraints),
+        ),
+        Benchmark(
+            "basis_changes/Hn_cycle_n=3",
+            lambda: None,
+            quietly(basis_changes.Hn_cycle_constraints, 3, False),
+        ),
+        Benchmark(
+            "micro/collapse",
+            lambda: collapse_inputs(4, 200),
+            lambda inputs: (
+                [inputs[0].constraints.collapse(p) for p in inputs[1]] and None
+            ),
+        ),
+        Benchmark(
+            "micro/find_solution_ordering",
+            lambda: ordering_inputs(3, 100),
+            lambda inputs: [c.find_solution_ordering(f) for c, f in inputs] and None,
+        ),
+        Benchmark(
+            "micro/maximal_attacks",
+            lambda: [attacks_of(program) for program in md_chains(2, ALL_PARAMS)],
+            # A single pass takes under a millisecond
+            lambda attacks: (
+                [maximal_attacks(iter(a)) for _ in range(100) for a in attacks] and None
+            ),
+        ),
+    ]
+    return suite
+
+
+def measure(benchmark: Benchmark) -> dict:
+    try:
+        state = benchmark.setup()
+        times = []
+        for _ in range(benchmark.repeats):
+            start = time.perf_counter()
+            partitions = benchmark.run(state)
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        benchmark.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    except Exception as e:
+        return {"name": benchmark.name, "error": f"{type(e).__name__}: {e}"}
+    wall = statistics.median(times)
+    result = {
+        "name": benchmark.name,
+        "wall": wall,
+        "min_wall": min(times),
+        "repeats": benchmark.repeats,
+        "peak_memory": peak,
+    }
+    if partitions is not None:
+        result["partitions"] = partitions
+        result["partitions_per_second"] = partitions / wall if wall > 0 else None
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "galois": galois.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_suite(
+    full: bool = False, only: str | None = None, progress: bool = True
+) -> dict:
+    warm_up()
+    results = []
+    for benchmark in benchmarks(full):
+        if only is not None and only not in benchmark.name:
+            continue
+        result = measure(benchmark)
+        if progress:
+            print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return {"environment": environment(), "full": full, "results": results}
+
+
+def compare(before: dict, after: dict, threshold: float = 0.1) -> list[dict]:
+    # Ratio of the wall times after / before of the stages in both runs. A stage
+    # is a regression if it got slower by more than threshold, an improvement if
+    # it got faster by more than that.
+    old = {r["name"]: r for r in before["results"] if "wall" in r}
+    rows = []
+    for result in after["results"]:
+        base = old.get(result["name"])
+        if base is None or "wall" not in result:
+            continue
+        ratio = result["wall"] / base["wall"] if base["wall"] > 0 else float("inf")
+        verdict = "same"
+        if ratio > 1 + threshold:
+            verdict = "regression"
+        elif ratio < 1 - threshold:
+            verdict = "improvement"
+        rows.append(
+            {
+                "name": result["name"],
+                "before": base["wall"],
+                "after": result["wall"],
+                "ratio": ratio,
+                "memory_ratio": result["peak_memory"] / max(base["peak_memory"], 1),
+                "verdict": verdict,
+            }
+        )
+    return rows
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="linicrypt_solver.bench")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the suite and write JSON")
+    run.add_argument("--out", help="file for the results, stdout if unset")
+    run.add_argument("--full", action="store_true", help="all chains to the end")
+    run.add_argument("--only", help="only stages whose name contains this")
+    diff = commands.add_parser("compare", help="compare two runs")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    if args.command == "run":
+        report = json.dumps(run_suite(args.full, args.only), indent=1)
+        if args.out is None:
+            print(report)
+        else:
+            with open(args.out, "w") as file:
+                file.write(report + "\n")
+        return
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    rows = compare(before, after, args.threshold)
+    for row in rows:
+        print(
+            f"{row['name']:<32} {row['before']:>9.4f}s {row['after']:>9.4f}s "
+            f"{row['ratio']:>6.2f}x  memory {row['memory_ratio']:>5.2f}x  "
+            f"{row['verdict']}"
+        )
+    # A failing exit status lets CI stop on regressions
+    if any(row["verdict"] == "regression" for row in rows):
+        sys.exit(1)
+
+
+def test_measure_and_compare():
+    benchmark = Benchmark(
+        "micro/collapse", lambda: collapse_inputs(2, 5), lambda inputs: 5, repeats=2
+    )
+    result = measure(benchmark)
+    assert result["partitions"] == 5 and result["peak_memory"] >= 0
+    assert measure(Benchmark("broken", lambda: 1 / 0, lambda _: None))["error"]
+
+    before = {"results": [result, {**result, "name": "other"}]}
+    after = {
+        "results": [
+            {**result, "wall": result["wall"] * 2},
+            {**result, "name": "other", "wall": result["wall"] / 2},
+        ]
+    }
+    verdicts = [row["verdict"] for row in compare(before, after)]
+    assert verdicts == ["regression", "improvement"]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
+import argparse
+import io
+import json
+import multiprocessing
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from typing import IO, Iterator
 
 from loguru import logger
 from itertools import product
 
-from linicrypt_solver.algebraic_representation import AlgebraicRep
+from linicrypt_solver.algebraic_representation import AlgebraicRep, Property
 from linicrypt_solver.field import GF
 from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+from linicrypt_solver.service import run_analysis, warm_up
 from linicrypt_solver.solvable import Constraints
+from linicrypt_solver.trace import tracing
 
 # Configure logger to print the log message on a new line
 logger.remove()  # Remove the default handler
@@ -27,7 +37,7 @@ def example_no_nonces() -> AlgebraicRep:
         ]
     )
     fixing = GF([[1, 0, 0, 0, 0], [0, 1, 0, 0, 0]])
-    output = GF([[0, 0, 0, 10, 1]])
+    output = GF([[0, 0, 0, 1, 1]])
     return AlgebraicRep(constraints, fixing, output)
 
 
@@ -87,8 +97,181 @@ def test_MD_secure_cr():
             test_MD_with(pgv_f)
 
 
+# The linicrypt_solver command. Reads one program per line as JSON, in the
+# format of service.program_from_json with an optional "field" (its order, which
+# has to be the one of field.GF) and "id", and writes one JSON line per program
+# with its attacks as soon as its analysis is done, in the order they finish.
+
+
+def quiet():
+    # Only warnings on stderr, for the command and each of its workers
+    logger.remove()
+    logger.add(sink=sys.stderr, level="WARNING", format="{level}\n{message}")
+
+
+def start_worker():
+    # Compiles the field kernels before the first program, so they don't count
+    # towards its time
+    quiet()
+    warm_up()
+
+
+def analyze_program(index: int, data: dict, options: dict) -> dict:
+    start = time.monotonic()
+    record = {"index": index, "id": data.get("id")}
+    try:
+        field = data.get("field", GF.order)
+        if field != GF.order:
+            raise ValueError(f"field of order {field}, the solver uses {GF.order}")
+        attacks = []
+        with tracing() if options.get("trace") else nullcontext() as tracer:
+            result = run_analysis(
+                {"program": data, **options},
+                lambda prop, partition: attacks.append(
+                    {"property": prop, "partition": partition}
+                ),
+            )
+        if tracer is not None:
+            record["trace"] = tracer.report()
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    # True if the whole search found no attack, None if it was cut short
+    resistant = {}
+    for prop in options["properties"]:
+        if any(a["property"] == prop for a in attacks):
+            resistant[prop] = False
+        else:
+            resistant[prop] = True if result["complete"] else None
+    record.update(
+        resistant=resistant,
+        attacks=attacks,
+        coverage=result["coverage"],
+        seconds=time.monotonic() - start,
+    )
+    return record
+
+
+def read_programs(lines: IO[str]) -> Iterator[tuple[int, dict | str]]:
+    # The parsed programs, or the error for lines that are not JSON objects
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield (index, f"JSONDecodeError: {e}")
+            continue
+        yield (index, data if isinstance(data, dict) else "expected a JSON object")
+
+
+def analyze_programs(lines: IO[str], options: dict, workers: int) -> Iterator[dict]:
+    # Records in the order the analyses finish. At most a few programs per
+    # worker are read ahead, so the input can be a stream.
+    programs = read_programs(lines)
+    if workers == 0:
+        for index, data in programs:
+            if isinstance(data, str):
+                yield {"index": index, "error": data}
+            else:
+                yield analyze_program(index, data, options)
+        return
+
+    # Forking after galois compiled its kernels can hang the workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, context, initializer=start_worker) as pool:
+        pending = set()
+        exhausted = False
+        while not exhausted or pending:
+            while not exhausted and len(pending) < 4 * workers:
+                item = next(programs, None)
+                if item is None:
+                    exhausted = True
+                elif isinstance(item[1], str):
+                    yield {"index": item[0], "error": item[1]}
+                else:
+                    pending.add(pool.submit(analyze_program, *item, options))
+            if pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="linicrypt_solver",
+        description="Find CR and 2PR attacks on Linicrypt programs given as JSON lines",
+    )
+    parser.add_argument(
+        "input", nargs="?", default="-", help="JSONL file of programs, - for stdin"
+    )
+    parser.add_argument(
+        "--properties",
+        nargs="+",
+        choices=[p.name for p in Property],
+        default=[p.name for p in Property],
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="0 analyses in this process"
+    )
+    parser.add_argument(
+        "--deadline", type=float, help="seconds of enumeration per program"
+    )
+    parser.add_argument("--max-partitions", type=int)
+    parser.add_argument("--limit", type=int, help="stop after this many attacks")
+    parser.add_argument(
+        "--trace", action="store_true", help="add counters and timings to each line"
+    )
+    args = parser.parse_args(argv)
+
+    quiet()
+    options = {
+        "properties": args.properties,
+        "deadline": args.deadline,
+        "max_partitions": args.max_partitions,
+        "limit": args.limit,
+        "trace": args.trace,
+    }
+    # stdin stays open for whoever reads it next
+    source = nullcontext(sys.stdin) if args.input == "-" else open(args.input)
+    with source as lines:
+        for record in analyze_programs(lines, options, args.workers):
+            print(json.dumps(record), flush=True)
+
+
+def test_main_writes_a_line_per_program(tmp_path, capsys):
+    # P(x, y) = H(H(x)) + y
+    hash_program = {
+        "constraints": [
+            {"q": [1, 0, 0, 0], "a": [0, 0, 1, 0]},
+            {"q": [0, 0, 1, 0], "a": [0, 0, 0, 1]},
+        ],
+        "fixing": [[1, 0, 0, 0], [0, 1, 0, 0]],
+        "output": [[0, 1, 0, 1]],
+    }
+    programs = tmp_path / "programs.jsonl"
+    lines = [
+        {"pgv": [0, 0, 1, 0, 0, 1], "n": 2, "id": "decrypt"},
+        {**hash_program, "field": GF.order},
+        {**hash_program, "field": 29},
+    ]
+    programs.write_text("\n".join(json.dumps(line) for line in lines) + "\nnot json\n")
+    main([str(programs), "--workers", "0", "--properties", "CR"])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r["index"] for r in records] == [0, 1, 2, 3]
+    assert records[0]["id"] == "decrypt"
+    assert records[0]["resistant"] == {"CR": False}
+    assert records[1]["resistant"] == {"CR": False}
+    assert "error" in records[2] and "error" in records[3]
+
+
+def test_main_leaves_stdin_open(monkeypatch, capsys):
+    program = {"pgv": [0, 0, 1, 0, 0, 1], "n": 2}
+    monkeypatch.setattr(sys, "stdin", io.StringIO(json.dumps(program) + "\n"))
+    main(["-", "--workers", "0", "--properties", "CR"])
+    assert not sys.stdin.closed
+    assert json.loads(capsys.readouterr().out)["resistant"] == {"CR": False}
+
+
 if __name__ == "__main__":
-    # test_cr(example_no_nonces())
-    # test_cr(my_example())
-    test_MD_secure_cr()
-    # test_MD_with(1, 0, 1, 1, 1, 0)
+    main()
@@ -0,0 +1,240 @@
+from dataclasses import dataclass
+from enum import Enum
+
+import numpy as np
+from galois import FieldArray
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep, Attack
+from linicrypt_solver.evaluate import LazyOracles, ProgramEvaluator
+from linicrypt_solver.field import GF
+from linicrypt_solver.ideal_cipher import ConstraintE
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints
+from linicrypt_solver.utils import stack_matrices
+
+# Turns an attack into a procedure that samples concrete collisions. The solution
+# ordering says in which order the constraints of the collapse can be solved:
+# the answer of each one is a new direction of the attack subspace, everything
+# its query needs is either known already or can be chosen freely. The moves only
+# depend on the attack, so they are planned once and then run for a whole batch
+# of samples with one vector operation per move.
+
+
+class Move(Enum):
+    FREE = "free"
+    TARGET = "target"
+    CHECK = "check"
+    HASH = "hash"
+    ENCRYPT = "encrypt"
+    DECRYPT = "decrypt"
+    FIXED_POINT = "fixed point"
+
+
+@dataclass
+class PlannedMove:
+    move: Move
+    # Row in the coordinates of the attack subspace whose value the move sets or
+    # checks, or whose query it makes
+    rows: FieldArray
+    nonce: object = None
+    # Index into the target input for TARGET and CHECK
+    index: int = 0
+
+
+class CollisionGenerator:
+    def __init__(self, program: AlgebraicRep, attack: Attack):
+        self.program = program
+        self.subspace = attack.subspace
+        dim = self.subspace.shape[1]
+        self.known = GF.Zeros((0, dim))
+        self.moves: list[PlannedMove] = []
+        # Second preimage attacks fix the input of the left execution
+        self.fixes_left = attack.fixing is not None
+        if self.fixes_left:
+            for i, row in enumerate(attack.fixing @ self.subspace):
+                row = row[np.newaxis]
+                if self.in_span(row):
+                    self.moves.append(PlannedMove(Move.CHECK, row, index=i))
+                else:
+                    self.add(PlannedMove(Move.TARGET, row, index=i))
+        for c in attack.solution.cs:
+            self.plan_constraint(c)
+        # Whatever the attack leaves open is chosen at random
+        for row in GF.Identity(dim):
+            self.ensure(row[np.newaxis])
+        self.basis_inverse = np.linalg.inv(self.known)
+
+    def in_span(self, row: FieldArray, *rows: FieldArray) -> bool:
+        # Whether row is determined by the known rows together with rows
+        known = GF(np.concatenate((self.known,) + rows))
+        if len(known) == 0:
+            return not row.any()
+        rank = len(known.row_space())
+        return len(stack_matrices(known, row).row_space()) == rank
+
+    def add(self, move: PlannedMove):
+        # The value of the first row becomes known
+        self.moves.append(move)
+        self.known = stack_matrices(self.known, move.rows[:1])
+
+    def ensure(self, row: FieldArray):
+        if not self.in_span(row):
+            self.add(PlannedMove(Move.FREE, row))
+
+    def plan_constraint(self, c: ConstraintH | ConstraintE):
+        # The same cases in the same order as Constraint.is_solvable
+        if isinstance(c, ConstraintH):
+            self.ensure(c.q)
+            self.add(PlannedMove(Move.HASH, stack_matrices(c.a, c.q), c.nonce))
+        elif not self.in_span(c.y, c.x, c.k):
+            self.ensure(c.k)
+            self.ensure(c.x)
+            rows = GF(np.concatenate((c.y, c.k, c.x)))
+            self.add(PlannedMove(Move.ENCRYPT, rows))
+        elif not self.in_span(c.x, c.k, c.y):
+            self.ensure(c.k)
+            self.ensure(c.y)
+            rows = GF(np.concatenate((c.x, c.k, c.y)))
+            self.add(PlannedMove(Move.DECRYPT, rows))
+        else:
+            assert (c.x == c.y).all()
+            self.ensure(c.k)
+            self.add(PlannedMove(Move.FIXED_POINT, stack_matrices(c.x, c.k)))
+
+    def sample(
+        self, count: int, oracles: LazyOracles, rng: np.random.Generator
+    ) -> tuple[FieldArray, FieldArray, np.ndarray]:
+        # The inputs of the left and right executions of count attempts, and
+        # which attempts went through (a key may have no fixed point, or the
+        # target of a second preimage attack may not fit the attack)
+        dim = self.subspace.shape[1]
+        values = GF.Zeros((count, dim))
+        ok = np.ones(count, dtype=bool)
+        inputs = len(self.program.fixing)
+        targets = GF(rng.integers(GF.order, size=(count, inputs)))
+        column = 0
+        for planned in self.moves:
+            move = planned.move
+            query = np.asarray(values @ self.coordinates(planned.rows[1:]))
+            if move == Move.CHECK:
+                value = values @ self.coordinates(planned.rows)
+                ok &= np.asarray(value[:, 0] == targets[:, planned.index])
+                continue
+            if move == Move.FREE:
+                answer = rng.integers(GF.order, size=count)
+            elif move == Move.TARGET:
+                answer = targets[:, planned.index]
+            elif move == Move.HASH:
+                answer = oracles.hash(query[:, 0], planned.nonce)
+            elif move == Move.ENCRYPT:
+                answer = oracles.encrypt(query[:, 0], query[:, 1])
+            elif move == Move.DECRYPT:
+                answer = oracles.decrypt(query[:, 0], query[:, 1])
+            else:
+                answer, found = fixed_points(query[:, 0], oracles, rng)
+                ok &= found
+            values[:, column] = answer
+            column += 1
+
+        point = values @ self.basis_inverse.transpose() @ self.subspace.transpose()
+        d = self.program.dim()
+        fixing = self.program.fixing.transpose()
+        return point[:, :d] @ fixing, point[:, d:] @ fixing, ok
+
+    def coordinates(self, rows: FieldArray) -> FieldArray:
+        return (rows @ self.basis_inverse).transpose()
+
+
+def fixed_points(
+    keys: np.ndarray, oracles: LazyOracles, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    # A random fixed point of E_k for each key, and whether there is one
+    points = np.arange(GF.order)
+    ys = oracles.encrypt(np.repeat(keys, GF.order), np.tile(points, len(keys)))
+    is_fixed = ys.reshape(len(keys), GF.order) == points
+    scores = rng.random(is_fixed.shape) * is_fixed
+    return scores.argmax(axis=1), is_fixed.any(axis=1)
+
+
+@dataclass
+class VerificationReport:
+    samples: int
+    # Attempts where every move went through
+    generated: int
+    # Of those, the ones where the two inputs differ
+    distinct: int
+    # Of those, the ones where the outputs agree
+    collisions: int
+
+    @property
+    def success_rate(self) -> float:
+        return self.collisions / self.samples if self.samples > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.collisions}/{self.samples} collisions ({self.success_rate:.1%}), "
+            f"{self.generated} generated, {self.distinct} with distinct inputs"
+        )
+
+
+def verify_attack(
+    program: AlgebraicRep,
+    attack: Attack,
+    samples: int = 1000,
+    seed: int = 0,
+    oracle_draws: int = 10,
+) -> VerificationReport:
+    # Samples collisions from the attack and checks them by running the program
+    # on both inputs with the same oracles. The samples are spread over
+    # oracle_draws independent oracles, since whether an attack works can depend
+    # on the oracle, for example on a fixed key having a fixed point.
+    generator = CollisionGenerator(program, attack)
+    evaluate = ProgramEvaluator(program)
+    seeds = np.random.default_rng(seed).integers(2**32, size=oracle_draws)
+    report = VerificationReport(0, 0, 0, 0)
+    for draw, count in enumerate(np.array_split(np.arange(samples), oracle_draws)):
+        oracles = LazyOracles(int(seeds[draw]))
+        rng = np.random.default_rng(int(seeds[draw]))
+        left, right, ok = generator.sample(len(count), oracles, rng)
+        outputs_agree = np.asarray(
+            (evaluate(left, oracles) == evaluate(right, oracles)).all(axis=1)
+        )
+        distinct = ok & np.asarray((left != right).any(axis=1))
+        collisions = distinct & outputs_agree
+        report.samples += len(count)
+        report.generated += int(ok.sum())
+        report.distinct += int(distinct.sum())
+        report.collisions += int(collisions.sum())
+    return report
+
+
+def verify_attacks(
+    program: AlgebraicRep, attacks: list[Attack], samples: int = 1000, seed: int = 0
+) -> list[VerificationReport]:
+    return [verify_attack(program, attack, samples, seed) for attack in attacks]
+
+
+def test_verify_hash_attacks():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    for attack in program.list_collision_attacks():
+        report = verify_attack(program, attack, samples=500)
+        assert report.collisions > 0
+        assert report.collisions == report.distinct
+
+
+def test_verify_merkle_damgard_attacks():
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    # E_h(m), where the message can be recovered by decryption, and E_0(h), which
+    # only collides through fixed points of E_0
+    for params in (PGVParams(0, 0, 1, 0, 0, 1), PGVParams(0, 0, 0, 0, 1, 0)):
+        H_2 = PGVComporessionFunction(params).construct_MD(2)
+        attacks = list(H_2.list_collision_attacks())
+        assert len(attacks) > 0
+        for report in verify_attacks(H_2, attacks, samples=500):
+            assert report.collisions > 0
+            assert report.collisions == report.distinct
@@ -0,0 +1,125 @@
+import numpy as np
+from galois import FieldArray
+from loguru import logger
+
+from linicrypt_solver.field import GF
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints, Partition
+
+# Random oracle programs in which every query uses its own nonce, the class
+# treated in "Characterizing Collision and Second-Preimage Resistance in Linicrypt".
+# In the joined program the i-th query of the left execution can then only
+# collide with the i-th query of the right execution, so a collision attack is
+# described by the set T of shared queries instead of a partition of all 2n
+# constraints.
+#
+# For a fixed T the collapsed program is solvable iff the unshared constraints
+# can be peeled off one by one, each with an answer a_i outside of
+#   span(output, q_j for the remaining j, a_j for the remaining j != i)
+# and it is proper iff no unshared query is forced to be shared, that is
+#   q_i not in span(output, q_T, a_T).
+# Peeling only gets easier with fewer remaining constraints, and a query that is
+# forced to be shared stays forced when T grows. So a greedy fixpoint finds the
+# smallest T of an attack with polynomially many rank computations.
+
+
+def has_distinct_nonces(cs: Constraints) -> bool:
+    nonces = [c.nonce for c in cs.cs]
+    return (
+        all(isinstance(c, ConstraintH) for c in cs.cs)
+        and None not in nonces
+        and len(set(nonces)) == len(nonces)
+    )
+
+
+def rank(rows: list[FieldArray]) -> int:
+    if len(rows) == 0:
+        return 0
+    return len(GF(np.concatenate(rows)).row_space())
+
+
+def is_in_span(v: FieldArray, rows: list[FieldArray]) -> bool:
+    return rank(rows + [v]) == rank(rows)
+
+
+def find_shared_queries(cs: Constraints, output: FieldArray) -> list[int] | None:
+    # Returns the queries both executions of a collision attack have in common,
+    # or None if the program is collision resistant
+    assert has_distinct_nonces(cs)
+    queries = [c.q for c in cs.cs]
+    answers = [c.a for c in cs.cs]
+
+    forced_shared: set[int] = set()
+    while True:
+        shared = list(range(len(cs.cs)))
+        unshared = []
+        # Same greedy as Constraints.find_solution_ordering, from the back
+        peeled = True
+        while peeled:
+            peeled = False
+            for i in shared:
+                if i in forced_shared:
+                    continue
+                fixing = [output] + [queries[j] for j in shared]
+                fixing += [answers[j] for j in shared if j != i]
+                if not is_in_span(answers[i], fixing):
+                    shared.remove(i)
+                    unshared.append(i)
+                    peeled = True
+                    break
+
+        shared_fixing = [output] + [queries[j] for j in shared]
+        shared_fixing += [answers[j] for j in shared]
+        improper = [i for i in unshared if is_in_span(queries[i], shared_fixing)]
+        if len(improper) == 0:
+            break
+        logger.debug(f"queries {improper} are forced to be shared")
+        forced_shared.update(improper)
+
+    # With everything peeled that can be, the executions still have to differ
+    if rank(shared_fixing) == cs.dim():
+        return None
+    return shared
+
+
+def shared_partition(shared: list[int], n: int) -> Partition:
+    # The partition of the joined constraints (left copy 0..n-1, right copy n..2n-1)
+    partition = [[i, i + n] for i in shared]
+    partition += [[i] for i in range(n) if i not in shared]
+    partition += [[i + n] for i in range(n) if i not in shared]
+    return partition
+
+
+def test_sum_of_hashes():
+    # P(x, y) = H_1(x) + H_2(y)
+    cs = Constraints(
+        [
+            ConstraintH([1, 0, 0, 0], [0, 0, 1, 0], nonce=1),
+            ConstraintH([0, 1, 0, 0], [0, 0, 0, 1], nonce=2),
+        ]
+    )
+    assert has_distinct_nonces(cs)
+    assert find_shared_queries(cs, GF([[0, 0, 1, 1]])) is None
+
+
+def test_chained_hashes():
+    # P(x, y) = H_2(H_1(x)) + y
+    cs = Constraints(
+        [
+            ConstraintH([1, 0, 0, 0], [0, 0, 1, 0], nonce=1),
+            ConstraintH([0, 0, 1, 0], [0, 0, 0, 1], nonce=2),
+        ]
+    )
+    assert find_shared_queries(cs, GF([[0, 1, 0, 1]])) == []
+    # P(x, y) = H_2(H_1(x)), the unused y gives a collision without any new query
+    assert find_shared_queries(cs, GF([[0, 0, 0, 1]])) == [0, 1]
+
+
+def test_shared_nonce():
+    cs = Constraints(
+        [
+            ConstraintH([1, 0, 0, 0], [0, 0, 1, 0], nonce=1),
+            ConstraintH([0, 1, 0, 0], [0, 0, 0, 1]),
+        ]
+    )
+    assert not has_distinct_nonces(cs)
@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+from enum import Enum
+
+import numpy as np
+from galois import FieldArray
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep
+from linicrypt_solver.field import GF
+from linicrypt_solver.ideal_cipher import ConstraintE
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints
+from linicrypt_solver.utils import stack_matrices
+
+# Runs Linicrypt programs on concrete inputs, many at once. The field is small,
+# so the oracles are plain tables indexed by field elements that are filled in
+# the first time an entry is queried.
+
+
+class LazyOracles:
+    # A random oracle for each nonce and one ideal cipher, shared by every
+    # evaluation that uses this object
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.hash_tables: dict[object, np.ndarray] = {}
+        # forward[k, x] = E_k(x) and backward[k, y] = E_k^-1(y), -1 if not sampled
+        self.forward = np.full((GF.order, GF.order), -1)
+        self.backward = np.full((GF.order, GF.order), -1)
+
+    def hash(self, queries: np.ndarray, nonce: object = None) -> np.ndarray:
+        table = self.hash_tables.setdefault(nonce, np.full(GF.order, -1))
+        new = np.unique(queries[table[queries] < 0])
+        table[new] = self.rng.integers(GF.order, size=len(new))
+        return table[queries]
+
+    def encrypt(self, keys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+        self._sample(self.forward, self.backward, keys, xs)
+        return self.forward[keys, xs]
+
+    def decrypt(self, keys: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        self._sample(self.backward, self.forward, keys, ys)
+        return self.backward[keys, ys]
+
+    def _sample(
+        self, table: np.ndarray, inverse: np.ndarray, keys: np.ndarray, xs: np.ndarray
+    ):
+        # Extends the permutation of each key to the new points by answers that
+        # were not used for that key yet, chosen uniformly
+        missing = table[keys, xs] < 0
+        if not missing.any():
+            return
+        new = np.unique(np.stack([keys[missing], xs[missing]]), axis=1)
+        for k in np.unique(new[0]):
+            points = new[1][new[0] == k]
+            unused = np.flatnonzero(inverse[k] < 0)
+            answers = self.rng.choice(unused, size=len(points), replace=False)
+            table[k, points] = answers
+            inverse[k, answers] = points
+
+
+class Step(Enum):
+    HASH = "hash"
+    ENCRYPT = "encrypt"
+    DECRYPT = "decrypt"
+
+
+@dataclass
+class EvaluationStep:
+    step: Step
+    constraint: ConstraintH | ConstraintE
+    # Rows of the query in the coordinates of the known values, one per column
+    query: FieldArray
+
+
+class ProgramEvaluator:
+    # Orders the constraints so that each query only depends on the inputs and
+    # earlier answers, once. The inputs and answers are then a basis of the dual
+    # space, and the variables follow from their values by one inversion.
+    def __init__(self, program: AlgebraicRep):
+        self.program = program
+        known = program.fixing
+        order = []
+        remaining = list(program.cs.cs)
+        while len(remaining) > 0:
+            for c in remaining:
+                step = self._direction(c, known)
+                if step is not None:
+                    break
+            else:
+                raise ValueError(f"No constraint can be evaluated after:\n{known}")
+            remaining.remove(c)
+            answer = (
+                c.a if step == Step.HASH else (c.y if step == Step.ENCRYPT else c.x)
+            )
+            known = stack_matrices(known, answer)
+            order.append((step, c))
+
+        dim = program.dim()
+        if known.shape != (dim, dim) or np.linalg.matrix_rank(known) < dim:
+            raise ValueError("The inputs and answers don't determine all variables")
+        self.basis = known
+        self.basis_inverse = np.linalg.inv(known)
+        self.steps = []
+        for step, c in order:
+            if step == Step.HASH:
+                rows = c.q
+            elif step == Step.ENCRYPT:
+                rows = stack_matrices(c.k, c.x)
+            else:
+                rows = stack_matrices(c.k, c.y)
+            self.steps.append(EvaluationStep(step, c, self.coordinates(rows)))
+
+    def coordinates(self, rows: FieldArray) -> FieldArray:
+        # Columns expressing the rows in terms of the known values
+        return (rows @ self.basis_inverse).transpose()
+
+    @staticmethod
+    def _direction(c, known: FieldArray) -> Step | None:
+        def in_span(rows: FieldArray) -> bool:
+            return len(stack_matrices(known, rows).row_space()) == len(
+                known.row_space()
+            )
+
+        if isinstance(c, ConstraintH):
+            return Step.HASH if in_span(c.q) else None
+        if in_span(stack_matrices(c.k, c.x)):
+            return Step.ENCRYPT
+        if in_span(stack_matrices(c.k, c.y)):
+            return Step.DECRYPT
+        return None
+
+    def variables(self, inputs: FieldArray, oracles: LazyOracles) -> FieldArray:
+        # inputs has one row per evaluation with the values of the fixing rows,
+        # the result one row per evaluation with the values of all variables
+        inputs = GF(inputs)
+        count, fixed = inputs.shape
+        assert fixed == len(self.program.fixing)
+        values = GF.Zeros((count, self.program.dim()))
+        values[:, :fixed] = inputs
+        for i, step in enumerate(self.steps):
+            query = np.asarray(values @ step.query)
+            if step.step == Step.HASH:
+                answer = oracles.hash(query[:, 0], step.constraint.nonce)
+            elif step.step == Step.ENCRYPT:
+                answer = oracles.encrypt(query[:, 0], query[:, 1])
+            else:
+                answer = oracles.decrypt(query[:, 0], query[:, 1])
+            values[:, fixed + i] = answer
+        return values @ self.basis_inverse.transpose()
+
+    def __call__(self, inputs: FieldArray, oracles: LazyOracles) -> FieldArray:
+        return self.variables(inputs, oracles) @ self.program.output.transpose()
+
+
+def test_hash_program():
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    oracles = LazyOracles(seed=1)
+    inputs = GF([[x, y] for x in range(GF.order) for y in range(GF.order)])
+    outputs = ProgramEvaluator(program)(inputs, oracles)
+    table = oracles.hash_tables[None]
+    for (x, y), (out,) in zip(inputs, outputs):
+        assert out == GF(int(table[table[x]])) + y
+
+
+def test_cipher_is_a_permutation():
+    oracles = LazyOracles(seed=2)
+    keys = np.zeros(GF.order, dtype=int)
+    ys = oracles.encrypt(keys, np.arange(GF.order))
+    assert sorted(ys) == list(range(GF.order))
+    assert list(oracles.decrypt(keys, ys)) == list(range(GF.order))
+
+
+def test_merkle_damgard_evaluation():
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    # Davies-Meyer: h_i = E_{m_i}(h_{i-1}) + h_{i-1}
+    f = PGVComporessionFunction(PGVParams(1, 0, 0, 1, 1, 0))
+    H_2 = f.construct_MD(2)
+    oracles = LazyOracles(seed=3)
+    inputs = GF(np.random.default_rng(0).integers(GF.order, size=(100, 3)))
+    outputs = ProgramEvaluator(H_2)(inputs, oracles)
+    for (h, m_1, m_2), (iv, h_2) in zip(inputs, outputs):
+        h_1 = GF(int(oracles.forward[m_1, h])) + h
+        assert iv == h
+        assert h_2 == GF(int(oracles.forward[m_2, h_1])) + h_1
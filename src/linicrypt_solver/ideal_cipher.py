@@ -52,7 +52,7 @@ class ConstraintE(Constraint):
         k_unconstrained = True
         # xy_unconstrained = True
         if (self.x == self.y).all() and k_unconstrained and xy_unconstrained:
-            logger.warning(f"solvable_fixed_point: x = {self.x} = {self.y} = y")
+            logger.warning("solvable_fixed_point: x = {} = {} = y", self.x, self.y)
             return True
         else:
             return False
@@ -65,7 +65,7 @@ class ConstraintE(Constraint):
             return False
         else:
             logger.debug(
-                f"solvable_enc: y = {self.y} is not contained in:\n{fixing} + <x,k>"
+                "solvable_enc: y = {} is not contained in:\n{} + <x,k>", self.y, fixing
             )
             return True
 
@@ -77,22 +77,30 @@ class ConstraintE(Constraint):
             return False
         else:
             logger.debug(
-                f"solvable_dec: x = {self.x} is not contained in:\n{fixing} + <k,y>"
+                "solvable_dec: x = {} is not contained in:\n{} + <k,y>", self.x, fixing
             )
             return True
 
     def is_solvable(self, fixing: FieldArray) -> bool:
-        logger.debug(f"checking solvable of:\n{self}\nfixing:\n{fixing}")
+        logger.debug("checking solvable of:\n{}\nfixing:\n{}", self, fixing)
         return (
             self.is_solvable_enc(fixing)
             or self.is_solvable_dec(fixing)
             or self.is_solvale_fixed_point(fixing)
         )
 
+    def is_determined(self, fixing: FieldArray) -> bool:
+        # Either as an encryption or as a decryption
+        fixing = fixing.row_space()
+        xk = GF(np.concatenate((fixing, self.x, self.k))).row_space()
+        ky = GF(np.concatenate((fixing, self.k, self.y))).row_space()
+        return len(fixing) == len(xk) or len(fixing) == len(ky)
+
     def is_proper(self, fixed_constraints: list["ConstraintE"]) -> bool:
         my_matrix = self.fixing_matrix()
         my_xk = my_matrix[:2]
         my_ky = my_matrix[1:]
+        fixed_constraints = [c for c in fixed_constraints if isinstance(c, ConstraintE)]
         for c in fixed_constraints:
             c_matrix = c.fixing_matrix()
             xk = c_matrix[:2]
@@ -0,0 +1,305 @@
+from dataclasses import dataclass
+from typing import Iterable
+
+from galois import FieldArray
+from loguru import logger
+from more_itertools import set_partitions
+
+from linicrypt_solver import Constraint, trace
+from linicrypt_solver.algebraic_representation import (
+    AlgebraicRep,
+    Attack,
+    JoinedProgram,
+    Property,
+    maximal_attacks,
+)
+from linicrypt_solver.solvable import Constraints, Partition, Verdict
+
+# Analysis of a program that is edited one constraint or output at a time, for
+# design loops. The session keeps the verdict of every partition of the joined
+# constraints and after an edit only redoes the partitions it can affect.
+#
+# Constraint i of the program is joined constraint i (left execution) and m + i
+# (right execution), and the output only enters through f, the subspace where
+# both outputs agree. So after replacing constraint i:
+#   - a partition rejected for mixing oracles stays rejected, unless i or m + i
+#     share a block with other constraints and changed their oracle
+#   - the collapse subspace only depends on the constraints in blocks with more
+#     than one element, so if i and m + i aren't in one it stays the same, and
+#     so does being inside W
+#   - with the same subspace, an improper or unsolvable collapse stays no attack
+#     as long as its core (see Verdict) doesn't contain what i and m + i were
+#     mapped to, and any verdict stays if they are mapped to the same as before
+# For 2PR a verdict also depends on the values the left input determines (see
+# JoinedProgram.determined), so when an edit changes them, and whenever the
+# output changes, which changes f and W, only the oracle rejections are kept.
+# A kept verdict can say "unsolvable" for a collapse that is now improper, both
+# mean that it is no attack.
+#
+#   session = AnalysisSession(program)
+#   update = session.replace_constraint(2, ConstraintH(q, a))
+#   update.maximal[Property.CR]
+
+
+@dataclass
+class Entry:
+    partition: Partition
+    # Joined constraints in blocks with more than one element
+    touched: frozenset[int]
+    verdict: Verdict | None
+    # Joined constraints that the core of the verdict was mapped from
+    core: frozenset[int] = frozenset()
+
+
+@dataclass
+class SessionUpdate:
+    recomputed: int
+    reused: int
+    maximal: dict[Property, list[Attack]]
+
+
+def touched(partition: Partition) -> frozenset[int]:
+    return frozenset(i for block in partition if len(block) > 1 for i in block)
+
+
+def oracle(c: Constraint) -> tuple:
+    return (type(c), c.nonce)
+
+
+class AnalysisSession:
+    def __init__(
+        self,
+        program: AlgebraicRep,
+        properties: Iterable[Property] = (Property.CR, Property.SPR),
+    ):
+        self.properties = [p for p in Property if p in properties]
+        self.program = program
+        self.joined = program.joined()
+        self.entries: list[Entry] = []
+        self.recompute_all()
+
+    def fixings(self) -> list[FieldArray]:
+        return [self.joined.fixing(p) for p in self.properties]
+
+    def fixed(self) -> list[FieldArray | None]:
+        return [self.joined.fixed_values(p) for p in self.properties]
+
+    def judge(self, entry: Entry, subspace: FieldArray | None = None):
+        # Tries whether the old core of an unsolvable collapse still is one first
+        cs = self.joined.constraints
+        hint = None
+        if entry.verdict is not None and entry.verdict.outcome == "unsolvable":
+            hint = sorted(entry.core)
+        verdict = cs.judge(
+            entry.partition,
+            self.joined.preimage_S,
+            self.fixings(),
+            subspace,
+            certify=True,
+            core=hint,
+            fixed=self.fixed(),
+        )
+        entry.verdict = verdict
+        entry.core = frozenset()
+        if len(verdict.core) > 0:
+            images = [c.map(verdict.subspace) for c in cs.cs]
+            entry.core = frozenset(
+                j for j, image in enumerate(images) if image in verdict.core
+            )
+
+    def recompute_all(self) -> SessionUpdate:
+        n = len(self.joined.constraints.cs)
+        self.entries = []
+        for partition in set_partitions(range(n)):
+            entry = Entry(list(partition), touched(partition), None)
+            self.judge(entry)
+            self.entries.append(entry)
+        return SessionUpdate(len(self.entries), 0, self.maximal_attacks())
+
+    def aligned(self, joined: JoinedProgram) -> bool:
+        # Joining dedupes the two copies of a constraint that lies in the row
+        # space of the output, which shifts the indices of the partitions
+        n = len(joined.constraints.cs)
+        return n == 2 * len(self.program.cs.cs) == len(self.joined.constraints.cs)
+
+    def replace_constraint(self, i: int, c: Constraint) -> SessionUpdate:
+        cs = list(self.program.cs.cs)
+        cs[i] = c
+        program = AlgebraicRep(
+            Constraints(cs), self.program.fixing, self.program.output
+        )
+        joined = program.joined()
+        if len(program.cs.cs) != len(cs) or not self.aligned(joined):
+            logger.info("Constraint {} changes the indices, analysing again", i)
+            self.program, self.joined = program, joined
+            return self.recompute_all()
+
+        m = len(cs)
+        edited = {i, m + i}
+        old = {j: self.joined.constraints.cs[j] for j in edited}
+        new = {j: joined.constraints.cs[j] for j in edited}
+        same_oracle = all(oracle(old[j]) == oracle(new[j]) for j in edited)
+        same_values = same_fixed_values(self.fixed(), joined, self.properties)
+        self.program, self.joined = program, joined
+        if not same_values:
+            logger.info("Constraint {} changes the values of the left input", i)
+            return self.rejudge()
+
+        recomputed = 0
+        for entry in self.entries:
+            if self.keeps(entry, edited, old, new, same_oracle):
+                continue
+            if entry.touched.isdisjoint(edited):
+                self.judge(entry, entry.verdict.subspace)
+            else:
+                self.judge(entry)
+            recomputed += 1
+        reused = len(self.entries) - recomputed
+        trace.count("partitions reused", reused)
+        return SessionUpdate(recomputed, reused, self.maximal_attacks())
+
+    @staticmethod
+    def keeps(
+        entry: Entry,
+        edited: set[int],
+        old: dict[int, Constraint],
+        new: dict[int, Constraint],
+        same_oracle: bool,
+    ) -> bool:
+        verdict = entry.verdict
+        if verdict.outcome == "mixed nonces":
+            return same_oracle or entry.touched.isdisjoint(edited)
+        if not entry.touched.isdisjoint(edited):
+            return False
+        if verdict.outcome == "inside W":
+            return True
+        subspace = verdict.subspace
+        before = [old[j].map(subspace) for j in edited]
+        if all(b == new[j].map(subspace) for b, j in zip(before, edited)):
+            return True
+        return verdict.outcome in ("improper", "unsolvable") and entry.core.isdisjoint(
+            edited
+        )
+
+    def set_output(self, output: FieldArray) -> SessionUpdate:
+        program = AlgebraicRep(self.program.cs, self.program.fixing, output)
+        joined = program.joined()
+        if not self.aligned(joined):
+            logger.info("The output changes the indices, analysing again")
+            self.program, self.joined = program, joined
+            return self.recompute_all()
+
+        self.program, self.joined = program, joined
+        return self.rejudge()
+
+    def rejudge(self) -> SessionUpdate:
+        # Everything but the oracle rejections
+        recomputed = 0
+        for entry in self.entries:
+            if entry.verdict.outcome != "mixed nonces":
+                self.judge(entry)
+                recomputed += 1
+        reused = len(self.entries) - recomputed
+        trace.count("partitions reused", reused)
+        return SessionUpdate(recomputed, reused, self.maximal_attacks())
+
+    def attacks(self) -> list[tuple[Property, Attack]]:
+        # In the order of analyze
+        attacks = []
+        f = self.joined.f
+        for entry in self.entries:
+            verdict = entry.verdict
+            for prop, ordering in zip(self.properties, verdict.orderings):
+                fixing = self.joined.attack_fixing(prop)
+                attack = Attack.from_collapse(
+                    entry.partition, f, verdict.subspace, fixing, ordering
+                )
+                attacks.append((prop, attack))
+        return attacks
+
+    def maximal_attacks(self) -> dict[Property, list[Attack]]:
+        attacks = self.attacks()
+        return {
+            prop: maximal_attacks(iter(a for p, a in attacks if p == prop))
+            for prop in self.properties
+        }
+
+
+def same_fixed_values(
+    fixed: list[FieldArray | None], joined: JoinedProgram, properties: list[Property]
+) -> bool:
+    for values, prop in zip(fixed, properties):
+        other = joined.fixed_values(prop)
+        if values is None or other is None:
+            if values is not other:
+                return False
+        elif values.shape != other.shape or (values != other).any():
+            return False
+    return True
+
+
+def analysed(program: AlgebraicRep) -> list[tuple]:
+    return [(p, a.partition) for p, a in program.analyze()]
+
+
+def test_edits_agree_with_analysing_again():
+    from linicrypt_solver.field import GF
+    from linicrypt_solver.random_oracle import ConstraintH
+
+    # P(x, y) = H(H(x)) + y
+    cs = Constraints.from_repr(
+        [([1, 0, 0, 0], [0, 0, 1, 0]), ([0, 0, 1, 0], [0, 0, 0, 1])]
+    )
+    program = AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    session = AnalysisSession(program)
+    assert [(p, a.partition) for p, a in session.attacks()] == analysed(program)
+
+    # P(x, y) = H(H(x + y)) + y
+    update = session.replace_constraint(0, ConstraintH([1, 1, 0, 0], [0, 0, 1, 0]))
+    assert [(p, a.partition) for p, a in session.attacks()] == analysed(session.program)
+    assert update.recomputed + update.reused == 15
+    assert update.maximal[Property.CR] == maximal_attacks(
+        session.program.list_collision_attacks()
+    )
+
+    # P(x, y) = H(H(x + y)) + H(x + y)
+    update = session.set_output(GF([[0, 0, 1, 1]]))
+    assert [(p, a.partition) for p, a in session.attacks()] == analysed(session.program)
+
+    # A constraint equal to another one is deduped, so everything is redone
+    update = session.replace_constraint(1, ConstraintH([1, 1, 0, 0], [0, 0, 1, 0]))
+    assert update.reused == 0 and len(session.entries) == 2
+
+
+def test_edits_of_random_programs():
+    from linicrypt_solver.workload import WorkloadParams, generate, program_rng
+
+    params = WorkloadParams(h=2, e=1, nonces=2, inverse=0.5)
+    session = AnalysisSession(generate(params, program_rng(0, 0)))
+    reused = 0
+    for index in range(1, 5):
+        # The same constraint of another program with the same calls
+        other = generate(params, program_rng(0, index))
+        i = index % 3
+        if type(other.cs.cs[i]) is not type(session.program.cs.cs[i]):
+            continue
+        update = session.replace_constraint(i, other.cs.cs[i])
+        assert [(p, a.partition) for p, a in session.attacks()] == analysed(
+            session.program
+        )
+        reused += update.reused
+    assert reused > 0
+
+
+def test_edits_of_a_chain():
+    from linicrypt_solver.ideal_cipher import ConstraintE
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    program = PGVComporessionFunction(PGVParams(0, 0, 1, 0, 0, 1)).construct_MD(2)
+    session = AnalysisSession(program, [Property.CR])
+    c = program.cs.cs[1]
+    # Encrypt with the key and the plaintext swapped
+    update = session.replace_constraint(1, ConstraintE(c.k, c.x, c.y))
+    attacks = list(session.program.list_collision_attacks())
+    assert update.maximal[Property.CR] == maximal_attacks(iter(attacks))
+    assert [a.partition for _, a in session.attacks()] == [a.partition for a in attacks]
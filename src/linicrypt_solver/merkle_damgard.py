@@ -1,12 +1,23 @@
 from dataclasses import dataclass
+from typing import Iterator
 
 import numpy as np
-from loguru import logger
+from galois import FieldArray
 
-from linicrypt_solver.algebraic_representation import AlgebraicRep
+from linicrypt_solver.algebraic_representation import (
+    AlgebraicRep,
+    Attack,
+    Property,
+    maximal_attacks,
+)
 from linicrypt_solver.field import GF
 from linicrypt_solver.ideal_cipher import ConstraintE
-from linicrypt_solver.solvable import Constraints
+from linicrypt_solver.solvable import (
+    Constraints,
+    Partition,
+    PartitionsAvoiding,
+    PartitionsTouching,
+)
 from linicrypt_solver.utils import stack_matrices
 
 
@@ -163,54 +174,10 @@ class PGVComporessionFunction:
         return brs_categories[pgv_index - 1]
 
     def construct_MD(self, n: int, basis: str = "merkle-damgard") -> AlgebraicRep:
-        md_construction = self.algebraic_rep(basis)
-        for _ in range(2, n + 1):
-            dim = md_construction.dim()
-            f_right = self.algebraic_rep(basis).embed_right(dim + 3)
-            md_construction = md_construction.embed_left(dim + 3)
-            # collapse the first input of this compression function
-            # with the output of the ent constraints
-            first_input = f_right.fixing[:1]
-            prev_output = md_construction.output[-1:]
-
-            collapse_f = GF(first_input - prev_output).null_space().transpose()
-            md_construction.merge(f_right)
-            # we need to remove the first input from the inputs of H_n
-            md_construction.fixing = GF(np.delete(md_construction.fixing, -2, 0))
-            # we just take the last output as the output of MD
-            md_construction.output = GF(md_construction.output[-1:])
-            # logger.debug(md_construction)
-            md_construction = md_construction.map(collapse_f)
-            # logger.debug(f"Collapse with:\n{collapse_f}")
-
-        # Add the input IV constant back to the output
-        iv = GF.Zeros((1, md_construction.dim()))
-        iv[0][0] = 1
-        md_construction.output = stack_matrices(iv, md_construction.output)
-
-        return md_construction
+        return construct_MD_batch([self], n, basis)[0]
 
     def construct_MD_2(self, n: int, basis: str = "merkle-damgard"):
-        md_construction = self.algebraic_rep(basis)
-        for _ in range(2, n + 1):
-            dim = md_construction.dim()
-            f_right = self.algebraic_rep(basis).embed_right(dim + 3)
-            md_construction = md_construction.embed_left(dim + 3)
-            # collapse the first input of this compression function
-            # with the output of the ent constraints
-            first_input = f_right.fixing[:1]
-            prev_output = md_construction.output[-1:]
-
-            collapse_f = GF(first_input - prev_output).null_space().transpose()
-            md_construction.merge(f_right)
-            # we need to remove the first input from the inputs of H_n
-            md_construction.fixing = GF(np.delete(md_construction.fixing, -2, 0))
-            # we just take the last output as the output of MD
-            md_construction.output = GF(md_construction.output[-1:])
-            # logger.debug(md_construction)
-            md_construction = md_construction.map(collapse_f)
-            # logger.debug(f"Collapse with:\n{collapse_f}")
-
+        md_construction = chain_MD([self], n, basis)[0]
         # Add the input IV constraint
         zero = GF.Zeros((1, md_construction.dim()))
         iv = md_construction.fixing[:1]
@@ -218,3 +185,195 @@ class PGVComporessionFunction:
         iv_constraint = ConstraintE(zero, zero, iv)
         md_construction.cs.add(iv_constraint)
         return md_construction
+
+
+def chain_MD(
+    functions: list[PGVComporessionFunction], n: int, basis: str = "merkle-damgard"
+) -> list[AlgebraicRep]:
+    # Writes H_n of every compression function directly in its final coordinates,
+    # the same ones the chaining of n copies by collapsing would end up with:
+    # h_0, then the two coordinates of each block that are not its chaining input
+    # (m_i and h_i in the merkle-damgard basis, m_i and y_i in the canonical one).
+    # Block i sees its chaining input as the output of block i - 1 written in
+    # these coordinates, so H_n is block banded apart from that column.
+    assert n >= 1
+    reps = [function.algebraic_rep(basis) for function in functions]
+    for rep in reps:
+        # The chaining input has to be the first coordinate of the block
+        assert (rep.fixing[0] == GF([1, 0, 0])).all()
+    dim = 2 * n + 1
+    # (functions, 3, 3) rows x, k, y, (functions, 2, 3) and (functions, 1, 3)
+    xky = GF(np.stack([rep.cs.cs[0].fixing_matrix() for rep in reps]))
+    inputs = GF(np.stack([rep.fixing for rep in reps]))
+    outputs = GF(np.stack([rep.output for rep in reps]))
+
+    # own[i, j] is the dual vector of coordinate j + 1 of block i in H_n
+    own = GF.Zeros((n, 2, dim))
+    blocks = np.arange(n)
+    own[blocks, 0, 2 * blocks + 1] = 1
+    own[blocks, 1, 2 * blocks + 2] = 1
+    # chain[:, i] is h_i in the coordinates of H_n
+    chain = GF.Zeros((len(reps), n + 1, dim))
+    chain[:, 0, 0] = 1
+    o = outputs[:, 0, :, np.newaxis]
+    for i in range(n):
+        chain[:, i + 1] = (
+            o[:, 0] * chain[:, i] + o[:, 1] * own[i, 0] + o[:, 2] * own[i, 1]
+        )
+
+    def in_blocks(vectors: FieldArray) -> FieldArray:
+        # Dual vectors of a block, (functions, rows, 3), on every block of H_n,
+        # (functions, rows, n, dim)
+        v = vectors[:, :, :, np.newaxis, np.newaxis]
+        return (
+            v[:, :, 0] * chain[:, np.newaxis, :n]
+            + v[:, :, 1] * own[np.newaxis, np.newaxis, :, 0]
+            + v[:, :, 2] * own[np.newaxis, np.newaxis, :, 1]
+        )
+
+    x, k, y = in_blocks(xky).transpose(1, 0, 2, 3)
+    fixings = in_blocks(inputs)
+    md_constructions = []
+    for j in range(len(reps)):
+        cs = Constraints([])
+        for i in range(n):
+            cs.add(ConstraintE(x[j, i : i + 1], k[j, i : i + 1], y[j, i : i + 1]))
+        # The chaining inputs of the later blocks are not inputs of H_n
+        fixing = stack_matrices(fixings[j, 0, :1], fixings[j, 1]).row_space()
+        output = chain[j, n : n + 1]
+        md_constructions.append(AlgebraicRep(cs, fixing, output))
+    return md_constructions
+
+
+def construct_MD_batch(
+    functions: list[PGVComporessionFunction], n: int, basis: str = "merkle-damgard"
+) -> list[AlgebraicRep]:
+    md_constructions = chain_MD(functions, n, basis)
+    for md_construction in md_constructions:
+        # Add the input IV constant back to the output
+        iv = GF.Zeros((1, md_construction.dim()))
+        iv[0][0] = 1
+        md_construction.output = stack_matrices(iv, md_construction.output)
+    return md_constructions
+
+
+@dataclass
+class MDLevel:
+    n: int
+    # The maximal collision attacks on H_n found at this level
+    attacks: list[Attack]
+    # How many of them were lifted from H_{n-1}
+    lifted: int
+    # Whether all partitions of the joined constraints were searched
+    exhaustive: bool
+
+    @property
+    def is_collision_resistant(self) -> bool | None:
+        if len(self.attacks) > 0:
+            return False
+        return True if self.exhaustive else None
+
+
+def lift_partition(partition: Partition, n: int) -> Partition:
+    # A collision on H_{n-1} extends to H_n by appending the same message block
+    # to both inputs. On the joined constraints of H_{n-1} (left blocks 0..n-2,
+    # right blocks n-1..2n-3) that makes the last blocks of H_n collapse.
+    def shift(i: int) -> int:
+        return i if i < n - 1 else i + 1
+
+    lifted = [[shift(i) for i in block] for block in partition]
+    return lifted + [[n - 1, 2 * n - 1]]
+
+
+def analyze_MD_levels(
+    function: PGVComporessionFunction,
+    N: int,
+    window: int = 2,
+    basis: str = "merkle-damgard",
+    prove: bool = True,
+) -> Iterator[MDLevel]:
+    # Collision attacks on H_1, ..., H_N. The first window levels are searched
+    # exhaustively. Every later level starts from the lifted attacks of the level
+    # before and then only searches the partitions in which each collapsed block
+    # contains one of the two new constraints. That misses attacks which need
+    # the old constraints collapsed among themselves without the new blocks
+    # collapsing together. If neither finds an attack and prove is set, the
+    # remaining partitions are searched as well, so the level is exhaustive and
+    # resistance is proven. Together both searches visit each of the Bell(2n)
+    # partitions once, as many as an exhaustive search of the level, so pass
+    # prove=False to keep resistant levels cheap. Otherwise the level is not
+    # exhaustive.
+    #
+    # Only attacks carry over from one level to the next. The verdicts of the
+    # partitions don't, because the collapse of a partition of H_n is taken in
+    # the subspace where the outputs of H_n agree, which is a different condition
+    # than equal outputs of H_{n-1}.
+    previous: list[Attack] | None = None
+    for n in range(1, N + 1):
+        H_n = function.construct_MD(n, basis)
+        joined = H_n.joined()
+        # Equal constraints of the two executions are identified in the joined
+        # constraints, then the indices don't line up with the blocks anymore
+        aligned = len(joined.constraints.cs) == 2 * n
+        if n <= window or not aligned or previous is None:
+            attacks = maximal_attacks(H_n.list_collision_attacks())
+            yield MDLevel(n, attacks, 0, True)
+            previous = attacks if aligned else None
+            continue
+
+        lifted = []
+        for attack in previous:
+            partition = lift_partition(attack.partition, n)
+            lifted_attack = joined.attack(partition, Property.CR)
+            if lifted_attack is not None:
+                lifted.append(lifted_attack)
+        source = PartitionsTouching([n - 1, 2 * n - 1])
+        searched = [attack for _, attack in H_n.analyze([Property.CR], source)]
+        exhaustive = False
+        if len(lifted) + len(searched) == 0 and prove:
+            source = PartitionsAvoiding([n - 1, 2 * n - 1])
+            searched = [attack for _, attack in H_n.analyze([Property.CR], source)]
+            exhaustive = True
+        attacks = maximal_attacks(iter(lifted + searched))
+        yield MDLevel(n, attacks, sum(1 for a in attacks if a in lifted), exhaustive)
+        previous = attacks
+
+
+def test_construct_MD():
+    f = PGVComporessionFunction(PGVParams(1, 1, 1, 0, 0, 1))
+    H_3 = f.construct_MD(3)
+    assert (H_3.fixing == GF.Identity(7)[[0, 1, 3, 5]]).all()
+    assert (H_3.output == GF.Identity(7)[[0, 6]]).all()
+    # E_{h_2}(m_3) + h_2 + m_3 = h_3
+    c = H_3.cs.cs[2]
+    assert (c.x == GF([[0, 0, 0, 0, 0, 1, 0]])).all()
+    assert (c.k == GF([[0, 0, 0, 0, 1, 0, 0]])).all()
+    assert (c.y == GF([[0, 0, 0, 0, 1, 1, 1]])).all()
+
+    batch = construct_MD_batch(
+        [f, PGVComporessionFunction(PGVParams(0, 1, 1, 1, 1, 0))], 3
+    )
+    assert (batch[0].output == H_3.output).all()
+    assert all(len(H.cs.cs) == 3 and H.dim() == 7 for H in batch)
+
+
+def test_lift_partition():
+    # Blocks 0, 1 of the left and 2, 3 of the right execution of H_2
+    assert lift_partition([[0, 2], [1, 3]], 3) == [[0, 3], [1, 4], [2, 5]]
+
+
+def test_analyze_MD_levels():
+    f = PGVComporessionFunction(PGVParams(0, 0, 0, 1, 0, 1))
+    levels = list(analyze_MD_levels(f, 3, window=2))
+    assert [level.n for level in levels] == [1, 2, 3]
+    assert [level.exhaustive for level in levels] == [True, True, False]
+    assert levels[0].is_collision_resistant
+    assert levels[1].is_collision_resistant is False
+    assert levels[2].is_collision_resistant is False
+
+    # Resistant at every level, proven beyond the window as well
+    f = PGVComporessionFunction(PGVParams(1, 0, 0, 1, 1, 0))
+    levels = list(analyze_MD_levels(f, 2, window=1))
+    assert [level.is_collision_resistant for level in levels] == [True, True]
+    levels = list(analyze_MD_levels(f, 2, window=1, prove=False))
+    assert [level.is_collision_resistant for level in levels] == [True, None]
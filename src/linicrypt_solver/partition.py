@@ -0,0 +1,195 @@
+from typing import Generic, Iterable, Iterator, TypeVar
+
+from linicrypt_solver.solvable import Partition
+
+T = TypeVar("T")
+
+
+def bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def lowest(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
+
+
+class BlockPartition:
+    # A set partition of non-negative integers stored as one bitmask per block.
+    # The blocks are ordered by their smallest element, which makes the
+    # representation canonical, so equal partitions have equal blocks.
+    __slots__ = ("blocks", "block_of")
+
+    def __init__(self, blocks: Iterable[int]):
+        self.blocks: tuple[int, ...] = tuple(sorted(blocks, key=lowest))
+        self.block_of: dict[int, int] = {}
+        for block in self.blocks:
+            for x in bits(block):
+                assert x not in self.block_of, f"{x} is in two blocks"
+                self.block_of[x] = block
+
+    @staticmethod
+    def from_list(partition: Partition) -> "BlockPartition":
+        blocks = []
+        for subset in partition:
+            mask = 0
+            for x in subset:
+                mask |= 1 << x
+            blocks.append(mask)
+        return BlockPartition(blocks)
+
+    @staticmethod
+    def from_restricted_growth(labels: Iterable[int]) -> "BlockPartition":
+        blocks: list[int] = []
+        for x, label in enumerate(labels):
+            if label == len(blocks):
+                blocks.append(0)
+            assert label < len(blocks), "not a restricted growth string"
+            blocks[label] |= 1 << x
+        return BlockPartition(blocks)
+
+    def to_list(self) -> Partition:
+        return [list(bits(block)) for block in self.blocks]
+
+    def restricted_growth(self) -> list[int]:
+        # Only defined for partitions of range(n)
+        labels = [0] * len(self.block_of)
+        for label, block in enumerate(self.blocks):
+            for x in bits(block):
+                labels[x] = label
+        return labels
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def merged(self) -> int:
+        # The elements that are not alone in their block
+        mask = 0
+        for block in self.blocks:
+            if block & (block - 1):
+                mask |= block
+        return mask
+
+    def is_finer(self, other: "BlockPartition") -> bool:
+        # Every block is contained in the block of other holding its smallest element
+        for block in self.blocks:
+            other_block = other.block_of.get(lowest(block))
+            if other_block is None or block & ~other_block:
+                return False
+        return True
+
+    def join(self, other: "BlockPartition") -> "BlockPartition":
+        # Union-find over the elements, linking each block to its smallest element
+        parent = {x: x for x in self.block_of} | {x: x for x in other.block_of}
+
+        def find(x: int) -> int:
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for block in self.blocks + other.blocks:
+            root = find(lowest(block))
+            for x in bits(block):
+                parent[find(x)] = root
+
+        joined: dict[int, int] = {}
+        for x in parent:
+            root = find(x)
+            joined[root] = joined.get(root, 0) | 1 << x
+        return BlockPartition(joined.values())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, BlockPartition):
+            return self.blocks == other.blocks
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.blocks)
+
+    def __repr__(self) -> str:
+        return f"{self.to_list()}"
+
+
+class Antichain(Generic[T]):
+    # The finest partitions seen so far, each with an item attached. A partition
+    # can only be strictly finer than one with fewer blocks, and only if the
+    # elements in its blocks of more than one element (merged) are a subset of
+    # the other's. So the current maxima are bucketed by their number of blocks
+    # and then by merged, a new partition is only compared with the groups that
+    # pass both tests and equal ones are found by hashing. That skips most
+    # comparisons, but in the worst case every maximum is still looked at.
+    def __init__(self):
+        self.items: dict[BlockPartition, T] = {}
+        self.by_size: dict[int, dict[int, set[BlockPartition]]] = {}
+
+    def insert(self, partition: BlockPartition, item: T) -> bool:
+        if partition in self.items:
+            return False
+        k = len(partition)
+        merged = partition.merged()
+        for size, groups in self.by_size.items():
+            if size <= k:
+                continue
+            for mask, group in groups.items():
+                if mask & ~merged == 0 and any(p.is_finer(partition) for p in group):
+                    return False
+
+        for size, groups in self.by_size.items():
+            if size >= k:
+                continue
+            for mask, group in groups.items():
+                if merged & ~mask:
+                    continue
+                coarser = [p for p in group if partition.is_finer(p)]
+                for p in coarser:
+                    group.remove(p)
+                    del self.items[p]
+        self.items[partition] = item
+        groups = self.by_size.setdefault(k, {})
+        groups.setdefault(merged, set()).add(partition)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.items.values())
+
+
+def test_join():
+    a = BlockPartition.from_list([[3], [1, 2]])
+    b = BlockPartition.from_list([[1], [2, 3]])
+    assert a.join(b).to_list() == [[1, 2, 3]]
+    a = BlockPartition.from_list([[0, 1], [2], [3], [4, 5]])
+    b = BlockPartition.from_list([[0], [1, 2], [3], [4], [5]])
+    assert a.join(b).to_list() == [[0, 1, 2], [3], [4, 5]]
+
+
+def test_restricted_growth():
+    p = BlockPartition.from_list([[0, 3], [2], [1, 4]])
+    assert p.restricted_growth() == [0, 1, 2, 0, 1]
+    assert BlockPartition.from_restricted_growth([0, 1, 2, 0, 1]) == p
+
+
+def test_antichain():
+    chain: Antichain[str] = Antichain()
+    assert chain.insert(BlockPartition.from_list([[0, 1], [2]]), "a")
+    assert chain.insert(BlockPartition.from_list([[0], [1, 2]]), "b")
+    assert not chain.insert(BlockPartition.from_list([[0, 1, 2]]), "c")
+    assert chain.insert(BlockPartition.from_list([[0], [1], [2]]), "d")
+    assert list(chain) == ["d"]
+
+
+def test_antichain_skips_unrelated_groups():
+    chain: Antichain[str] = Antichain()
+    assert chain.insert(BlockPartition.from_list([[0, 1], [2], [3]]), "a")
+    assert chain.insert(BlockPartition.from_list([[0], [1], [2, 3]]), "b")
+    # Merges 0, 1 like a, so a is finer
+    assert not chain.insert(BlockPartition.from_list([[0, 1, 2], [3]]), "c")
+    # Finer than both
+    assert chain.insert(BlockPartition.from_list([[0], [1], [2], [3]]), "d")
+    assert list(chain) == ["d"]
+    assert BlockPartition.from_list([[0, 2], [1], [3]]).merged() == 0b101
@@ -9,7 +9,7 @@ from linicrypt_solver.utils import stack_matrices
 
 
 class ConstraintH(Constraint):
-    def __init__(self, q: DualVector, a: DualVector):
+    def __init__(self, q: DualVector, a: DualVector, nonce: object = None):
         if isinstance(q, list):
             q = np.array([q])
         if isinstance(a, list):
@@ -19,6 +19,7 @@ class ConstraintH(Constraint):
         assert n == q.shape[1]
         self.q = GF(q)
         self.a = GF(a)
+        self.nonce = nonce
 
     def fixing_matrix(self) -> FieldArray:
         return stack_matrices(self.q, self.a)
@@ -26,7 +27,7 @@ class ConstraintH(Constraint):
     def map(self, f: FieldArray) -> "ConstraintH":
         q = self.q @ f
         a = self.a @ f
-        return ConstraintH(q, a)
+        return ConstraintH(q, a, self.nonce)
 
     def dim(self):
         assert self.q.shape[1] == self.a.shape[1]
@@ -38,12 +39,27 @@ class ConstraintH(Constraint):
         new_fixing_space = stack_matrices(fixing, self.a).row_space()
         assert len(fixing) <= len(new_fixing_space)
         if len(fixing.row_space()) == len(new_fixing_space.row_space()):
-            logger.debug(f"{self.a} is contained in:\n{fixing}")
+            logger.debug("{} is contained in:\n{}", self.a, fixing)
             return False
         return True
 
+    def is_determined(self, fixing: FieldArray) -> bool:
+        return len(stack_matrices(fixing, self.q).row_space()) == len(
+            fixing.row_space()
+        )
+
     def is_proper(self, fixed_constraints: list[Self]) -> bool:
-        return all((c.q != self.q).any() for c in fixed_constraints)
+        return all(
+            not isinstance(c, ConstraintH)
+            or (c.q != self.q).any()
+            or c.nonce != self.nonce
+            for c in fixed_constraints
+        )
+
+    def __eq__(self, other) -> bool:
+        return super().__eq__(other) and self.nonce == other.nonce
 
     def __repr__(self):
+        if self.nonce is not None:
+            return f"{self.q[0]} |-{self.nonce}-> {self.a[0]}"
         return f"{self.q[0]} |-> {self.a[0]}"
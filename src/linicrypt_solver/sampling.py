@@ -0,0 +1,233 @@
+import multiprocessing
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import cache
+from typing import Iterator
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep, Attack, Property
+from linicrypt_solver.partition import BlockPartition
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints, Partition, PartitionSource
+
+
+@cache
+def completions(r: int, k: int, blocks: int | None = None) -> int:
+    # Number of ways to place r more elements when k blocks are open already,
+    # ending with exactly `blocks` blocks if that is given.
+    # completions(n, 0) is the Bell number and completions(n, 0, k) the Stirling
+    # number of the second kind S(n, k).
+    if blocks is not None and k > blocks:
+        return 0
+    if r == 0:
+        return 1 if blocks is None or k == blocks else 0
+    return k * completions(r - 1, k, blocks) + completions(r - 1, k + 1, blocks)
+
+
+def sample_partition(
+    n: int, rng: random.Random, blocks: int | None = None
+) -> Partition:
+    # Builds a restricted growth string element by element. Each element joins
+    # one of the k open blocks or opens a new one, with probabilities proportional
+    # to the number of completions, so every partition (with the given number of
+    # blocks) is equally likely.
+    labels = []
+    k = 0
+    for r in range(n, 0, -1):
+        stay = completions(r - 1, k, blocks)
+        x = rng.randrange(completions(r, k, blocks))
+        if x < k * stay:
+            labels.append(x // stay)
+        else:
+            labels.append(k)
+            k += 1
+    partition: Partition = [[] for _ in range(k)]
+    for i, label in enumerate(labels):
+        partition[label].append(i)
+    return partition
+
+
+@dataclass
+class SamplingStats:
+    drawn: int = 0
+    hits: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.drawn / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return f"{self.hits} hits in {self.drawn} samples ({self.throughput:.1f}/s)"
+
+
+class PartitionSampling(PartitionSource):
+    # Draws partitions at random instead of enumerating them, for joined programs
+    # with too many constraints to walk through all Bell(n) partitions.
+    # block_weights biases the number of blocks, for example {n: 1.0} only
+    # samples the finest partition, otherwise all partitions are equally likely.
+    # Stops after `samples` draws or at the deadline (a time.monotonic() value).
+    def __init__(
+        self,
+        seed: int = 0,
+        samples: int | None = None,
+        deadline: float | None = None,
+        block_weights: dict[int, float] | None = None,
+    ):
+        self.rng = random.Random(seed)
+        self.samples = samples
+        self.deadline = deadline
+        self.block_weights = block_weights
+        self.stats = SamplingStats()
+
+    def partitions(self, cs: Constraints) -> Iterator[Partition]:
+        n = len(cs.cs)
+        if n == 0:
+            return
+        if self.block_weights is not None:
+            sizes = [k for k in self.block_weights if 1 <= k <= n]
+            if not sizes:
+                raise ValueError(
+                    f"block_weights {self.block_weights} has no number of blocks "
+                    f"between 1 and {n}"
+                )
+            weights = [self.block_weights[k] for k in sizes]
+        start = time.monotonic() - self.stats.seconds
+        try:
+            while self.samples is None or self.stats.drawn < self.samples:
+                now = time.monotonic()
+                self.stats.seconds = now - start
+                if self.deadline is not None and now > self.deadline:
+                    return
+                blocks = None
+                if self.block_weights is not None:
+                    blocks = self.rng.choices(sizes, weights)[0]
+                self.stats.drawn += 1
+                yield sample_partition(n, self.rng, blocks)
+        finally:
+            # Also counts the time spent on the last sample
+            self.stats.seconds = time.monotonic() - start
+
+
+def sample_attacks(
+    program: AlgebraicRep, sampling: PartitionSampling, prop: Property = Property.CR
+) -> Iterator[Attack]:
+    # Streams the attacks on the sampled partitions, each partition only once
+    seen: set[BlockPartition] = set()
+    for _, attack in program.analyze([prop], sampling):
+        if attack.block_partition not in seen:
+            seen.add(attack.block_partition)
+            sampling.stats.hits += 1
+            yield attack
+
+
+def _sample_chunk(
+    program: AlgebraicRep,
+    prop: Property,
+    seed: int,
+    samples: int,
+    block_weights: dict[int, float] | None,
+) -> tuple[list[Partition], SamplingStats]:
+    sampling = PartitionSampling(seed, samples, block_weights=block_weights)
+    hits = [attack.partition for attack in sample_attacks(program, sampling, prop)]
+    return hits, sampling.stats
+
+
+def parallel_sample_attacks(
+    program: AlgebraicRep,
+    workers: int,
+    chunks: int,
+    samples_per_chunk: int,
+    seed: int = 0,
+    prop: Property = Property.CR,
+    block_weights: dict[int, float] | None = None,
+    stats: SamplingStats | None = None,
+) -> Iterator[Attack]:
+    # Runs the chunks in a process pool, each with its own seed derived from seed,
+    # and streams the new attacks as the chunks finish. The totals end up in
+    # stats, with the wall clock time of the whole pool.
+    if stats is None:
+        stats = SamplingStats()
+    start = time.monotonic()
+    seeds = random.Random(seed)
+    joined = program.joined()
+    seen: set[BlockPartition] = set()
+    # Forking after galois compiled its kernels can hang the workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                _sample_chunk,
+                program,
+                prop,
+                seeds.getrandbits(64),
+                samples_per_chunk,
+                block_weights,
+            )
+            for _ in range(chunks)
+        ]
+        for future in as_completed(futures):
+            hits, chunk_stats = future.result()
+            stats.drawn += chunk_stats.drawn
+            stats.seconds = time.monotonic() - start
+            for partition in hits:
+                block_partition = BlockPartition.from_list(partition)
+                if block_partition in seen:
+                    continue
+                seen.add(block_partition)
+                attack = joined.attack(partition, prop)
+                assert attack is not None
+                stats.hits += 1
+                yield attack
+
+
+def test_sample_partition_is_uniform():
+    rng = random.Random(1)
+    counts = Counter(
+        BlockPartition.from_list(sample_partition(4, rng)) for _ in range(3000)
+    )
+    assert len(counts) == completions(4, 0) == 15
+    assert max(counts.values()) < 2 * min(counts.values())
+
+
+def test_sample_partition_with_blocks():
+    rng = random.Random(2)
+    assert completions(5, 0, 2) == 15
+    assert all(len(sample_partition(5, rng, blocks=2)) == 2 for _ in range(100))
+
+
+def test_sampling_is_reproducible():
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(6)])
+    a = PartitionSampling(seed=3, samples=20)
+    b = PartitionSampling(seed=3, samples=20)
+    assert list(a.partitions(cs)) == list(b.partitions(cs))
+    assert a.stats.drawn == 20
+
+
+def test_sampling_block_weights_and_seconds():
+    import pytest
+
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(4)])
+    sampling = PartitionSampling(samples=5, block_weights={0: 1.0, 7: 1.0})
+    with pytest.raises(ValueError):
+        next(sampling.partitions(cs))
+
+    # The time of the last sample is counted as well
+    sampling = PartitionSampling(samples=2)
+    for _ in sampling.partitions(cs):
+        time.sleep(0.05)
+    assert sampling.stats.seconds >= 0.1
+
+
+def test_parallel_sample_attacks():
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    H_2 = PGVComporessionFunction(PGVParams(0, 0, 1, 0, 0, 1)).construct_MD(2)
+    stats = SamplingStats()
+    attacks = list(parallel_sample_attacks(H_2, 2, 4, 50, seed=1, stats=stats))
+    assert stats.drawn == 200 and stats.hits == len(attacks) > 0
+    partitions = {attack.block_partition for attack in attacks}
+    assert len(partitions) == len(attacks)
+    assert partitions <= {a.block_partition for a in H_2.list_collision_attacks()}
@@ -0,0 +1,178 @@
+import heapq
+import time
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Iterator
+
+import numpy as np
+from galois import FieldArray
+
+from linicrypt_solver import trace
+from linicrypt_solver.field import GF
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import (
+    Constraints,
+    Coverage,
+    Partition,
+    PartitionSource,
+    bell_number,
+)
+from linicrypt_solver.utils import stack_matrices
+
+# Best-first order over the partitions of the constraints, for finding an attack
+# quickly rather than proving there is none.
+#
+# Every partition except the finest one has a unique parent: move its largest
+# element that is not the smallest of its block into a block of its own. This
+# makes the partitions a tree rooted at the finest partition, whose children
+# merge one singleton {x} into an earlier block, with x larger than any element
+# that was merged before. The search expands that tree from a priority queue.
+#
+# A partition is scored by the rank of its difference matrix, the codimension of
+# the subspace it collapses to. A merge of constraints that already share most
+# of their q, or x/k/y, components adds little rank and keeps the collapse large,
+# which is where solvable collapses tend to be. The rank can only grow from a
+# parent to its children, so partitions come out in order of codimension, and
+# among equal codimensions the one with more shared components comes first.
+
+
+@dataclass(order=True)
+class Node:
+    codim: int
+    unshared: int
+    order: int
+    # Elements above last_merged are singletons
+    last_merged: int = field(compare=False)
+    blocks: tuple[tuple[int, ...], ...] = field(compare=False)
+    diff: FieldArray = field(compare=False)
+
+
+def can_merge(c, other) -> bool:
+    # Collapsing never separates constraints again, so a block mixing constraint
+    # types or oracles rules out the whole subtree below it
+    return type(c) is type(other) and c.nonce == other.nonce
+
+
+def shared_components(c, other) -> int:
+    # Nonzero entries that two constraints already have in common
+    a, b = c.fixing_matrix(), other.fixing_matrix()
+    return int(np.count_nonzero((a == b) & (a != 0)))
+
+
+class BestFirstSearch(PartitionSource):
+    # Yields the partitions in best-first order until the deadline (a
+    # time.monotonic() value) or after max_partitions. With max_queue the
+    # priority queue only keeps that many of the best partitions waiting to be
+    # expanded, and the subtrees of the dropped ones are never visited.
+    def __init__(
+        self,
+        max_queue: int | None = None,
+        deadline: float | None = None,
+        max_partitions: int | None = None,
+    ):
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.max_partitions = max_partitions
+        self.visited = 0
+        self.pruned = 0
+        self.dropped = 0
+        self.total = 0
+
+    def partitions(self, cs: Constraints) -> Iterator[Partition]:
+        n = len(cs.cs)
+        self.total = int(bell_number(n)) if n > 0 else 0
+        trace.add_total(self.total)
+        if n == 0:
+            return
+        order = count()
+        finest = tuple((i,) for i in range(n))
+        queue = [Node(0, 0, next(order), -1, finest, GF.Zeros((1, cs.dim())))]
+        while len(queue) > 0:
+            if self.max_partitions is not None and self.visited >= self.max_partitions:
+                return
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                return
+            node = heapq.heappop(queue)
+            self.visited += 1
+            yield [list(block) for block in node.blocks]
+
+            for x in range(node.last_merged + 1, n):
+                for i, block in enumerate(node.blocks):
+                    first = block[0]
+                    if first >= x:
+                        break
+                    if not can_merge(cs.cs[first], cs.cs[x]):
+                        # The child and all its descendants, whose elements above
+                        # x go anywhere but the blocks of the elements up to x
+                        # stay apart
+                        k = sum(1 for b in node.blocks if b[0] < x)
+                        pruned = int(bell_number(n - x - 1, k))
+                        self.pruned += pruned
+                        trace.count("partitions pruned", pruned)
+                        continue
+                    row = cs.cs[x].difference_matrix(cs.cs[first])
+                    diff = stack_matrices(node.diff, row).row_space()
+                    shared = shared_components(cs.cs[x], cs.cs[first])
+                    blocks = [b for b in node.blocks if b != (x,)]
+                    blocks[i] = block + (x,)
+                    child = Node(
+                        len(diff),
+                        node.unshared - shared,
+                        next(order),
+                        x,
+                        tuple(blocks),
+                        diff,
+                    )
+                    heapq.heappush(queue, child)
+
+            if self.max_queue is not None and len(queue) > self.max_queue:
+                self.dropped += len(queue) - self.max_queue
+                queue = heapq.nsmallest(self.max_queue, queue)
+
+    def coverage(self) -> Coverage:
+        # Only the number of explored partitions is meaningful, the best-first
+        # order can't be resumed from a rank like the walk over set_partitions.
+        # Pruned partitions mix oracles and can't be attacks, so they count as
+        # explored.
+        return Coverage(0, self.visited + self.pruned, self.total)
+
+
+def test_visits_every_partition_once():
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(5)])
+    search = BestFirstSearch()
+    seen = [tuple(map(tuple, partition)) for partition in search.partitions(cs)]
+    assert len(seen) == len(set(seen)) == 52
+    assert search.coverage().complete
+
+
+def test_prunes_mixed_nonces():
+    cs = Constraints([ConstraintH([i, 1], [1, i], nonce=i % 2) for i in range(5)])
+    search = BestFirstSearch()
+    seen = list(search.partitions(cs))
+    assert all(len({i % 2 for i in block}) == 1 for p in seen for block in p)
+    # Partitions of {0, 2, 4} times partitions of {1, 3}
+    assert len(seen) == 5 * 2
+    assert search.coverage().complete
+
+
+def test_lowest_codimension_first():
+    cs = Constraints(
+        [
+            ConstraintH([1, 0, 0], [0, 1, 0]),
+            ConstraintH([1, 1, 0], [0, 0, 1]),
+            ConstraintH([1, 0, 0], [0, 1, 1]),
+        ]
+    )
+    search = BestFirstSearch()
+    partitions = list(search.partitions(cs))
+    assert partitions[0] == [[0], [1], [2]]
+    # Constraints 0 and 2 only differ in one component
+    assert partitions[1] == [[0, 2], [1]]
+
+
+def test_queue_bound():
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(5)])
+    search = BestFirstSearch(max_queue=3)
+    assert len(list(search.partitions(cs))) < 52
+    assert search.dropped > 0
+    assert not search.coverage().complete
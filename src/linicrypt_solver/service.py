@@ -0,0 +1,522 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Callable
+
+from loguru import logger
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep, Property
+from linicrypt_solver.field import GF
+from linicrypt_solver.ideal_cipher import ConstraintE
+from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints, PartitionWalk, VerdictCache
+
+# A long running solver service. Worker processes are started once and compile
+# the galois kernels on start up, so a job only pays for its own analysis.
+# Clients send JSON-RPC requests, one JSON object per line, over a Unix socket
+# or stdin, and get every attack streamed back as a notification as soon as a
+# worker finds it, followed by the response of the request:
+#
+#   {"jsonrpc": "2.0", "id": 1, "method": "analyze",
+#    "params": {"program": {...}, "properties": ["CR"], "deadline": 10}}
+#   {"jsonrpc": "2.0", "method": "attack",
+#    "params": {"id": 1, "property": "CR", "partition": [[0, 2], [1]]}}
+#   {"jsonrpc": "2.0", "id": 1, "result": {"attacks": 1, "complete": true, ...}}
+#
+# Complete analyses are cached by program and properties and answered without a
+# worker afterwards. Each worker also keeps the collapses and verdicts of the
+# partitions it checked, so a job that was cut short by its deadline, limit or
+# a cancel only checks the partitions it hasn't seen when it is sent again, and
+# one asking for other properties of the same program reuses the collapses.
+# Jobs are cancelled by a "cancel" request or when their client disconnects. At
+# most max_pending jobs are queued or running, a client that submits more is not
+# read from until one of them is done.
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+JOB_FAILED = -32000
+
+
+def program_from_json(data: dict) -> AlgebraicRep:
+    # Either explicit constraints, fixing and output, or a PGV chain
+    if "pgv" in data:
+        f = PGVComporessionFunction(PGVParams(*data["pgv"]))
+        return f.construct_MD(data["n"], data.get("basis", "merkle-damgard"))
+    cs = []
+    for c in data["constraints"]:
+        if "q" in c:
+            cs.append(ConstraintH(c["q"], c["a"], c.get("nonce")))
+        else:
+            cs.append(ConstraintE(c["x"], c["k"], c["y"]))
+    return AlgebraicRep(Constraints(cs), GF(data["fixing"]), GF(data["output"]))
+
+
+def program_to_json(program: AlgebraicRep) -> dict:
+    cs = []
+    for c in program.cs.cs:
+        if isinstance(c, ConstraintH):
+            cs.append({"q": c.q[0].tolist(), "a": c.a[0].tolist(), "nonce": c.nonce})
+        else:
+            cs.append(
+                {"x": c.x[0].tolist(), "k": c.k[0].tolist(), "y": c.y[0].tolist()}
+            )
+    return {
+        "constraints": cs,
+        "fixing": program.fixing.tolist(),
+        "output": program.output.tolist(),
+    }
+
+
+class CancellableWalk(PartitionWalk):
+    # Stops like running out of budget once cancelled() is true
+    def __init__(self, cancelled: Callable[[], bool], **kwargs):
+        super().__init__(**kwargs)
+        self.cancelled = cancelled
+
+    def partitions(self, cs: Constraints):
+        for partition in super().partitions(cs):
+            yield partition
+            if self.cancelled():
+                self.max_partitions = self.visited
+
+
+def run_analysis(
+    params: dict,
+    emit: Callable[[str, list], None],
+    cancelled: Callable[[], bool] = lambda: False,
+    verdicts: VerdictCache | None = None,
+) -> dict:
+    # The analyze method of the service, emit gets each attack as it is found
+    program = program_from_json(params["program"])
+    properties = [Property[p] for p in params.get("properties", ["CR", "SPR"])]
+    deadline = params.get("deadline")
+    walk = CancellableWalk(
+        cancelled,
+        deadline=None if deadline is None else time.monotonic() + deadline,
+        max_partitions=params.get("max_partitions"),
+        progress=False,
+    )
+    limit = params.get("limit")
+    found = 0
+    reused = 0 if verdicts is None else verdicts.hits
+    for prop, attack in program.analyze(properties, walk, verdicts):
+        emit(prop.name, attack.partition)
+        found += 1
+        if limit is not None and found >= limit:
+            break
+    coverage = walk.coverage()
+    return {
+        "attacks": found,
+        "complete": coverage.complete,
+        "cancelled": cancelled(),
+        "coverage": [coverage.start, coverage.stop, coverage.total],
+        "reused": 0 if verdicts is None else verdicts.hits - reused,
+    }
+
+
+def warm_up():
+    # Compiles the field kernels that every analysis needs
+    program = PGVComporessionFunction(PGVParams(0, 0, 1, 0, 0, 1)).construct_MD(2)
+    run_analysis({"program": program_to_json(program)}, lambda *_: None)
+
+
+def worker(index: int, jobs, results, cancel):
+    # Runs jobs until it gets None. cancel holds the id of a job to stop.
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    warm_up()
+    verdicts = VerdictCache()
+    while (job := jobs.get()) is not None:
+        job_id, params = job
+        results.put(("start", job_id, index))
+        try:
+            result = run_analysis(
+                params,
+                lambda prop, partition: results.put(
+                    ("attack", job_id, prop, partition)
+                ),
+                lambda: cancel.value == job_id,
+                verdicts,
+            )
+        # Malformed programs or parameters that got past the checks of the
+        # service, like vectors of different lengths or unknown properties
+        except (KeyError, TypeError, ValueError, IndexError, AssertionError) as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+        else:
+            results.put(("done", job_id, result))
+
+
+class Connection:
+    # Writes the messages for one client in order, waiting for the client to
+    # read them
+    def __init__(self, writer: "asyncio.StreamWriter | StdoutWriter"):
+        self.writer = writer
+        self.outbox: asyncio.Queue[dict] = asyncio.Queue()
+        self.jobs: dict[object, "Job"] = {}
+        self.closed = False
+
+    def send(self, message: dict):
+        if not self.closed:
+            self.outbox.put_nowait({"jsonrpc": "2.0", **message})
+
+    def respond(self, request_id, result: dict):
+        self.send({"id": request_id, "result": result})
+
+    def fail(self, request_id, code: int, message: str):
+        self.send({"id": request_id, "error": {"code": code, "message": message}})
+
+    async def send_loop(self):
+        while True:
+            message = await self.outbox.get()
+            self.writer.write((json.dumps(message) + "\n").encode())
+            await self.writer.drain()
+
+
+@dataclass
+class Job:
+    id: int
+    request_id: object
+    connection: Connection
+    key: str
+    limit: int | None
+    attacks: list[tuple[str, list]] = field(default_factory=list)
+    worker: int | None = None
+    cancelled: bool = False
+
+
+class SolverService:
+    def __init__(self, workers: int = 2, max_pending: int = 64, cache_size: int = 1024):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        # Cache key to the attacks and result of a complete analysis
+        self.cache: OrderedDict[str, tuple[list[tuple[str, list]], dict]] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.running: dict[int, Job] = {}
+        self.ids = count()
+
+    async def start(self):
+        # Forking after galois compiled its kernels can hang the workers
+        context = multiprocessing.get_context("spawn")
+        self.loop = asyncio.get_running_loop()
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.cancel = [context.RawValue("q", -1) for _ in range(self.workers)]
+        self.processes = [
+            context.Process(
+                target=worker,
+                args=(i, self.jobs, self.results, self.cancel[i]),
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+
+    async def close(self):
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            await self.loop.run_in_executor(None, process.join)
+        self.results.put(None)
+        await self.loop.run_in_executor(None, self.reader.join)
+
+    def read_results(self):
+        while (message := self.results.get()) is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, message)
+
+    def dispatch(self, message: tuple):
+        kind, job_id, *rest = message
+        job = self.running.get(job_id)
+        if job is None:
+            return
+        if kind == "start":
+            job.worker = rest[0]
+            if job.cancelled:
+                self.cancel[job.worker].value = job.id
+        elif kind == "attack":
+            prop, partition = rest
+            job.attacks.append((prop, partition))
+            job.connection.send(attack_notification(job.request_id, prop, partition))
+        else:
+            self.running.pop(job_id)
+            job.connection.jobs.pop(job.request_id, None)
+            self.pending.release()
+            if kind == "error":
+                job.connection.fail(job.request_id, JOB_FAILED, rest[0])
+                return
+            result = rest[0]
+            if result["complete"] and job.limit is None:
+                self.cache[job.key] = (job.attacks, result)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            job.connection.respond(job.request_id, {**result, "cached": False})
+
+    def cancel_job(self, job: Job):
+        job.cancelled = True
+        if job.worker is not None:
+            self.cancel[job.worker].value = job.id
+
+    async def serve_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: "asyncio.StreamWriter | StdoutWriter",
+        finish_on_eof: bool = False,
+    ):
+        # The end of the input is a disconnect that cancels the remaining jobs,
+        # unless finish_on_eof, where it only means that no more requests come,
+        # like when stdin is a file of requests
+        connection = Connection(writer)
+        sender = asyncio.create_task(connection.send_loop())
+        try:
+            while line := await reader.readline():
+                await self.handle(connection, line)
+            if finish_on_eof:
+                while connection.jobs:
+                    await asyncio.sleep(0.01)
+                await self.flush(connection)
+        except ConnectionError:
+            pass
+        finally:
+            connection.closed = True
+            for job in connection.jobs.values():
+                self.cancel_job(job)
+            sender.cancel()
+            writer.close()
+
+    async def flush(self, connection: Connection):
+        while not connection.outbox.empty():
+            await asyncio.sleep(0.01)
+        await connection.writer.drain()
+
+    async def handle(self, connection: Connection, line: bytes):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            connection.fail(None, PARSE_ERROR, str(e))
+            return
+        if not isinstance(request, dict) or "method" not in request:
+            connection.fail(None, INVALID_REQUEST, "expected a JSON-RPC request")
+            return
+        request_id = request.get("id")
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            connection.fail(request_id, INVALID_PARAMS, "expected params by name")
+            return
+        method = request["method"]
+        if method == "analyze":
+            await self.analyze(connection, request_id, params)
+        elif method == "cancel":
+            job = connection.jobs.get(params.get("id"))
+            if job is not None:
+                self.cancel_job(job)
+            connection.respond(request_id, {"cancelled": job is not None})
+        elif method == "stats":
+            connection.respond(
+                request_id,
+                {
+                    "workers": self.workers,
+                    "running": len(self.running),
+                    "cached": len(self.cache),
+                    "hits": self.hits,
+                },
+            )
+        else:
+            connection.fail(request_id, METHOD_NOT_FOUND, f"unknown method {method}")
+
+    async def analyze(self, connection: Connection, request_id, params: dict):
+        if "program" not in params:
+            connection.fail(request_id, INVALID_PARAMS, "missing program")
+            return
+        key = json.dumps(
+            [params["program"], sorted(params.get("properties", ["CR", "SPR"]))],
+            sort_keys=True,
+        )
+        limit = params.get("limit")
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            attacks, result = self.cache[key]
+            for prop, partition in attacks[:limit]:
+                connection.send(attack_notification(request_id, prop, partition))
+            answered = len(attacks[:limit])
+            connection.respond(
+                request_id, {**result, "attacks": answered, "cached": True}
+            )
+            return
+        # Stops reading from this client while the service is full
+        await self.pending.acquire()
+        job = Job(next(self.ids), request_id, connection, key, limit)
+        self.running[job.id] = job
+        connection.jobs[request_id] = job
+        self.jobs.put((job.id, params))
+
+
+def attack_notification(request_id, prop: str, partition: list) -> dict:
+    return {
+        "method": "attack",
+        "params": {"id": request_id, "property": prop, "partition": partition},
+    }
+
+
+async def serve_unix(service: SolverService, path: str):
+    await service.start()
+    server = await asyncio.start_unix_server(service.serve_connection, path)
+    async with server:
+        await server.serve_forever()
+
+
+class StdoutWriter:
+    # The parts of asyncio.StreamWriter that Connection uses. stdin and stdout
+    # may be files, which asyncio pipes don't support, so they are used directly.
+    def write(self, data: bytes):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+async def serve_stdio(service: SolverService):
+    await service.start()
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+
+    def read_stdin():
+        for line in sys.stdin.buffer:
+            loop.call_soon_threadsafe(reader.feed_data, line)
+        loop.call_soon_threadsafe(reader.feed_eof)
+
+    threading.Thread(target=read_stdin, daemon=True).start()
+    await service.serve_connection(reader, StdoutWriter(), finish_on_eof=True)
+    await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long running Linicrypt solver")
+    parser.add_argument("--socket", help="Unix socket to listen on, stdio if unset")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+    service = SolverService(args.workers, args.max_pending)
+    if args.socket is None:
+        asyncio.run(serve_stdio(service))
+    else:
+        asyncio.run(serve_unix(service, args.socket))
+
+
+def test_program_json_round_trip():
+    program = PGVComporessionFunction(PGVParams(1, 0, 0, 1, 1, 0)).construct_MD(2)
+    data = json.loads(json.dumps(program_to_json(program)))
+    again = program_from_json(data)
+    assert (again.fixing == program.fixing).all()
+    assert (again.output == program.output).all()
+    assert again.cs.cs == program.cs.cs
+
+
+def test_service_streams_caches_and_cancels(tmp_path):
+    program = {"pgv": [0, 0, 1, 0, 0, 1], "n": 2}
+    expected = [
+        [prop.name, attack.partition]
+        for prop, attack in program_from_json(program).analyze()
+    ]
+    # Large enough that it is still running when it is cancelled
+    slow = {"pgv": [1, 0, 0, 1, 1, 0], "n": 6}
+
+    async def session():
+        service = SolverService(workers=1)
+        await service.start()
+        path = str(tmp_path / "solver.sock")
+        server = await asyncio.start_unix_server(service.serve_connection, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+
+        def send(request_id, method, params):
+            request = {"jsonrpc": "2.0", "id": request_id, "method": method}
+            writer.write((json.dumps({**request, "params": params}) + "\n").encode())
+
+        async def until_response(request_id):
+            attacks = []
+            while True:
+                message = json.loads(await reader.readline())
+                if message.get("method") == "attack":
+                    attacks.append(message["params"])
+                elif message.get("id") == request_id:
+                    return attacks, message["result"]
+
+        send(1, "analyze", {"program": program})
+        first, result = await until_response(1)
+        assert result["complete"] and not result["cached"]
+        send(2, "analyze", {"program": program})
+        second, result = await until_response(2)
+        assert result["cached"]
+
+        send(3, "analyze", {"program": slow, "properties": ["SPR"]})
+        send(4, "cancel", {"id": 3})
+        _, cancelled = await until_response(4)
+        assert cancelled == {"cancelled": True}
+        _, result = await until_response(3)
+        assert result["cancelled"] and not result["complete"]
+
+        writer.close()
+        server.close()
+        await service.close()
+        return first, second
+
+    first, second = asyncio.run(session())
+    assert [[a["property"], a["partition"]] for a in first] == expected
+    assert [[a["property"], a["partition"]] for a in second] == expected
+
+
+def test_workers_reuse_verdicts():
+    program = program_to_json(
+        PGVComporessionFunction(PGVParams(0, 0, 1, 0, 0, 1)).construct_MD(2)
+    )
+    verdicts = VerdictCache()
+    found = []
+    first = run_analysis(
+        {"program": program, "properties": ["CR"], "limit": 1},
+        lambda *attack: found.append(attack),
+        verdicts=verdicts,
+    )
+    assert first["reused"] == 0 and len(found) == 1
+    again = []
+    params = {"program": program, "properties": ["CR"]}
+    second = run_analysis(
+        params, lambda *attack: again.append(attack), verdicts=verdicts
+    )
+    expected = []
+    run_analysis(params, lambda *attack: expected.append(attack))
+    assert second["reused"] > 0 and again == expected
+
+
+def test_invalid_params():
+    # Nothing is written without a send loop, the messages stay in the outbox
+    service = SolverService(workers=1)
+    connection = Connection(StdoutWriter())
+    for params in ([1, 2], "program"):
+        request = {"jsonrpc": "2.0", "id": 1, "method": "cancel", "params": params}
+        asyncio.run(service.handle(connection, json.dumps(request).encode()))
+        message = connection.outbox.get_nowait()
+        assert message["error"]["code"] == INVALID_PARAMS
+
+
+if __name__ == "__main__":
+    main()
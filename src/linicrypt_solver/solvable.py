@@ -1,5 +1,10 @@
-from itertools import pairwise, permutations
-from typing import Iterator
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from functools import cache
+from itertools import islice, pairwise, product
+from typing import Iterable, Iterator
 
 import numpy as np
 from galois import FieldArray
@@ -7,16 +12,452 @@ from loguru import logger
 from more_itertools import set_partitions
 from tqdm import tqdm
 
-from linicrypt_solver import Constraint, DualVector
+from linicrypt_solver import Constraint, DualVector, trace
 from linicrypt_solver.field import GF
 from linicrypt_solver.ideal_cipher import ConstraintE
 from linicrypt_solver.random_oracle import ConstraintH
 from linicrypt_solver.utils import stack_matrices
 
-
 Partition = list[list[int]]
 
 
+# https://codegolf.stackexchange.com/questions/132379/output-the-n-th-bell-number
+# https://en.wikipedia.org/wiki/Partition_of_a_set
+# Memoized, so the values fill a table of r-Bell numbers once instead of
+# recursing exponentially for every progress total
+@cache
+def bell_number(n, k=0):
+    return 1 if n < 1 else k * bell_number(n - 1, k) + bell_number(n - 1, k + 1)
+
+
+class CountingIterator:
+    def __init__(self, it: Iterable):
+        self.it = iter(it)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.it)
+        self.count += 1
+        return item
+
+
+@dataclass
+class Coverage:
+    # The ranks (positions in the order of set_partitions) in [start, stop) were
+    # explored out of total partitions
+    start: int
+    stop: int
+    total: int
+
+    @property
+    def explored(self) -> int:
+        return self.stop - self.start
+
+    @property
+    def fraction(self) -> float:
+        return self.explored / self.total if self.total > 0 else 1.0
+
+    @property
+    def complete(self) -> bool:
+        return self.explored == self.total
+
+    def remaining(self) -> list[tuple[int, int]]:
+        ranges = []
+        if self.start > 0:
+            ranges.append((0, self.start))
+        if self.stop < self.total:
+            ranges.append((self.stop, self.total))
+        return ranges
+
+    def __repr__(self) -> str:
+        return f"explored {self.explored}/{self.total} partitions, remaining {self.remaining()}"
+
+
+class PartitionSource(ABC):
+    # Where the searches get the partitions of the constraints to collapse from
+    @abstractmethod
+    def partitions(self, cs: "Constraints") -> Iterator[Partition]:
+        pass
+
+
+class PartitionWalk(PartitionSource):
+    # Enumerates the partitions of range(n) in the order of set_partitions from
+    # rank start on, until the deadline (a time.monotonic() value) has passed or
+    # max_partitions have been visited. Afterwards coverage() tells which ranks
+    # were explored, and a new walk with start=coverage().stop continues.
+    def __init__(
+        self,
+        deadline: float | None = None,
+        max_partitions: int | None = None,
+        start: int = 0,
+        progress: bool = True,
+    ):
+        self.deadline = deadline
+        self.max_partitions = max_partitions
+        self.start = start
+        self.progress = progress
+        self.visited = 0
+        self.total = 0
+
+    def partitions(self, cs: "Constraints") -> Iterator[Partition]:
+        n = len(cs.cs)
+        self.total = int(bell_number(n)) if n > 0 else 0
+        trace.add_total(self.total - self.start)
+        partitions = islice(set_partitions(range(n)), self.start, None)
+        if self.progress:
+            partitions = tqdm(partitions, total=self.total, initial=self.start)
+        for partition in partitions:
+            if self.max_partitions is not None and self.visited >= self.max_partitions:
+                return
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                return
+            self.visited += 1
+            yield partition
+
+    def coverage(self) -> Coverage:
+        return Coverage(self.start, self.start + self.visited, self.total)
+
+
+class PartitionsTouching(PartitionSource):
+    # Only the partitions of range(n) in which every block with more than one
+    # element contains one of the elements of touching, the others are left as
+    # singletons or merged into such a block
+    def __init__(self, touching: list[int]):
+        assert len(touching) > 0
+        self.touching = touching
+        self.visited = 0
+        self.total = 0
+
+    @staticmethod
+    def count(n: int, touching: list[int]) -> int:
+        rest = n - len(touching)
+        return sum((len(base) + 1) ** rest for base in set_partitions(touching))
+
+    def partitions(self, cs: "Constraints") -> Iterator[Partition]:
+        n = len(cs.cs)
+        rest = [i for i in range(n) if i not in self.touching]
+        bases = list(set_partitions(self.touching))
+        self.total = self.count(n, self.touching)
+        trace.add_total(self.total)
+        for base in bases:
+            for choice in product(range(len(base) + 1), repeat=len(rest)):
+                blocks = [list(block) for block in base]
+                for x, i in zip(rest, choice):
+                    if i == len(base):
+                        blocks.append([x])
+                    else:
+                        blocks[i].append(x)
+                self.visited += 1
+                yield sorted(sorted(block) for block in blocks)
+
+    def coverage(self) -> Coverage:
+        return Coverage(0, self.visited, self.total)
+
+
+class PartitionsAvoiding(PartitionSource):
+    # The partitions of range(n) that PartitionsTouching(touching) leaves out,
+    # those with a block of more than one element that contains none of touching.
+    # Together both sources enumerate every partition exactly once.
+    # Like PartitionsTouching, the elements of touching are partitioned first and
+    # every other element joins a block or starts a new one, but a choice is only
+    # taken if the remaining elements can still make a block without touching of
+    # more than one element, so no branch ends without a partition.
+    def __init__(self, touching: list[int]):
+        assert len(touching) > 0
+        self.touching = touching
+        self.visited = 0
+        self.total = 0
+
+    def partitions(self, cs: "Constraints") -> Iterator[Partition]:
+        n = len(cs.cs)
+        rest = [i for i in range(n) if i not in self.touching]
+        self.total = int(bell_number(n)) - PartitionsTouching.count(n, self.touching)
+        trace.add_total(self.total)
+
+        for base in set_partitions(self.touching):
+            # blocks[:len(base)] contain elements of touching, the others don't
+            blocks = [list(block) for block in base]
+
+            def extend(k: int, found: bool) -> Iterator[Partition]:
+                if k == len(rest):
+                    self.visited += 1
+                    yield sorted(sorted(block) for block in blocks)
+                    return
+                left = len(rest) - k - 1
+                singles = sum(len(b) == 1 for b in blocks[len(base) :])
+                for i, block in enumerate(blocks):
+                    grows = i >= len(base) and len(block) == 1
+                    if not (found or grows or left >= 2 or (left == 1 and singles)):
+                        continue
+                    block.append(rest[k])
+                    yield from extend(k + 1, found or grows)
+                    block.pop()
+                if found or left >= 1:
+                    blocks.append([rest[k]])
+                    yield from extend(k + 1, found)
+                    blocks.pop()
+
+            yield from extend(0, False)
+
+    def coverage(self) -> Coverage:
+        return Coverage(0, self.visited, self.total)
+
+
+class PartitionsSeparating(PartitionSource):
+    # Only the partitions of range(n) in which the elements of apart are all in
+    # different blocks. Every other element in turn joins one of the blocks so
+    # far or starts a new one, so each partition comes up exactly once.
+    def __init__(self, apart: list[int]):
+        self.apart = apart
+        self.visited = 0
+        self.total = 0
+
+    def partitions(self, cs: "Constraints") -> Iterator[Partition]:
+        n = len(cs.cs)
+        rest = [i for i in range(n) if i not in self.apart]
+        self.total = int(bell_number(len(rest), len(self.apart)))
+        trace.add_total(self.total)
+        blocks = [[i] for i in self.apart]
+
+        def extend(k: int) -> Iterator[Partition]:
+            if k == len(rest):
+                self.visited += 1
+                yield sorted(sorted(block) for block in blocks)
+                return
+            for block in blocks:
+                block.append(rest[k])
+                yield from extend(k + 1)
+                block.pop()
+            blocks.append([rest[k]])
+            yield from extend(k + 1)
+            blocks.pop()
+
+        yield from extend(0)
+
+    def coverage(self) -> Coverage:
+        return Coverage(0, self.visited, self.total)
+
+
+@dataclass
+class SolvableStats:
+    partitions: int = 0
+    solvable: int = 0
+    by_blocks: Counter[int] = field(default_factory=Counter)
+    # Canonical (row reduced) bases of the distinct solvable subspaces
+    subspaces: set[tuple[tuple[int, ...], bytes]] = field(default_factory=set)
+
+    def add(self, partition: Partition, subspace: FieldArray):
+        self.solvable += 1
+        self.by_blocks[len(partition)] += 1
+        basis = subspace.transpose().row_space()
+        self.subspaces.add((basis.shape, basis.tobytes()))
+
+    def merge(self, other: "SolvableStats") -> "SolvableStats":
+        return SolvableStats(
+            self.partitions + other.partitions,
+            self.solvable + other.solvable,
+            self.by_blocks + other.by_blocks,
+            self.subspaces | other.subspaces,
+        )
+
+    @property
+    def distinct_subspaces(self) -> int:
+        return len(self.subspaces)
+
+    def __repr__(self) -> str:
+        histogram = dict(sorted(self.by_blocks.items()))
+        return (
+            f"{self.solvable}/{self.partitions} solvable partitions, "
+            f"{self.distinct_subspaces} distinct subspaces, by blocks: {histogram}"
+        )
+
+
+@dataclass
+class Verdict:
+    # Why a partition is or isn't an attack: "mixed nonces", "inside W",
+    # "improper", "unsolvable", "relates fixed values" (see solvable_collapses)
+    # or "solvable", with the collapse subspace once it was computed and the
+    # solution orderings for the fixings that work.
+    # The core of an improper or unsolvable collapse are constraints of it that
+    # are improper or unsolvable on their own, so every collapse that contains
+    # them is no attack either.
+    outcome: str
+    subspace: FieldArray | None = None
+    orderings: list["Constraints"] = field(default_factory=list)
+    core: list[Constraint] = field(default_factory=list)
+
+
+def matrix_key(matrix: FieldArray | None) -> tuple | None:
+    if matrix is None:
+        return None
+    return (matrix.shape, matrix.tobytes())
+
+
+class VerdictCache:
+    # Collapse subspaces and verdicts of partitions, kept across analyses, for
+    # example by the workers of the service. The subspace only depends on the
+    # constraints and the partition, so it is reused for any W and fixings, the
+    # verdict only for the same ones. Beyond max_entries each, the least
+    # recently used entries are dropped.
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.subspaces: OrderedDict[tuple, FieldArray] = OrderedDict()
+        self.verdicts: OrderedDict[tuple, Verdict] = OrderedDict()
+        self.hits = 0
+
+    @staticmethod
+    def system_key(cs: "Constraints") -> tuple:
+        return tuple(
+            (type(c).__name__, c.nonce, matrix_key(c.fixing_matrix())) for c in cs.cs
+        )
+
+    def lookup(self, table: OrderedDict, key: tuple):
+        value = table.get(key)
+        if value is not None:
+            table.move_to_end(key)
+        return value
+
+    def store(self, table: OrderedDict, key: tuple, value):
+        table[key] = value
+        if len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def judge(
+        self,
+        cs: "Constraints",
+        system: tuple,
+        partition: Partition,
+        W: FieldArray | None,
+        fixings: list[FieldArray],
+        dim_W: int | None = None,
+        fixed: list[FieldArray | None] | None = None,
+    ) -> Verdict:
+        # cs.judge, answered from the cache where possible. system is
+        # system_key(cs), which callers compute once per walk.
+        blocks = tuple(tuple(block) for block in partition)
+        key = (
+            system,
+            blocks,
+            matrix_key(W),
+            tuple(map(matrix_key, fixings)),
+            None if fixed is None else tuple(map(matrix_key, fixed)),
+        )
+        verdict = self.lookup(self.verdicts, key)
+        if verdict is not None:
+            self.hits += 1
+            trace.count("verdicts reused")
+            return verdict
+        subspace = self.lookup(self.subspaces, (system, blocks))
+        verdict = cs.judge(partition, W, fixings, subspace, dim_W=dim_W, fixed=fixed)
+        if verdict.subspace is not None:
+            self.store(self.subspaces, (system, blocks), verdict.subspace)
+        self.store(self.verdicts, key, verdict)
+        return verdict
+
+
+class SolvabilityCache:
+    # Whether constraint i of cs is solvable after the constraints in the bitmask
+    # placed, for searches over sets of placed constraints. Solvability only gets
+    # lost as more is placed, so the sets where a constraint was found to be
+    # unsolvable decide all their supersets and the ones where it was found to be
+    # solvable all their subsets. The fixing of a set is only computed once a
+    # check needs it.
+    def __init__(self, cs: "Constraints", fixing: FieldArray):
+        self.cs = cs.cs
+        self.spans = {0: fixing}
+        # A set without its span yet, by the set it extends and what it adds
+        self.parents: dict[int, tuple[int, int]] = {}
+        self.lost: list[list[int]] = [[] for _ in self.cs]
+        self.kept: list[list[int]] = [[] for _ in self.cs]
+
+    def place(self, placed: int, i: int) -> int:
+        after = placed | (1 << i)
+        if after not in self.spans:
+            self.parents.setdefault(after, (placed, i))
+        return after
+
+    def span(self, placed: int) -> FieldArray:
+        if placed not in self.spans:
+            parent, i = self.parents.pop(placed)
+            fixing = self.cs[i].fixing_matrix()
+            self.spans[placed] = stack_matrices(self.span(parent), fixing).row_space()
+        return self.spans[placed]
+
+    def known(self, i: int, placed: int) -> bool | None:
+        if any(placed & mask == mask for mask in self.lost[i]):
+            return False
+        if any(placed & ~mask == 0 for mask in self.kept[i]):
+            return True
+        return None
+
+    def __call__(self, i: int, placed: int) -> bool:
+        known = self.known(i, placed)
+        if known is not None:
+            return known
+        # Only the minimal lost and the maximal kept sets are kept, the others
+        # are decided by them
+        if self.cs[i].is_solvable(self.span(placed)):
+            kept = [mask for mask in self.kept[i] if mask & ~placed != 0]
+            self.kept[i] = kept + [placed]
+            return True
+        lost = [mask for mask in self.lost[i] if mask & placed != placed]
+        self.lost[i] = lost + [placed]
+        return False
+
+    def all(self, rest: list[int], placed: int) -> bool:
+        # Whether all of rest are solvable, trying what is known first
+        if any(self.known(i, placed) is False for i in rest):
+            return False
+        return all(self(i, placed) for i in rest)
+
+
+@dataclass
+class OrderingDag:
+    # All solution orderings of cs at once. The nodes are the sets of constraints
+    # (bitmasks of indices into cs) that a solution ordering can start with, and
+    # nexts[placed] are the constraints that can follow such a prefix so that the
+    # ordering can still be completed. Every path from 0 to the full set is a
+    # solution ordering and every solution ordering is such a path.
+    # before[i] is the bitmask of constraints that must come after i in every
+    # ordering, because fixing one of them on its own already determines i.
+    cs: list[Constraint]
+    nexts: dict[int, list[int]]
+    before: list[int]
+
+    @property
+    def complete(self) -> int:
+        return (1 << len(self.cs)) - 1
+
+    def count(self) -> int:
+        @cache
+        def paths(placed: int) -> int:
+            if placed == self.complete:
+                return 1
+            return sum(paths(placed | (1 << i)) for i in self.nexts[placed])
+
+        return paths(0)
+
+    def orderings(self) -> Iterator["Constraints"]:
+        ordering: list[int] = []
+
+        def extend(placed: int) -> Iterator[Constraints]:
+            if placed == self.complete:
+                yield Constraints([self.cs[i] for i in ordering])
+                return
+            for i in self.nexts[placed]:
+                ordering.append(i)
+                yield from extend(placed | (1 << i))
+                ordering.pop()
+
+        yield from extend(0)
+
+    def must_precede(self, i: int, j: int) -> bool:
+        return bool(self.before[i] & (1 << j))
+
+
 class Constraints:
     def __init__(self, cs: list[Constraint]):
         ordered_set = []
@@ -35,12 +476,15 @@ class Constraints:
         self.cs += other.cs
 
     @staticmethod
-    def from_repr(representation: list[tuple[DualVector, ...]]) -> "Constraints":
+    def from_repr(
+        representation: list[tuple[DualVector, ...]], nonces: list | None = None
+    ) -> "Constraints":
+        # nonces[i] is the nonce of constraint i if that is a random oracle query
         cs = []
-        for c_repr in representation:
+        for i, c_repr in enumerate(representation):
             if len(c_repr) == 2:
                 q, a = c_repr
-                c = ConstraintH(q, a)
+                c = ConstraintH(q, a, None if nonces is None else nonces[i])
             elif len(c_repr) == 3:
                 x, k, y = c_repr
                 c = ConstraintE(x, k, y)
@@ -56,11 +500,32 @@ class Constraints:
         for i, c in enumerate(self.cs):
             if not c.is_proper(self.cs[:i]):
                 logger.debug(
-                    f"Not solution ordering because {c} is not proper with {self.cs[:i]}"
+                    "Not solution ordering because {} is not proper with {}",
+                    c,
+                    self.cs[:i],
                 )
                 return False
         return True
 
+    def is_stuck(self, fixing: FieldArray) -> bool:
+        # None of the constraints is solvable given all the others
+        for i, c in enumerate(self.cs):
+            rest = self.cs[:i] + self.cs[i + 1 :]
+            fixing_rest = GF(
+                np.concatenate([r.fixing_matrix() for r in rest] + [fixing])
+            )
+            if c.is_solvable(fixing_rest):
+                return False
+        return len(self.cs) > 0
+
+    def improper_pair(self) -> list[Constraint]:
+        # Two constraints that make the collapse improper on their own
+        for i, c in enumerate(self.cs):
+            for other in self.cs[:i]:
+                if not c.is_proper([other]):
+                    return [other, c]
+        return []
+
     def is_solution_ordering(self, fixing: FieldArray) -> bool:
         if len(self.cs) == 0:
             return True
@@ -68,22 +533,102 @@ class Constraints:
         assert fixing.shape[1] == dim
         for i, c in enumerate(self.cs):
             if not c.is_solvable(fixing):
-                logger.debug(f"Not solution ordering because of {i}: {c}")
+                logger.debug("Not solution ordering because of {}: {}", i, c)
                 return False
             fixing = stack_matrices(fixing, c.fixing_matrix()).row_space()
         return True
 
     def is_solvable_brute_force(self, fixing: FieldArray) -> bool:
-        logger.debug(f"Checking solvability of:\n{self} fixing:\n{fixing}")
-        for permuted_cs in permutations(self.cs):
-            logger.debug(f"Checking ordering {permuted_cs}")
-            C_permuted = Constraints(list(permuted_cs))
-            if C_permuted.is_solution_ordering(fixing):
-                logger.info(f"Found solution ordering {permuted_cs}")
+        logger.debug("Checking solvability of:\n{} fixing:\n{}", self, fixing)
+        ordering = self.exhaustive_solution_ordering(fixing)
+        if ordering is None:
+            return False
+        logger.info("Found solution ordering {}", ordering)
+        return True
+
+    def exhaustive_solution_ordering(self, fixing: FieldArray) -> "None | Constraints":
+        # The exhaustive reference for find_solution_ordering. Whether a constraint
+        # is solvable after a prefix of an ordering only depends on the set of
+        # constraints in the prefix, not on their order, so this searches prefixes
+        # depth first and remembers the sets (as bitmasks) that can't be completed.
+        # That is at most 2^n states instead of n! orderings. A constraint that
+        # isn't solvable after a prefix isn't after any longer one either, as the
+        # fixing only grows, so such a prefix is given up right away. The checks
+        # that earlier ones decide are skipped, see SolvabilityCache.
+        n = len(self.cs)
+        complete = (1 << n) - 1
+        solvable = SolvabilityCache(self, fixing)
+        dead: set[int] = set()
+        ordering: list[Constraint] = []
+
+        def extend(placed: int) -> bool:
+            if placed == complete:
                 return True
-        return False
+            if placed in dead:
+                return False
+            rest = [i for i in range(n) if not placed & (1 << i)]
+            if not solvable.all(rest, placed):
+                dead.add(placed)
+                return False
+            for i in rest:
+                ordering.append(self.cs[i])
+                if extend(solvable.place(placed, i)):
+                    return True
+                ordering.pop()
+            dead.add(placed)
+            return False
+
+        if not extend(0):
+            return None
+        return Constraints(ordering)
+
+    def solution_ordering_dag(self, fixing: FieldArray) -> "None | OrderingDag":
+        # Like exhaustive_solution_ordering, but keeps going after the first
+        # ordering and records every way to extend each completable prefix
+        n = len(self.cs)
+        complete = (1 << n) - 1
+        solvable = SolvabilityCache(self, fixing)
+        nexts: dict[int, list[int]] = {}
+
+        def live(placed: int) -> bool:
+            if placed == complete:
+                return True
+            if placed in nexts:
+                return len(nexts[placed]) > 0
+            rest = [i for i in range(n) if not placed & (1 << i)]
+            nexts[placed] = []
+            if not solvable.all(rest, placed):
+                return False
+            for i in rest:
+                if live(solvable.place(placed, i)):
+                    nexts[placed].append(i)
+            return len(nexts[placed]) > 0
+
+        if not live(0):
+            return None
+        before = [0] * n
+        for i in range(n):
+            for j in range(n):
+                if i != j and not solvable(i, solvable.place(0, j)):
+                    before[i] |= 1 << j
+        # A completable prefix is only reached through completable ones
+        nexts = {placed: nexts[placed] for placed in nexts if nexts[placed]}
+        return OrderingDag(list(self.cs), nexts, before)
 
     def find_solution_ordering(self, fixing: FieldArray) -> "None | Constraints":
+        ordering, stuck = self.solve_backwards(fixing)
+        if len(stuck) > 0:
+            return None
+        # If nothing is left, ordering is a solution ordering
+        assert Constraints(ordering).is_solution_ordering(fixing)
+        return Constraints(ordering)
+
+    def solve_backwards(
+        self, fixing: FieldArray
+    ) -> tuple[list[Constraint], list[Constraint]]:
+        # The end of a solution ordering, and the constraints that are left when
+        # none of them is solvable given the others. Solvability only gets harder
+        # with more constraints, so any set containing those has no ordering.
         ordering = []
         remaining = self.cs  # we are not modifying remaing, so this is ok
         # We go through self.cs and choose a constraint that is solvable
@@ -103,79 +648,197 @@ class Constraints:
                 fixing_rest = GF(
                     np.concatenate([c.fixing_matrix() for c in rest] + [fixing])
                 )
-                logger.debug(f"c=\n{c}")
-                logger.debug(f"rest=\n{rest}")
-                logger.debug(f"fixing_rest=\n{fixing_rest}")
+                logger.debug("c=\n{}", c)
+                logger.debug("rest=\n{}", rest)
+                logger.debug("fixing_rest=\n{}", fixing_rest)
                 if c.is_solvable(fixing_rest):
-                    logger.debug(f"solving remaining {len(remaining)}: {c} is solvable")
+                    logger.debug(
+                        "solving remaining {}: {} is solvable", len(remaining), c
+                    )
                     ordering = [c] + ordering
                     remaining = rest
                     break
             # here we have found no solvable constraint, so the whole set has to be unsolvable
             else:
-                logger.debug(f"solving remaining {len(remaining)}: nothing is solvable")
-                return None
-
-        # If we completed the while loop, ordering is a solution ordering
-        assert Constraints(ordering).is_solution_ordering(fixing)
-        return Constraints(ordering)
+                logger.debug(
+                    "solving remaining {}: nothing is solvable", len(remaining)
+                )
+                return ordering, remaining
+        return ordering, []
 
     def find_solvable_subspaces(
-        self, fixing: FieldArray | None = None
+        self, fixing: FieldArray | None = None, walk: PartitionSource | None = None
     ) -> Iterator[tuple[Partition, FieldArray]]:
         if fixing is None:
             fixing = GF.Zeros((1, self.dim()))
-        n = len(self.cs)
-
-        # https://codegolf.stackexchange.com/questions/132379/output-the-n-th-bell-number
-        # https://en.wikipedia.org/wiki/Partition_of_a_set
-        def bell_number(n, k=0):
-            return n < 1 or k * bell_number(n - 1, k) + bell_number(n - 1, k + 1)
-
-        # todo len
-        for partition in tqdm(set_partitions(range(n)), total=bell_number(n)):
-            logger.debug(f"collapsing {partition}")
-            collapsed_C, subspace = self.collapse(partition)
-            collapsed_fixing = fixing @ subspace
-            if collapsed_C.is_proper() and collapsed_C.find_solution_ordering(
-                collapsed_fixing
-            ):
-                yield (partition, subspace)
+        if walk is None:
+            walk = PartitionWalk()
+        partitions = walk.partitions(self)
+        for partition, subspace, _ in self.solvable_collapses(
+            partitions, None, [fixing]
+        ):
+            yield (partition, subspace)
 
     def find_solvable_subspaces_outside(
-        self, W: FieldArray, fixing: FieldArray | None = None
+        self,
+        W: FieldArray,
+        fixing: FieldArray | None = None,
+        walk: PartitionSource | None = None,
     ) -> Iterator[tuple[Partition, FieldArray]]:
-        dim_W = len(W.column_space())
-
-        def is_outside_W(subspace):
-            W_plus = stack_matrices(W, subspace, axis=1).column_space()
-            assert len(W_plus) >= dim_W
-            if len(W_plus) > dim_W:
-                logger.debug(f"subspace:\n{subspace} is outside of W:\n{W}")
-                return True
-            else:
-                return False
-
         if fixing is None:
             fixing = GF.Zeros((1, self.dim()))
-        n = len(self.cs)
-
-        # https://codegolf.stackexchange.com/questions/132379/output-the-n-th-bell-number
-        # https://en.wikipedia.org/wiki/Partition_of_a_set
-        def bell_number(n, k=0):
-            return n < 1 or k * bell_number(n - 1, k) + bell_number(n - 1, k + 1)
-
-        # todo len
-        for partition in tqdm(set_partitions(range(n)), total=bell_number(n)):
-            logger.debug(f"collapsing {partition}")
-            collapsed_C, subspace = self.collapse(partition)
-            if not is_outside_W(subspace):
-                continue
-            collapsed_fixing = fixing @ subspace
-            if collapsed_C.is_proper() and collapsed_C.find_solution_ordering(
-                collapsed_fixing
-            ):
-                yield (partition, subspace)
+        for partition, subspace, _ in self.find_solvable_subspaces_outside_each(
+            W, [fixing], walk
+        ):
+            yield (partition, subspace)
+
+    def find_solvable_subspaces_outside_each(
+        self,
+        W: FieldArray,
+        fixings: list[FieldArray],
+        walk: PartitionSource | None = None,
+        verdicts: VerdictCache | None = None,
+        fixed: list[FieldArray | None] | None = None,
+    ) -> Iterator[tuple[Partition, FieldArray, list["Constraints"]]]:
+        if walk is None:
+            walk = PartitionWalk()
+        partitions = walk.partitions(self)
+        yield from self.solvable_collapses(partitions, W, fixings, verdicts, fixed)
+
+    def count_solvable_subspaces(
+        self,
+        fixing: FieldArray | None = None,
+        chunk: tuple[int, int] | None = None,
+    ) -> "SolvableStats":
+        return self.count_solvable_subspaces_outside(None, fixing, chunk)
+
+    def count_solvable_subspaces_outside(
+        self,
+        W: FieldArray | None,
+        fixing: FieldArray | None = None,
+        chunk: tuple[int, int] | None = None,
+        fixed: FieldArray | None = None,
+    ) -> "SolvableStats":
+        # Same walk as find_solvable_subspaces_outside without a progress bar,
+        # only aggregating the solvable collapses. With chunk=(i, k) only every
+        # k-th partition starting at the i-th is visited, so k workers can each
+        # count one chunk and merge their SolvableStats.
+        if fixing is None:
+            fixing = GF.Zeros((1, self.dim()))
+        partitions = set_partitions(range(len(self.cs)))
+        if chunk is not None:
+            i, k = chunk
+            partitions = islice(partitions, i, None, k)
+        stats = SolvableStats()
+        visited = CountingIterator(partitions)
+        collapses = self.solvable_collapses(visited, W, [fixing], fixed=[fixed])
+        for partition, subspace, _ in collapses:
+            stats.add(partition, subspace)
+        stats.partitions = visited.count
+        return stats
+
+    def solvable_collapses(
+        self,
+        partitions: Iterable[Partition],
+        W: FieldArray | None,
+        fixings: list[FieldArray],
+        verdicts: VerdictCache | None = None,
+        fixed: list[FieldArray | None] | None = None,
+    ) -> Iterator[tuple[Partition, FieldArray, list["Constraints"]]]:
+        # Collapses each partition and checks it against several fixings, where
+        # each fixing has to contain the previous one. A collapse that is
+        # unsolvable with some fixing is unsolvable with all later ones, so we
+        # yield the solution orderings for the fixings from the start that work.
+        # With W given, only collapses to subspaces outside of W are considered.
+        # fixed[k] are dual vectors whose values are fixed and random once
+        # fixings[k] is (see JoinedProgram.fixed_values). A collapse that imposes
+        # a linear relation on them, one that lowers their rank, only works with
+        # negligible probability, so it doesn't count for that fixing and the
+        # later ones, which fix more.
+        # With verdicts given, partitions judged before are answered from it.
+        dim_W = None if W is None else len(W.column_space())
+        system = None if verdicts is None else VerdictCache.system_key(self)
+        for partition in partitions:
+            trace.count("partitions visited")
+            if verdicts is None:
+                verdict = self.judge(partition, W, fixings, dim_W=dim_W, fixed=fixed)
+            else:
+                verdict = verdicts.judge(
+                    self, system, partition, W, fixings, dim_W, fixed
+                )
+            trace.count(verdict.outcome)
+            if len(verdict.orderings) > 0:
+                yield (partition, verdict.subspace, verdict.orderings)
+
+    def judge(
+        self,
+        partition: Partition,
+        W: FieldArray | None,
+        fixings: list[FieldArray],
+        subspace: FieldArray | None = None,
+        dim_W: int | None = None,
+        certify: bool = False,
+        core: list[int] | None = None,
+        fixed: list[FieldArray | None] | None = None,
+    ) -> "Verdict":
+        # The checks of solvable_collapses for a single partition. The collapse
+        # subspace can be passed in if it is already known. With certify, an
+        # improper or unsolvable verdict comes with its core. core are indices of
+        # constraints that are likely stuck, tried before the whole greedy.
+        if not self.respects_nonces(partition):
+            return Verdict("mixed nonces")
+        if subspace is None:
+            with trace.phase("collapse"):
+                collapsed_C, subspace = self.collapse(partition)
+        else:
+            collapsed_C = self.map(subspace)
+        if W is not None:
+            with trace.phase("outside W"):
+                if dim_W is None:
+                    dim_W = len(W.column_space())
+                W_plus = stack_matrices(W, subspace, axis=1).column_space()
+                assert len(W_plus) >= dim_W
+            if len(W_plus) == dim_W:
+                return Verdict("inside W", subspace)
+        with trace.phase("properness"):
+            proper = collapsed_C.is_proper()
+        if not proper:
+            core = collapsed_C.improper_pair() if certify else []
+            return Verdict("improper", subspace, core=core)
+        orderings = []
+        stuck = []
+        relates = False
+        with trace.phase("ordering"):
+            if core is not None:
+                candidates = Constraints([self.cs[i].map(subspace) for i in core])
+                if candidates.is_stuck(fixings[0] @ subspace):
+                    return Verdict("unsolvable", subspace, core=candidates.cs)
+            if fixed is None:
+                fixed = [None] * len(fixings)
+            for fixing, values in zip(fixings, fixed):
+                relates = values is not None and len(
+                    (values @ subspace).row_space()
+                ) < len(values)
+                if relates:
+                    break
+                ordering, stuck = collapsed_C.solve_backwards(fixing @ subspace)
+                if len(stuck) > 0:
+                    break
+                assert Constraints(ordering).is_solution_ordering(fixing @ subspace)
+                orderings.append(Constraints(ordering))
+        if len(orderings) == 0 and relates:
+            return Verdict("relates fixed values", subspace)
+        if len(orderings) == 0:
+            return Verdict("unsolvable", subspace, core=stuck)
+        return Verdict("solvable", subspace, orderings)
+
+    def respects_nonces(self, partition: Partition) -> bool:
+        # Queries to oracles with different nonces can never be forced to collide,
+        # and neither can random oracle and ideal cipher queries
+        return all(
+            len({(type(self.cs[i]), self.cs[i].nonce) for i in block}) == 1
+            for block in partition
+        )
 
     def collapse_pair(self, i: int, j: int) -> "Constraints":
         assert i != j
@@ -198,10 +861,10 @@ class Constraints:
             for i, j in pairwise(collapse):
                 diff = stack_matrices(diff, self.cs[i].difference_matrix(self.cs[j]))
 
-        logger.debug(f"diff matrix:\n{diff}")
+        logger.debug("diff matrix:\n{}", diff)
 
         f_matrix = diff.null_space().transpose()
-        logger.debug(f"collapsing space:\n{f_matrix}")
+        logger.debug("collapsing space:\n{}", f_matrix)
         return (self.map(f_matrix), f_matrix)
 
     def map(self, f: FieldArray) -> "Constraints":
@@ -232,3 +895,89 @@ class Constraints:
 
     def embed_right(self, dim: int):
         return Constraints([c.embed_right(dim) for c in self.cs])
+
+
+def test_partitions_touching():
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(4)])
+    source = PartitionsTouching([1, 3])
+    partitions = list(source.partitions(cs))
+    # {1}, {3} apart: 0 and 2 each go to either or stay alone, or {1, 3}
+    assert len(partitions) == 3**2 + 2**2
+    assert [[0], [1], [2], [3]] in partitions
+    assert [[0, 1, 2], [3]] in partitions
+    assert [[0, 2], [1], [3]] not in partitions
+    assert source.coverage().complete
+
+    rest = PartitionsAvoiding([1, 3])
+    others = list(rest.partitions(cs))
+    assert [[0, 2], [1], [3]] in others
+    assert len(others) + len(partitions) == bell_number(4)
+    assert rest.coverage().complete
+
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(7)])
+    for touching in [[0], [2, 5], [1, 3, 6]]:
+        both = list(PartitionsTouching(touching).partitions(cs))
+        both += list(PartitionsAvoiding(touching).partitions(cs))
+        expected = [sorted(sorted(b) for b in p) for p in set_partitions(range(7))]
+        assert sorted(both) == sorted(expected)
+
+
+def test_partitions_separating():
+    cs = Constraints([ConstraintH([i, 1], [1, i]) for i in range(5)])
+    source = PartitionsSeparating([0, 3])
+    partitions = list(source.partitions(cs))
+    expected = [
+        sorted(p)
+        for p in set_partitions(range(5))
+        if not any(0 in block and 3 in block for block in p)
+    ]
+    assert sorted(partitions) == sorted(expected)
+    assert len(partitions) == source.total == bell_number(3, 2)
+    assert source.coverage().complete
+
+
+def test_exhaustive_solution_ordering():
+    from linicrypt_solver.workload import WorkloadParams, generate_programs
+
+    # Ten calls, beyond what trying all orderings could check
+    params = WorkloadParams(h=7, e=3, inputs=2)
+    program = next(generate_programs(params, seed=3))
+    cs = Constraints(program.cs.cs[::-1])
+    ordering = cs.exhaustive_solution_ordering(program.fixing)
+    assert ordering is not None and ordering.is_solution_ordering(program.fixing)
+
+    # With the outputs fixed as well the programs have no ordering
+    params = WorkloadParams(h=4, e=2, inputs=2, inverse=0.5)
+    for program in islice(generate_programs(params, seed=5), 15):
+        cs = Constraints(program.cs.cs[::-1])
+        for fixing in [program.fixing, stack_matrices(program.fixing, program.output)]:
+            found = cs.find_solution_ordering(fixing)
+            assert (found is None) == (cs.exhaustive_solution_ordering(fixing) is None)
+
+    # Each answer is the query of the other
+    cycle = Constraints([ConstraintH([1, 0], [0, 1]), ConstraintH([0, 1], [1, 0])])
+    assert cycle.exhaustive_solution_ordering(GF.Zeros((1, 2))) is None
+    assert cycle.find_solution_ordering(GF.Zeros((1, 2))) is None
+
+
+def test_solution_ordering_dag():
+    # a |-> b, b |-> c and c |-> d with a fixed: the only ordering is the chain
+    def unit(i: int) -> list[int]:
+        return [int(j == i) for j in range(4)]
+
+    chain = Constraints([ConstraintH(unit(i), unit(i + 1)) for i in range(3)])
+    dag = chain.solution_ordering_dag(GF([unit(0)]))
+    assert dag is not None and dag.count() == 1
+    assert [o.cs for o in dag.orderings()] == [chain.cs]
+    assert dag.must_precede(0, 1) and not dag.must_precede(1, 0)
+
+    # Independent calls a |-> b, a |-> c, a |-> d can come in any order
+    fan = Constraints([ConstraintH(unit(0), unit(i), nonce=i) for i in range(1, 4)])
+    dag = fan.solution_ordering_dag(GF([unit(0)]))
+    orderings = list(dag.orderings())
+    assert dag.count() == len(orderings) == 6
+    assert all(o.is_solution_ordering(GF([unit(0)])) for o in orderings)
+    assert dag.before == [0, 0, 0]
+
+    cycle = Constraints([ConstraintH([1, 0], [0, 1]), ConstraintH([0, 1], [1, 0])])
+    assert cycle.solution_ordering_dag(GF.Zeros((1, 2))) is None
@@ -0,0 +1,377 @@
+import json
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from galois import FieldArray
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep, Attack, Property
+from linicrypt_solver.field import GF
+from linicrypt_solver.ideal_cipher import ConstraintE
+from linicrypt_solver.random_oracle import ConstraintH
+from linicrypt_solver.solvable import Constraints, Partition
+from linicrypt_solver.utils import embed_left
+
+# A binary store of programs and their attacks, as a directory of append-only
+# columns. Each column is a flat array of one dtype in a .bin file and the end
+# offsets of its rows in a .offsets file, both memory-mapped for reading, so
+# loading a store reads no data until it is used and a row is a slice of a map.
+#
+# Field elements are one uint8 each, which is what a FieldArray of the field
+# uses, so they are read back as views without copies. Partitions are restricted
+# growth strings (the block of each constraint, blocks numbered in the order of
+# their first constraint). The subspace of an attack is stored as the rows of
+# its reduced row echelon form together with their pivot columns, and the
+# solution ordering in the coordinates of that basis.
+
+FORMAT_VERSION = 1
+
+CONSTRAINT_H = 0
+CONSTRAINT_E = 1
+
+PROGRAM_COLUMNS = {
+    # dim, constraints, rows of the fixing, rows of the output
+    "shape": np.int32,
+    "kinds": np.uint8,
+    "nonces": np.int32,
+    # 3 rows per constraint: q, a, 0 or x, k, y
+    "constraints": np.uint8,
+    "fixing": np.uint8,
+    "output": np.uint8,
+}
+
+ATTACK_COLUMNS = {
+    "program": np.int64,
+    "property": np.uint8,
+    "partition": np.uint8,
+    "pivots": np.uint16,
+    "subspace": np.uint8,
+    "kinds": np.uint8,
+    "nonces": np.int32,
+    "solution": np.uint8,
+}
+
+PROPERTIES = list(Property)
+
+
+def field_id() -> list:
+    return [GF.characteristic, GF.degree, str(GF.irreducible_poly)]
+
+
+def partition_to_rgs(partition: Partition) -> np.ndarray:
+    rgs = np.zeros(sum(len(block) for block in partition), dtype=np.uint8)
+    for b, block in enumerate(sorted(partition, key=min)):
+        rgs[list(block)] = b
+    return rgs
+
+
+def rgs_to_partition(rgs: np.ndarray) -> Partition:
+    blocks: Partition = [[] for _ in range(int(rgs.max()) + 1)] if len(rgs) else []
+    for i, b in enumerate(rgs):
+        blocks[b].append(i)
+    return blocks
+
+
+def reduced_basis(subspace: FieldArray) -> tuple[FieldArray, FieldArray, np.ndarray]:
+    # The rows R of the reduced row echelon form of the columns of subspace, the
+    # matrix M with R = M subspace^T and the pivot column of each row
+    s = subspace.shape[1]
+    augmented = GF(np.concatenate((subspace.transpose(), GF.Identity(s)), axis=1))
+    reduced = augmented.row_reduce()
+    R, M = reduced[:, :-s], reduced[:, -s:]
+    return R, M, (R != 0).argmax(axis=1)
+
+
+class Column:
+    def __init__(self, path: Path, dtype):
+        self.data_path = path.with_suffix(".bin")
+        self.offsets_path = path.with_suffix(".offsets")
+        self.dtype = np.dtype(dtype)
+        if not self.offsets_path.exists():
+            np.zeros(1, dtype=np.int64).tofile(self.offsets_path)
+            self.data_path.touch()
+        self._offsets: np.ndarray | None = None
+        self._data: np.ndarray | None = None
+
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.memmap(self.offsets_path, np.int64, mode="r")
+        return self._offsets
+
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            if self.data_path.stat().st_size == 0:
+                self._data = np.zeros(0, dtype=self.dtype)
+            else:
+                self._data = np.memmap(self.data_path, self.dtype, mode="r")
+        return self._data
+
+    def __len__(self) -> int:
+        return len(self.offsets()) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        offsets = self.offsets()
+        return self.data()[offsets[i] : offsets[i + 1]]
+
+    def extend(self, rows: list[np.ndarray], committed: int):
+        # Appends the rows after the first committed ones. Data past the last
+        # committed offset is left over from an interrupted write and dropped.
+        end = int(self.offsets()[committed])
+        self._offsets = self._data = None
+        with self.data_path.open("r+b") as file:
+            file.truncate(end * self.dtype.itemsize)
+            file.seek(0, 2)
+            for row in rows:
+                file.write(np.ascontiguousarray(row, dtype=self.dtype).tobytes())
+        ends = end + np.cumsum([np.size(row) for row in rows], dtype=np.int64)
+        with self.offsets_path.open("r+b") as file:
+            file.truncate((committed + 1) * 8)
+            file.seek(0, 2)
+            file.write(ends.tobytes())
+
+
+class Table:
+    # Columns with one row per record. A record is only there once all of its
+    # columns are written, so the row count is that of the shortest column.
+    def __init__(self, path: Path, columns: dict[str, type]):
+        path.mkdir(parents=True, exist_ok=True)
+        self.columns = {
+            name: Column(path / name, dtype) for name, dtype in columns.items()
+        }
+
+    def __len__(self) -> int:
+        return min(len(column) for column in self.columns.values())
+
+    def __getitem__(self, name: str) -> Column:
+        return self.columns[name]
+
+    def extend(self, records: list[dict[str, np.ndarray]]):
+        committed = len(self)
+        for name, column in self.columns.items():
+            column.extend([record[name] for record in records], committed)
+
+
+class ResultStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # The field and the nonces, which the constraints refer to by index
+        self.meta_path = self.path / "meta.json"
+        self.nonces: list = []
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            if meta["version"] != FORMAT_VERSION or meta["field"] != field_id():
+                raise ValueError(f"{path} is a store for the field {meta['field']}")
+            # Tuples come back from JSON as lists
+            self.nonces = [
+                tuple(n) if isinstance(n, list) else n for n in meta["nonces"]
+            ]
+        else:
+            self.write_meta()
+        self.programs = Table(self.path / "programs", PROGRAM_COLUMNS)
+        self.attacks = Table(self.path / "attacks", ATTACK_COLUMNS)
+        # The attack rows ordered by program and their programs, see attacks_of
+        self._attack_rows: tuple[np.ndarray, np.ndarray] | None = None
+
+    def write_meta(self):
+        meta = {"version": FORMAT_VERSION, "field": field_id(), "nonces": self.nonces}
+        self.meta_path.write_text(json.dumps(meta))
+
+    def nonce_id(self, nonce: object) -> int:
+        if nonce is None:
+            return -1
+        if nonce not in self.nonces:
+            self.nonces.append(nonce)
+            self.write_meta()
+        return self.nonces.index(nonce)
+
+    def encode_constraints(self, cs: Constraints) -> dict[str, np.ndarray]:
+        kinds, nonces, rows = [], [], []
+        for c in cs.cs:
+            matrix = c.fixing_matrix()
+            kinds.append(CONSTRAINT_H if isinstance(c, ConstraintH) else CONSTRAINT_E)
+            nonces.append(self.nonce_id(c.nonce))
+            rows.append(np.pad(matrix, ((0, 3 - len(matrix)), (0, 0))))
+        return {
+            "kinds": np.array(kinds, dtype=np.uint8),
+            "nonces": np.array(nonces, dtype=np.int32),
+            "rows": np.array(rows, dtype=np.uint8),
+        }
+
+    def decode_constraints(
+        self, kinds: np.ndarray, nonces: np.ndarray, rows: np.ndarray, dim: int
+    ) -> Constraints:
+        rows = rows.reshape(len(kinds), 3, dim).view(GF)
+        cs = []
+        for kind, nonce, (r0, r1, r2) in zip(kinds, nonces, rows):
+            if kind == CONSTRAINT_H:
+                nonce = None if nonce < 0 else self.nonces[nonce]
+                cs.append(ConstraintH(r0[np.newaxis], r1[np.newaxis], nonce))
+            else:
+                cs.append(ConstraintE(r0[np.newaxis], r1[np.newaxis], r2[np.newaxis]))
+        return Constraints(cs)
+
+    def add_programs(self, programs: list[AlgebraicRep]) -> list[int]:
+        start = len(self.programs)
+        records = []
+        for program in programs:
+            encoded = self.encode_constraints(program.cs)
+            shape = (program.dim(), len(program.cs.cs))
+            shape += (len(program.fixing), len(program.output))
+            records.append(
+                {
+                    "shape": np.array(shape, dtype=np.int32),
+                    "kinds": encoded["kinds"],
+                    "nonces": encoded["nonces"],
+                    "constraints": encoded["rows"],
+                    "fixing": program.fixing,
+                    "output": program.output,
+                }
+            )
+        self.programs.extend(records)
+        return list(range(start, start + len(programs)))
+
+    def add_attacks(self, program: int, attacks: list[tuple[Property, Attack]]):
+        records = []
+        for prop, attack in attacks:
+            R, M, pivots = reduced_basis(attack.subspace)
+            # Dual vectors on the subspace in the coordinates of the reduced basis
+            solution = attack.solution.map(M.transpose())
+            encoded = self.encode_constraints(solution)
+            records.append(
+                {
+                    "program": np.array([program]),
+                    "property": np.array([PROPERTIES.index(prop)]),
+                    "partition": partition_to_rgs(attack.partition),
+                    "pivots": pivots,
+                    "subspace": R,
+                    "kinds": encoded["kinds"],
+                    "nonces": encoded["nonces"],
+                    "solution": encoded["rows"],
+                }
+            )
+        self.attacks.extend(records)
+        self._attack_rows = None
+
+    def add_analysis(
+        self, program: AlgebraicRep, attacks: list[tuple[Property, Attack]]
+    ) -> int:
+        (index,) = self.add_programs([program])
+        self.add_attacks(index, attacks)
+        return index
+
+    def program(self, i: int) -> AlgebraicRep:
+        dim = int(self.programs["shape"][i][0])
+        cs = self.decode_constraints(
+            self.programs["kinds"][i],
+            self.programs["nonces"][i],
+            self.programs["constraints"][i],
+            dim,
+        )
+        fixing = self.program_matrix(i, "fixing")
+        output = self.program_matrix(i, "output")
+        return AlgebraicRep(cs, fixing, output)
+
+    def program_matrix(self, i: int, name: str) -> FieldArray:
+        dim = int(self.programs["shape"][i][0])
+        return self.programs[name][i].reshape(-1, dim).view(GF)
+
+    def attack(self, j: int) -> tuple[int, Property, Attack]:
+        # The program of the attack, its property and the attack itself, with
+        # the reduced basis as subspace
+        program = int(self.attacks["program"][j][0])
+        prop = PROPERTIES[self.attacks["property"][j][0]]
+        dim = 2 * int(self.programs["shape"][program][0])
+        pivots = self.attacks["pivots"][j]
+        subspace = self.attacks["subspace"][j].reshape(len(pivots), dim).view(GF)
+        solution = self.decode_constraints(
+            self.attacks["kinds"][j],
+            self.attacks["nonces"][j],
+            self.attacks["solution"][j],
+            len(pivots),
+        )
+        fixing = None
+        if prop == Property.SPR:
+            fixing = embed_left(self.program_matrix(program, "fixing"), dim)
+        partition = rgs_to_partition(self.attacks["partition"][j])
+        return (
+            program,
+            prop,
+            Attack(partition, subspace.transpose(), fixing, solution),
+        )
+
+    def attacks_of(self, program: int) -> Iterator[tuple[Property, Attack]]:
+        # The program column has one entry per attack, so it is the flat data.
+        # It is sorted by program once, after that the attacks of a program are
+        # found by binary search.
+        if self._attack_rows is None:
+            programs = self.attacks["program"].data()[: len(self.attacks)]
+            rows = np.argsort(programs, kind="stable")
+            self._attack_rows = (rows, programs[rows])
+        rows, programs = self._attack_rows
+        start = np.searchsorted(programs, program, side="left")
+        stop = np.searchsorted(programs, program, side="right")
+        for j in rows[start:stop]:
+            _, prop, attack = self.attack(int(j))
+            yield (prop, attack)
+
+
+def test_partition_rgs():
+    partition = [[1, 3], [0], [2, 4]]
+    rgs = partition_to_rgs(partition)
+    assert list(rgs) == [0, 1, 2, 1, 2]
+    assert rgs_to_partition(rgs) == [[0], [1, 3], [2, 4]]
+
+
+def test_store_round_trip(tmp_path):
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    programs = [
+        PGVComporessionFunction(PGVParams(*params)).construct_MD(2)
+        for params in [(0, 0, 1, 0, 0, 1), (1, 0, 0, 1, 1, 0), (0, 0, 0, 1, 0, 1)]
+    ]
+    # P(x, y) = H_1(H_2(x)) + y, with nonces
+    cs = Constraints(
+        [
+            ConstraintH([1, 0, 0, 0], [0, 0, 1, 0], nonce=2),
+            ConstraintH([0, 0, 1, 0], [0, 0, 0, 1], nonce="one"),
+        ]
+    )
+    programs.append(
+        AlgebraicRep(cs, GF([[1, 0, 0, 0], [0, 1, 0, 0]]), GF([[0, 1, 0, 1]]))
+    )
+    analyses = [list(program.analyze()) for program in programs]
+
+    store = ResultStore(tmp_path / "store")
+    store.add_analysis(programs[0], analyses[0])
+    # Reopening continues the store
+    store = ResultStore(tmp_path / "store")
+    for program, attacks in zip(programs[1:], analyses[1:]):
+        store.add_analysis(program, attacks)
+
+    # Opening only reads the metadata
+    written = store.meta_path.stat().st_mtime_ns
+    store = ResultStore(tmp_path / "store")
+    assert store.meta_path.stat().st_mtime_ns == written
+    assert len(store.programs) == len(programs)
+    assert store.nonces == [2, "one"]
+    assert len(store.attacks) == sum(len(a) for a in analyses)
+    for i, (program, attacks) in enumerate(zip(programs, analyses)):
+        loaded = store.program(i)
+        assert loaded.cs.cs == program.cs.cs
+        assert (loaded.fixing == program.fixing).all()
+        assert (loaded.output == program.output).all()
+        stored = list(store.attacks_of(i))
+        assert [p for p, _ in stored] == [p for p, _ in attacks]
+        for (_, attack), (_, original) in zip(stored, attacks):
+            assert attack == original
+            assert (
+                attack.subspace.transpose().row_space()
+                == original.subspace.transpose().row_space()
+            ).all()
+            # The solution is still one in the new basis
+            fixing = GF.Zeros((1, attack.subspace.shape[1]))
+            if attack.fixing is not None:
+                fixing = attack.fixing @ attack.subspace
+                assert (attack.fixing == original.fixing).all()
+            assert attack.solution.is_solution_ordering(fixing)
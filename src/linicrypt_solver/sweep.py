@@ -0,0 +1,203 @@
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import astuple, dataclass
+from itertools import product
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from linicrypt_solver.algebraic_representation import Property
+from linicrypt_solver.field import GF
+from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+# Sweeps over PGV compression functions E(ch + dm, eh + fm) + ah + bm, their
+# chain lengths and properties. Each finished job is appended as one JSON line to
+# a SweepStore, so an interrupted sweep continues where it stopped.
+#
+# Functions that only differ by a change of basis are analysed once. Scaling the
+# message by l and the chaining value by u (and conjugating the cipher with that
+# scaling, which keeps its fixed points) and the key by s maps
+#   (a, b, c, d, e, f) -> (a, b l/u, s u c, s l d, e, f l/u)
+# and every check of the solver is invariant under it. With r = l/u and t = s u
+# that is b, f scaled by r and (c, d) by t and (1, r).
+
+Key = tuple[tuple[int, ...], int, str, str]
+
+
+def multiplication_table() -> np.ndarray:
+    elements = GF.elements
+    return np.asarray(elements[:, np.newaxis] * elements[np.newaxis, :])
+
+
+def canonical_params(params: np.ndarray) -> np.ndarray:
+    # The smallest parameter set (in lexicographic order) equivalent to each row
+    # of params, an integer array of shape (functions, 6)
+    mul = multiplication_table()
+    q = GF.order
+    weights = q ** np.arange(5, -1, -1)
+    a, b, c, d, e, f = params.T
+    best = None
+    for r, t in product(range(1, q), repeat=2):
+        rt = mul[r, t]
+        scaled = np.stack([a, mul[r, b], mul[t, c], mul[rt, d], e, mul[r, f]], 1)
+        codes = scaled @ weights
+        best = codes if best is None else np.minimum(best, codes)
+    return (best[:, np.newaxis] // weights) % q
+
+
+def parameter_sets(coefficients: Iterable[int] | None = None) -> np.ndarray:
+    # All of GF(q)^6 by default
+    if coefficients is None:
+        coefficients = range(GF.order)
+    return np.array(list(product(coefficients, repeat=6)), dtype=np.int64)
+
+
+@dataclass
+class SweepJob:
+    params: PGVParams
+    n: int
+    basis: str
+    prop: Property
+    # How many of the swept parameter sets this one stands for
+    orbit: int = 1
+
+    def key(self) -> Key:
+        return (astuple(self.params), self.n, self.basis, self.prop.name)
+
+
+def run_job(job: SweepJob, deadline: float | None) -> dict:
+    # Runs in a worker, the deadline is in seconds from the start of the job
+    start = time.monotonic()
+    H_n = PGVComporessionFunction(job.params).construct_MD(job.n, job.basis)
+    record = {
+        "params": list(astuple(job.params)),
+        "n": job.n,
+        "basis": job.basis,
+        "property": job.prop.name,
+        "orbit": job.orbit,
+    }
+    if job.prop == Property.CR:
+        budget = None if deadline is None else start + deadline
+        decision = H_n.decide_collision_resistance(deadline=budget)
+        record["resistant"] = decision.is_resistant
+        record["attack"] = decision.partition
+    else:
+        attack = next(H_n.list_second_preimage_attacks(), None)
+        record["resistant"] = attack is None
+        record["attack"] = None if attack is None else attack[0]
+    record["seconds"] = time.monotonic() - start
+    return record
+
+
+class SweepStore:
+    # Results as JSON lines, appended and flushed one job at a time
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def records(self) -> Iterator[dict]:
+        if not self.path.exists():
+            return
+        with self.path.open() as file:
+            for line in file:
+                # A line cut off by an interrupted write is just redone
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+    def done(self) -> set[Key]:
+        return {
+            (tuple(r["params"]), r["n"], r["basis"], r["property"])
+            for r in self.records()
+        }
+
+    def append(self, record: dict):
+        with self.path.open("a+b") as file:
+            # Drop a line cut off by an interrupted write, so the new record
+            # doesn't continue it
+            file.seek(0, 2)
+            if file.tell() > 0:
+                file.seek(-1, 2)
+                if file.read(1) != b"\n":
+                    file.seek(0)
+                    content = file.read()
+                    file.truncate(content.rfind(b"\n") + 1)
+            file.write((json.dumps(record) + "\n").encode())
+            file.flush()
+
+
+def sweep_jobs(
+    params: np.ndarray,
+    lengths: Iterable[int],
+    properties: Iterable[Property] = (Property.CR,),
+    basis: str = "merkle-damgard",
+) -> list[SweepJob]:
+    # One job per class of equivalent parameter sets, chain length and property
+    representatives, orbits = np.unique(
+        canonical_params(params), axis=0, return_counts=True
+    )
+    return [
+        SweepJob(PGVParams(*map(int, p)), n, basis, prop, int(orbit))
+        for p, orbit in zip(representatives, orbits)
+        for n in lengths
+        for prop in properties
+    ]
+
+
+def sweep(
+    store: SweepStore,
+    jobs: list[SweepJob],
+    workers: int,
+    deadline: float | None = None,
+) -> Iterator[dict]:
+    # Runs the jobs that are not in the store yet and streams their records as
+    # they finish, after they are written. deadline bounds the CR enumeration of
+    # each job in seconds, its verdict is None if it runs out.
+    done = store.done()
+    todo = [job for job in jobs if job.key() not in done]
+    # Forking after galois compiled its kernels can hang the workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [pool.submit(run_job, job, deadline) for job in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            store.append(record)
+            yield record
+
+
+def test_canonical_params():
+    params = parameter_sets([0, 1])
+    # Over the bits no scaling but the identity stays inside {0, 1}
+    canonical = canonical_params(params)
+    assert len(np.unique(canonical, axis=0)) == 64
+    # Scaling b, f by 2 and (c, d) by 3 and (1, 2)
+    mul = multiplication_table()
+    p = np.array([[1, 1, 1, 1, 0, 1]])
+    q = np.array([[1, 2, 3, mul[3, 2], 0, 2]])
+    assert (canonical_params(p) == canonical_params(q)).all()
+
+
+def test_sweep_resumes(tmp_path):
+    store = SweepStore(tmp_path / "sweep.jsonl")
+    jobs = sweep_jobs(parameter_sets([0, 1])[:2], [1])
+    first = list(sweep(store, jobs[:1], workers=1))
+    assert len(first) == 1
+    rest = list(sweep(store, jobs, workers=1))
+    assert [r["params"] for r in rest] == [list(astuple(jobs[1].params))]
+    assert len(list(store.records())) == 2
+
+
+def test_sweep_resumes_after_torn_write(tmp_path):
+    def record(params: list[int]) -> dict:
+        return {"params": params, "n": 1, "basis": "b", "property": "CR"}
+
+    store = SweepStore(tmp_path / "sweep.jsonl")
+    store.append(record([0, 0, 0, 0, 0, 1]))
+    with store.path.open("a") as file:
+        file.write('{"params":[0,0')
+    store.append(record([0, 0, 0, 0, 1, 0]))
+    assert store.done() == {
+        ((0, 0, 0, 0, 0, 1), 1, "b", "CR"),
+        ((0, 0, 0, 0, 1, 0), 1, "b", "CR"),
+    }
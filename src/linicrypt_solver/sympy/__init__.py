@@ -1,9 +1,14 @@
 from itertools import product
 from dataclasses import dataclass
 
+import numpy as np
+
 # from sympy import BooleanTrue
 from sympy import symbols, Matrix, Eq, solve, init_printing, Identity, pprint, eye
 
+from linicrypt_solver.field import GF
+from linicrypt_solver.sympy.linear import field_system, solve_linear_batch
+
 init_printing(use_unicode=True)
 
 
@@ -183,50 +188,38 @@ class MerkleDamgard:
         y[0, (i - 1) * 2 : i * 2 + 1] = self.f.y
         return (x, k, y)
 
-    def permute_eqs(self, i: int, j: int, B: Matrix):
+    # Every equation on B is u * B = v for rows u and v. The *_rows methods give
+    # the pairs (u, v), which the field backend solves as a linear system, and
+    # the *_eqs methods the corresponding sympy equations.
+
+    def permute_rows(self, i: int, j: int):
         xi, ki, yi = self.c(i)
         xj, kj, yj = self.c(j)
-        eqs = [
-            Eq(xi * B, xj),
-            Eq(xj * B, xi),
-            Eq(ki * B, kj),
-            Eq(kj * B, ki),
-            Eq(yi * B, yj),
-            Eq(yj * B, yi),
-        ]
-        return eqs
+        return [(xi, xj), (xj, xi), (ki, kj), (kj, ki), (yi, yj), (yj, yi)]
 
-    def collapse_eqs(self, i: int, j: int, B: Matrix):
+    def permute_eqs(self, i: int, j: int, B: Matrix):
+        return [Eq(u * B, v) for u, v in self.permute_rows(i, j)]
+
+    def collapse_rows(self, i: int, j: int):
         xi, ki, yi = self.c(i)
         xj, kj, yj = self.c(j)
-        eqs = [
-            Eq(xi * B, xi),
-            Eq(xj * B, xi),
-            Eq(ki * B, ki),
-            Eq(kj * B, ki),
-            Eq(yi * B, yi),
-            Eq(yj * B, yi),
-        ]
-        return eqs
+        return [(xi, xi), (xj, xi), (ki, ki), (kj, ki), (yi, yi), (yj, yi)]
 
-    def cycle_eqs(self, B: Matrix):
+    def collapse_eqs(self, i: int, j: int, B: Matrix):
+        return [Eq(u * B, v) for u, v in self.collapse_rows(i, j)]
+
+    def cycle_rows(self):
         x1, k1, y1 = self.c(1)
         xn, kn, yn = self.c(self.n)
-        eqs = [
-            Eq(xn * B, x1),
-            Eq(kn * B, k1),
-            Eq(yn * B, y1),
-        ]
+        rows = [(xn, x1), (kn, k1), (yn, y1)]
         for i in range(1, self.n):
             xi, ki, yi = self.c(i)
             xi_1, ki_1, yi_1 = self.c(i + 1)
-            eqs += [
-                Eq(xi * B, xi_1),
-                Eq(ki * B, ki_1),
-                Eq(yi * B, yi_1),
-            ]
+            rows += [(xi, xi_1), (ki, ki_1), (yi, yi_1)]
+        return rows
 
-        return eqs
+    def cycle_eqs(self, B: Matrix):
+        return [Eq(u * B, v) for u, v in self.cycle_rows()]
 
     # This doesnt make sense yet, but there has to be something there...
     # def flip_permute(self, i: int, j: int, B: Matrix):
@@ -242,112 +235,132 @@ class MerkleDamgard:
     #     ]
     #     return eqs
 
+    def output_invariant_rows(self):
+        return [(self.O, self.O)]
+
     def output_invariant(self, B: Matrix):
         return Eq(self.O @ B, self.O)
 
-    def output_h0(self, B: Matrix):
+    def output_h0_rows(self):
         o1 = row_with_one(self.dimension, 0)
         on = row_with_one(self.dimension, self.dimension - 1)
+        return [(on, o1)]
+
+    def output_h0(self, B: Matrix):
+        ((on, o1),) = self.output_h0_rows()
         return Eq(on @ B, o1)
 
-    def iv_invariant(self, B: Matrix):
+    def iv_invariant_rows(self):
         o1 = row_with_one(self.dimension, 0)
+        return [(o1, o1)]
+
+    def iv_invariant(self, B: Matrix):
+        ((o1, _),) = self.iv_invariant_rows()
         return Eq(o1 @ B, o1)
 
 
-def H2_permute_constraints():
+def solve_basis_changes(
+    systems: list[tuple[MerkleDamgard, list]], backend: str = "field"
+) -> list[Matrix | None]:
+    # All B with u * B = v for the row pairs of each system, as a matrix with a
+    # symbol for each free parameter, or None if there is none. The field
+    # backend solves over the field of the solver, all systems at once, sympy
+    # solves symbolically over the rationals one system at a time.
+    if backend == "field":
+        U, V = zip(*(field_system(pairs) for _, pairs in systems))
+        solutions = solve_linear_batch(GF(np.stack(U)), GF(np.stack(V)))
+        return [None if s is None else s.to_sympy("B") for s in solutions]
+    assert backend == "sympy", f"unknown backend {backend}"
+    results = []
+    for H_f, pairs in systems:
+        B = Matrix(H_f.dimension, H_f.dimension, symbols(f"B0:{H_f.dimension ** 2}"))
+        solution = solve([Eq(u * B, v) for u, v in pairs], B)
+        results.append(B.subs(solution) if solution else None)
+    return results
+
+
+def H2_permute_constraints(backend="field"):
     # Iterate over all combinations of a, b, c, d, e, f in {0,1}
     print("Permutation attack c1 <-> c2:")
     print("-----------------------------")
     count = 0
+    systems = []
     for a, b, c, d, e, f in product([0, 1], repeat=6):
         f_compression = PGVComporessionFunction(a, b, c, d, e, f)
         H_f = MerkleDamgard(f_compression, 2)
-
-        B = Matrix(H_f.dimension, H_f.dimension, symbols(f"B0:{H_f.dimension ** 2}"))
-        permute_eqs = H_f.permute_eqs(1, 2, B)
-        out_inv = H_f.output_invariant(B)
-        equations = permute_eqs + [out_inv]
-        solution = solve(equations, B)
-
-        if solution:
-            B_substituted = B.subs(solution)
-            if B_substituted != eye(5):
-                count += 1
-                print(f_compression)
-                pprint(B_substituted)
-                print()
-        else:
-            pass
+        pairs = H_f.permute_rows(1, 2) + H_f.output_invariant_rows()
+        systems.append((H_f, pairs))
+
+    for (H_f, _), B_substituted in zip(systems, solve_basis_changes(systems, backend)):
+        if B_substituted is not None and B_substituted != eye(5):
+            count += 1
+            print(H_f.f)
+            pprint(B_substituted)
+            print()
     print(count)
 
 
-def H2_collapse_constraints(force_collision=True):
+def H2_collapse_constraints(force_collision=True, backend="field"):
     # Iterate over all combinations of a, b, c, d, e, f in {0,1}
     print("Collapse attack c1 <-| c2:")
     print("--------------------------")
     count = 0
+    systems = []
     for a, b, c, d, e, f in product([0, 1], repeat=6):
         f_compression = PGVComporessionFunction(a, b, c, d, e, f)
         H_f = MerkleDamgard(f_compression, 2)
-
-        B = Matrix(H_f.dimension, H_f.dimension, symbols(f"B0:{H_f.dimension ** 2}"))
-        equations = H_f.collapse_eqs(1, 2, B)
+        pairs = H_f.collapse_rows(1, 2)
         if force_collision:
-            equations += [H_f.output_h0(B)]
-        solution = solve(equations, B)
-
-        if solution:
-            B_substituted = B.subs(solution)
-            if B_substituted != eye(5):
-                count += 1
-                print(f_compression)
-                pprint(B_substituted)
-                if (
-                    f_compression.brs_category() == "g"
-                    and f_compression.pgv_category()[0] == "B"
-                ):
-                    pprint(B_substituted.eigenvects())
-                print()
-        else:
-            pass
+            pairs += H_f.output_h0_rows()
+        systems.append((H_f, pairs))
+
+    for (H_f, _), B_substituted in zip(systems, solve_basis_changes(systems, backend)):
+        f_compression = H_f.f
+        if B_substituted is not None and B_substituted != eye(5):
+            count += 1
+            print(f_compression)
+            pprint(B_substituted)
+            # Eigenvectors over the rationals only mean something for sympy
+            if (
+                backend == "sympy"
+                and f_compression.brs_category() == "g"
+                and f_compression.pgv_category()[0] == "B"
+            ):
+                pprint(B_substituted.eigenvects())
+            print()
     print(count)
 
 
-def Hn_cycle_constraints(n=3, force_collision=True):
+def Hn_cycle_constraints(n=3, force_collision=True, backend="field"):
     # Iterate over all combinations of a, b, c, d, e, f in {0,1}
     print("Permutation attack c1 -> c2 -> ... -> cn -> c1:")
     print("-----------------------------------------------")
     count = 0
+    systems = []
     for a, b, c, d, e, f in product([0, 1], repeat=6):
         f_compression = PGVComporessionFunction(a, b, c, d, e, f)
         H_f = MerkleDamgard(f_compression, n)
-
-        B = Matrix(H_f.dimension, H_f.dimension, symbols(f"B0:{H_f.dimension ** 2}"))
-        equations = H_f.cycle_eqs(B)
+        pairs = H_f.cycle_rows()
         if force_collision:
-            out_inv = H_f.output_invariant(B)
-            equations += [out_inv]
-        else:
-            iv_inv = H_f.iv_invariant(B)
-            equations += [iv_inv]
-        solution = solve(equations, B)
-
-        if solution:
-            B_substituted = B.subs(solution)
-            if B_substituted != eye(H_f.dimension):
-                count += 1
-                print(f_compression)
-                pprint(B_substituted)
-                if (
-                    f_compression.brs_category() == "g"
-                    and f_compression.pgv_category()[0] == "B"
-                ):
-                    pprint(B_substituted.eigenvects())
-                    pprint(B_substituted.transpose().eigenvects())
-                print()
+            pairs += H_f.output_invariant_rows()
         else:
-            pass
+            pairs += H_f.iv_invariant_rows()
+        systems.append((H_f, pairs))
+
+    for (H_f, _), B_substituted in zip(systems, solve_basis_changes(systems, backend)):
+        f_compression = H_f.f
+        if B_substituted is not None and B_substituted != eye(H_f.dimension):
+            count += 1
+            print(f_compression)
+            pprint(B_substituted)
+            if (
+                backend == "sympy"
+                and f_compression.brs_category() == "g"
+                and f_compression.pgv_category()[0] == "B"
+            ):
+                pprint(B_substituted.eigenvects())
+                pprint(B_substituted.transpose().eigenvects())
+            print()
     print(count)
 
 
@@ -0,0 +1,166 @@
+from dataclasses import dataclass
+
+import numpy as np
+from galois import FieldArray
+from sympy import Matrix, symbols
+
+from linicrypt_solver.field import GF
+
+# The basis change searches ask for all matrices B with u B = v for a list of
+# row pairs (u, v). Column j of B only appears in column j of the equations, so
+# with U and V the stacked rows this is U B = V: one linear system with d right
+# hand sides. Its solutions are B = B_0 + N T, with B_0 a particular solution,
+# the columns of N a basis of the kernel of U and T arbitrary.
+#
+# Solving happens over the field of the solver, for many systems of the same
+# shape at once, for example one per PGV compression function.
+
+
+@dataclass
+class AffineSolution:
+    particular: FieldArray
+    kernel: FieldArray
+
+    @property
+    def parameters(self) -> int:
+        return self.kernel.shape[1] * self.particular.shape[1]
+
+    def is_unique(self) -> bool:
+        return self.kernel.shape[1] == 0
+
+    def evaluate(self, T: FieldArray) -> FieldArray:
+        return self.particular + self.kernel @ T
+
+    def to_sympy(self, name: str = "t") -> Matrix:
+        # The solutions with one symbol per free parameter, like B.subs(solve(...))
+        # gives them. The coefficients are field elements written as integers.
+        rows, cols = self.kernel.shape[1], self.particular.shape[1]
+        B = Matrix(self.particular.tolist())
+        if rows == 0:
+            return B
+        T = Matrix(rows, cols, symbols(f"{name}0:{rows * cols}"))
+        return B + Matrix(self.kernel.tolist()) * T
+
+
+def batched_row_reduce(
+    A: FieldArray, cols: int | None = None
+) -> tuple[FieldArray, np.ndarray, np.ndarray]:
+    # Reduced row echelon forms of the matrices A[i], with pivots only in the
+    # first cols columns. Returns them with the pivot row of each of those
+    # columns (-1 for free columns) and the ranks.
+    A = A.copy()
+    count, m, width = A.shape
+    if cols is None:
+        cols = width
+    rank = np.zeros(count, dtype=int)
+    pivots = np.full((count, cols), -1)
+    rows = np.arange(m)
+    for col in range(cols):
+        candidates = (A[:, :, col] != 0) & (rows >= rank[:, np.newaxis])
+        has_pivot = candidates.any(axis=1)
+        if not has_pivot.any():
+            continue
+        batch = np.flatnonzero(has_pivot)
+        source = candidates[batch].argmax(axis=1)
+        target = rank[batch]
+        swapped = A[batch, source].copy()
+        A[batch, source] = A[batch, target]
+        pivot_rows = swapped / swapped[:, col : col + 1]
+        A[batch, target] = pivot_rows
+        factors = A[batch, :, col]
+        factors[np.arange(len(batch)), target] = 0
+        A[batch] -= factors[:, :, np.newaxis] * pivot_rows[:, np.newaxis, :]
+        pivots[batch, col] = target
+        rank[batch] += 1
+    return A, pivots, rank
+
+
+def solve_linear_batch(U: FieldArray, V: FieldArray) -> list[AffineSolution | None]:
+    # All solutions X of U[i] X = V[i] for each i, None if there are none
+    count, m, d = U.shape
+    R, pivots, rank = batched_row_reduce(GF(np.concatenate((U, V), axis=2)), d)
+    below_rank = np.arange(m)[np.newaxis, :] >= rank[:, np.newaxis]
+    inconsistent = ((R[:, :, d:] != 0).any(axis=2) & below_rank).any(axis=1)
+
+    solutions: list[AffineSolution | None] = []
+    for i in range(count):
+        if inconsistent[i]:
+            solutions.append(None)
+            continue
+        bound = np.flatnonzero(pivots[i] >= 0)
+        free = np.flatnonzero(pivots[i] < 0)
+        reduced = R[i, pivots[i, bound]]
+        particular = GF.Zeros((d, V.shape[2]))
+        particular[bound] = reduced[:, d:]
+        kernel = GF.Zeros((d, len(free)))
+        kernel[free, np.arange(len(free))] = 1
+        kernel[bound] = -reduced[:, free]
+        solutions.append(AffineSolution(particular, kernel))
+    return solutions
+
+
+def field_system(pairs: list[tuple[Matrix, Matrix]]) -> tuple[FieldArray, FieldArray]:
+    # U and V from row pairs with integer entries, which are taken modulo the
+    # characteristic, like the coefficients of the PGV functions
+    def rows(index: int) -> FieldArray:
+        stacked = np.concatenate(
+            [np.array(p[index].tolist(), dtype=int) for p in pairs]
+        )
+        return GF(stacked % GF.characteristic)
+
+    return rows(0), rows(1)
+
+
+def test_batched_row_reduce():
+    A = GF([[[0, 1, 1], [1, 1, 0], [1, 0, 1]], [[2, 4, 6], [1, 2, 3], [0, 0, 1]]])
+    R, pivots, rank = batched_row_reduce(A)
+    for i in range(len(A)):
+        assert (R[i] == A[i].row_reduce()).all()
+        assert rank[i] == np.linalg.matrix_rank(A[i])
+    assert list(pivots[1]) == [0, -1, 1]
+
+
+def test_solve_linear_batch():
+    rng = np.random.default_rng(0)
+    U = GF(rng.integers(GF.order, size=(20, 4, 5)))
+    U[:, 3] = U[:, 0] + U[:, 1]
+    X = GF(rng.integers(GF.order, size=(20, 5, 5)))
+    V = U @ X
+    # Half of the systems get a right hand side that breaks the dependency
+    V[10:, 3] += GF(1)
+    solutions = solve_linear_batch(U, V)
+    for i, solution in enumerate(solutions):
+        if i >= 10:
+            assert solution is None
+            continue
+        assert solution.kernel.shape[1] == 5 - np.linalg.matrix_rank(U[i])
+        T = GF(rng.integers(GF.order, size=(solution.kernel.shape[1], 5)))
+        assert (U[i] @ solution.evaluate(T) == V[i]).all()
+        assert not (U[i] @ solution.kernel).any()
+
+
+def test_collapse_agrees_with_sympy():
+    from itertools import product
+
+    from sympy import eye
+
+    from linicrypt_solver.sympy import (
+        MerkleDamgard,
+        PGVComporessionFunction,
+        solve_basis_changes,
+    )
+
+    # Collapsing the two calls of H_2 needs no negation, so the rationals and
+    # the field allow a basis change for the same functions
+    systems = []
+    for params in product([0, 1], repeat=6):
+        H_f = MerkleDamgard(PGVComporessionFunction(*params), 2)
+        systems.append((H_f, H_f.collapse_rows(1, 2) + H_f.output_h0_rows()))
+    found = {
+        backend: [
+            B is not None and B != eye(5) for B in solve_basis_changes(systems, backend)
+        ]
+        for backend in ("field", "sympy")
+    }
+    assert found["field"] == found["sympy"]
+    assert sum(found["field"]) == 21
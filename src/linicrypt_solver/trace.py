@@ -0,0 +1,175 @@
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Iterator
+
+from linicrypt_solver.field import GF
+
+# Counters and timers for the hot paths of the solver. Nothing is recorded
+# unless a tracing() block is active: the call sites only look up the module
+# level tracer and find None, and the row reductions of the field are only
+# wrapped while tracing.
+#
+#   with tracing() as tracer:
+#       attacks = list(program.analyze())
+#   tracer.report()   # JSON friendly counters, phases, row reductions, progress
+#   tracer.folded()   # "phase;subphase microseconds" lines for flamegraph.pl
+
+ROW_REDUCTIONS = (
+    "row_reduce",
+    "row_space",
+    "column_space",
+    "null_space",
+    "left_null_space",
+)
+
+
+class Tracer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.counters: Counter[str] = Counter()
+        # Inclusive seconds per stack of phases
+        self.phases: Counter[tuple[str, ...]] = Counter()
+        self.stack: tuple[str, ...] = ()
+        # Calls, seconds and matrix shapes of the outermost row reductions
+        self.reductions: Counter[str] = Counter()
+        self.reduction_seconds: Counter[str] = Counter()
+        self.shapes: Counter[tuple[int, int]] = Counter()
+        self.depth = 0
+        # Partitions that the walks will visit, for the progress
+        self.total = 0
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        outer = self.stack
+        self.stack = outer + (name,)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[self.stack] += time.perf_counter() - start
+            self.stack = outer
+
+    def row_reduction(self, name: str, shape: tuple[int, ...], seconds: float):
+        self.reductions[name] += 1
+        self.reduction_seconds[name] += seconds
+        self.shapes[shape[-2:] if len(shape) > 1 else (1, shape[0])] += 1
+
+    def progress(self) -> dict:
+        visited = self.counters["partitions visited"]
+        done = visited + self.counters["partitions pruned"]
+        elapsed = time.perf_counter() - self.start
+        eta = None
+        if 0 < done <= self.total:
+            eta = elapsed / done * (self.total - done)
+        return {
+            "visited": visited,
+            "pruned": self.counters["partitions pruned"],
+            "total": self.total,
+            "fraction": done / self.total if self.total > 0 else 1.0,
+            "elapsed": elapsed,
+            "eta": eta,
+        }
+
+    def self_times(self) -> dict[tuple[str, ...], float]:
+        times = dict(self.phases)
+        for stack, seconds in self.phases.items():
+            if len(stack) > 1:
+                parent = stack[:-1]
+                times[parent] = times.get(parent, 0.0) - seconds
+        return times
+
+    def folded(self) -> str:
+        lines = [
+            f"{';'.join(stack)} {round(seconds * 1e6)}"
+            for stack, seconds in sorted(self.self_times().items())
+        ]
+        return "\n".join(lines)
+
+    def report(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "phases": {";".join(stack): s for stack, s in sorted(self.phases.items())},
+            "row_reductions": {
+                name: {"calls": calls, "seconds": self.reduction_seconds[name]}
+                for name, calls in self.reductions.items()
+            },
+            "shapes": {f"{r}x{c}": n for (r, c), n in sorted(self.shapes.items())},
+            "progress": self.progress(),
+        }
+
+
+active: Tracer | None = None
+_NO_PHASE = nullcontext()
+
+
+def count(name: str, amount: int = 1):
+    if active is not None:
+        active.count(name, amount)
+
+
+def phase(name: str):
+    return _NO_PHASE if active is None else active.phase(name)
+
+
+def add_total(partitions: int):
+    if active is not None:
+        active.total += partitions
+
+
+def _wrap(tracer: Tracer, name: str, method):
+    # Only the outermost call counts, row_space itself row reduces
+    def traced(self, *args, **kwargs):
+        if tracer.depth > 0:
+            return method(self, *args, **kwargs)
+        tracer.depth += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            tracer.depth -= 1
+            tracer.row_reduction(name, self.shape, time.perf_counter() - start)
+
+    return traced
+
+
+@contextmanager
+def tracing() -> Iterator[Tracer]:
+    global active
+    tracer = Tracer()
+    previous = active
+    own = {name: GF.__dict__.get(name) for name in ROW_REDUCTIONS}
+    for name in ROW_REDUCTIONS:
+        setattr(GF, name, _wrap(tracer, name, getattr(GF, name)))
+    active = tracer
+    try:
+        yield tracer
+    finally:
+        active = previous
+        for name, method in own.items():
+            if method is None:
+                delattr(GF, name)
+            else:
+                setattr(GF, name, method)
+
+
+def test_tracing_an_analysis():
+    from linicrypt_solver.merkle_damgard import PGVComporessionFunction, PGVParams
+
+    H_2 = PGVComporessionFunction(PGVParams(0, 0, 1, 0, 0, 1)).construct_MD(2)
+    with tracing() as tracer:
+        attacks = list(H_2.analyze())
+    report = tracer.report()
+    assert report["progress"]["visited"] == report["progress"]["total"] == 15
+    assert report["counters"]["solvable"] == len({str(a.partition) for _, a in attacks})
+    assert report["row_reductions"]["null_space"]["calls"] >= 15
+    assert "collapse" in report["phases"]
+    assert all(
+        int(line.rsplit(" ", 1)[1]) >= 0 for line in tracer.folded().splitlines()
+    )
+    # Nothing is recorded and the field is restored afterwards
+    assert active is None
+    assert "row_space" not in GF.__dict__
@@ -0,0 +1,226 @@
+import argparse
+import json
+import random
+import sys
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterator
+
+from linicrypt_solver.algebraic_representation import AlgebraicRep
+from linicrypt_solver.field import GF
+from linicrypt_solver.service import program_to_json
+from linicrypt_solver.solvable import Constraints
+
+# Random Linicrypt programs for scaling and stress tests, larger and more varied
+# than the PGV chains.
+#
+# The first `inputs` base variables are the inputs of a program and every call
+# answers with a fresh one, so the dimension is inputs + h + e and the calls in
+# the order they are generated are a solution ordering. The queries are random
+# combinations of the variables known at that point, each coefficient nonzero
+# with probability `density`. With chain="md" every query only combines the
+# inputs and takes the previous answer as chaining value, like the Merkle-Damgard
+# chains (for ideal cipher calls the plaintext, so decryptions aren't chained).
+#
+# Program i of a seed only depends on the seed, i and the parameters, so the
+# programs can be streamed or regenerated one at a time:
+#
+#   python -m linicrypt_solver.workload --count 1000000 --h 6 > programs.jsonl
+#   linicrypt_solver programs.jsonl --workers 8
+
+
+@dataclass
+class WorkloadParams:
+    # Random oracle and ideal cipher calls
+    h: int = 3
+    e: int = 0
+    inputs: int = 2
+    density: float = 0.5
+    # Number of distinct nonces of the random oracle calls, 0 for no nonces
+    nonces: int = 0
+    # Fraction of the ideal cipher calls that decrypt
+    inverse: float = 0.0
+    # "random" or "md"
+    chain: str = "random"
+    outputs: int = 1
+
+    def dim(self) -> int:
+        return self.inputs + self.h + self.e
+
+
+def sparse_vector(
+    dim: int, support: list[int], density: float, rng: random.Random
+) -> list[int]:
+    # A vector with random nonzero coefficients at some of support, at least one
+    vector = [0] * dim
+    for i in support:
+        if rng.random() < density:
+            vector[i] = rng.randrange(1, GF.order)
+    if not any(vector):
+        vector[rng.choice(support)] = rng.randrange(1, GF.order)
+    return vector
+
+
+def generate(params: WorkloadParams, rng: random.Random) -> AlgebraicRep:
+    assert params.inputs > 0 and params.h + params.e > 0
+    assert params.chain in ("random", "md"), f"unknown chain {params.chain}"
+    dim = params.dim()
+    inputs = list(range(params.inputs))
+
+    def unit(i: int) -> list[int]:
+        return [int(j == i) for j in range(dim)]
+
+    kinds = ["H"] * params.h + ["E"] * params.e
+    rng.shuffle(kinds)
+    representation = []
+    nonces = []
+    # The queries so far, ("H", nonce, q) for the random oracle and ("x", k, x),
+    # ("y", k, y) for the ideal cipher. A query that repeats one of them is drawn
+    # again, otherwise the program isn't proper.
+    queries = set()
+    previous = None
+    for i, kind in enumerate(kinds):
+        answer = params.inputs + i
+        known = inputs if params.chain == "md" else list(range(answer))
+        nonce = rng.randrange(params.nonces) if kind == "H" and params.nonces else None
+        inverse = kind == "E" and rng.random() < params.inverse
+        while True:
+            vectors = [
+                sparse_vector(dim, known, params.density, rng)
+                for _ in range(1 if kind == "H" else 2)
+            ]
+            if params.chain == "md" and previous is not None:
+                vectors[0][previous] = 1
+            if kind == "H":
+                query = ("H", nonce, tuple(vectors[0]))
+            else:
+                query = ("y" if inverse else "x", tuple(vectors[1]), tuple(vectors[0]))
+            if query not in queries:
+                break
+        if kind == "H":
+            representation.append((vectors[0], unit(answer)))
+            queries.add(query)
+        elif inverse:
+            # x = D(k, y)
+            representation.append((unit(answer), vectors[1], vectors[0]))
+            queries.add(query)
+            queries.add(("x", tuple(vectors[1]), tuple(unit(answer))))
+        else:
+            representation.append((vectors[0], vectors[1], unit(answer)))
+            queries.add(query)
+            queries.add(("y", tuple(vectors[1]), tuple(unit(answer))))
+        nonces.append(nonce)
+        previous = answer
+
+    fixing = [unit(i) for i in inputs]
+    # Every output depends on the last answer, otherwise there are trivial
+    # collisions in the inputs that the output ignores
+    output = []
+    for _ in range(params.outputs):
+        row = sparse_vector(dim, list(range(dim)), params.density, rng)
+        row[dim - 1] = row[dim - 1] or rng.randrange(1, GF.order)
+        output.append(row)
+    cs = Constraints.from_repr(representation, nonces)
+    return AlgebraicRep(cs, GF(fixing), GF(output))
+
+
+def program_rng(seed: int, index: int) -> random.Random:
+    return random.Random(f"{seed}/{index}")
+
+
+def generate_programs(
+    params: WorkloadParams, seed: int = 0, start: int = 0
+) -> Iterator[AlgebraicRep]:
+    # The programs start, start + 1, ... of the seed, without end
+    index = start
+    while True:
+        yield generate(params, program_rng(seed, index))
+        index += 1
+
+
+def write_jsonl(
+    params: WorkloadParams, count: int, seed: int = 0, file=sys.stdout
+) -> None:
+    # In the input format of the linicrypt_solver command
+    programs = islice(generate_programs(params, seed), count)
+    for index, program in enumerate(programs):
+        data = {**program_to_json(program), "field": GF.order}
+        file.write(json.dumps({"id": f"{seed}/{index}", **data}) + "\n")
+
+
+def main(argv: list[str] | None = None):
+    defaults = WorkloadParams()
+    parser = argparse.ArgumentParser(
+        prog="linicrypt_solver.workload",
+        description="Write random Linicrypt programs as JSON lines",
+    )
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--h", type=int, default=defaults.h)
+    parser.add_argument("--e", type=int, default=defaults.e)
+    parser.add_argument("--inputs", type=int, default=defaults.inputs)
+    parser.add_argument("--density", type=float, default=defaults.density)
+    parser.add_argument("--nonces", type=int, default=defaults.nonces)
+    parser.add_argument("--inverse", type=float, default=defaults.inverse)
+    parser.add_argument("--chain", choices=["random", "md"], default=defaults.chain)
+    parser.add_argument("--outputs", type=int, default=defaults.outputs)
+    parser.add_argument("--store", help="add them to a ResultStore instead")
+    args = parser.parse_args(argv)
+
+    params = WorkloadParams(
+        args.h,
+        args.e,
+        args.inputs,
+        args.density,
+        args.nonces,
+        args.inverse,
+        args.chain,
+        args.outputs,
+    )
+    if args.store is None:
+        write_jsonl(params, args.count, args.seed)
+        return
+
+    from linicrypt_solver.store import ResultStore
+
+    store = ResultStore(args.store)
+    programs = islice(generate_programs(params, args.seed), args.count)
+    while batch := list(islice(programs, 10_000)):
+        store.add_programs(batch)
+
+
+def test_programs_are_well_formed():
+    from linicrypt_solver.random_oracle import ConstraintH
+
+    params = WorkloadParams(h=4, e=3, inputs=3, nonces=2, inverse=0.5, outputs=2)
+    for program in islice(generate_programs(params, seed=1), 20):
+        assert program.dim() == 10 and len(program.cs.cs) == 7
+        assert program.cs.is_solution_ordering(program.fixing)
+        assert program.cs.is_proper()
+        assert program.output.shape == (2, 10) and program.output[:, -1].all()
+        assert {c.nonce for c in program.cs.cs if isinstance(c, ConstraintH)} <= {0, 1}
+
+
+def test_md_chains_take_the_previous_answer():
+    params = WorkloadParams(h=5, inputs=2, chain="md", density=1.0)
+    program = generate(params, program_rng(0, 0))
+    for i, c in enumerate(program.cs.cs[1:]):
+        assert c.q[0, 2 + i] == 1
+        assert not c.q[0, 3 + i :].any()
+
+
+def test_generation_is_deterministic():
+    from linicrypt_solver.service import program_from_json
+
+    params = WorkloadParams(h=3, e=1, nonces=3)
+    first = [program_to_json(p) for p in islice(generate_programs(params, 7), 5)]
+    again = [program_to_json(p) for p in islice(generate_programs(params, 7, 2), 3)]
+    assert first[2:] == again
+    assert first != [
+        program_to_json(p) for p in islice(generate_programs(params, 8), 5)
+    ]
+    assert program_to_json(program_from_json(first[0])) == first[0]
+
+
+if __name__ == "__main__":
+    main()